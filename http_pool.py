@@ -0,0 +1,150 @@
+"""
+AKShare上游请求的共享长连接池
+
+所有线程共用同一个HTTPAdapter（连接池），每个线程使用各自的requests.Session，
+Cookie等会话状态不在Streamlit会话、API线程和后台加载线程之间共享。只替换AKShare
+模块中的requests引用，进程内其他代码的requests调用不受影响
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+# 上游HTTP连接池配置，可通过环境变量调整
+HTTP_POOL_SIZE = int(os.environ.get("STOCK_ANALYZER_HTTP_POOL_SIZE", "16"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("STOCK_ANALYZER_HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.environ.get("STOCK_ANALYZER_HTTP_READ_TIMEOUT", "20"))
+
+
+class PooledSession:
+    """
+    保持长连接的共享HTTP连接池
+
+    同一主机的请求复用连接池中的连接，避免每次请求都重新建立TCP和TLS连接；
+    调用方未指定超时时间时使用默认超时，并记录请求数和耗时用于统计
+    """
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)):
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.default_timeout = timeout
+        self.request_count = 0
+        self.error_count = 0
+        self.total_latency = 0.0
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _thread_session(self):
+        """当前线程的会话，挂载共享的连接池"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", self.adapter)
+            session.mount("https://", self.adapter)
+            self._local.session = session
+        return session
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.default_timeout
+        start = time.perf_counter()
+        try:
+            return self._thread_session().request(method, url, **kwargs)
+        except requests.RequestException:
+            with self._stats_lock:
+                self.error_count += 1
+            raise
+        finally:
+            with self._stats_lock:
+                self.request_count += 1
+                self.total_latency += time.perf_counter() - start
+
+    def get(self, url, params=None, **kwargs):
+        return self.request("GET", url, params=params, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request("POST", url, data=data, json=json, **kwargs)
+
+
+class PooledRequestsModule:
+    """替代AKShare模块中的requests引用：请求函数经过共享连接池，其余属性仍取自requests"""
+
+    def __init__(self, session):
+        self._session = session
+
+    def request(self, method, url, **kwargs):
+        return self._session.request(method, url, **kwargs)
+
+    def get(self, url, params=None, **kwargs):
+        return self._session.get(url, params=params, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self._session.post(url, data=data, json=json, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
+def install_pooled_session(session, package="akshare"):
+    """
+    让AKShare发起的请求使用共享连接池
+
+    AKShare的各个模块通过模块级的requests.get等函数发起请求，这里只替换这些模块中的
+    requests引用，不修改requests模块本身
+
+    参数:
+        session: PooledSession对象
+        package: 需要替换的包名
+
+    返回:
+        替换了requests引用的模块数量
+    """
+    proxy = PooledRequestsModule(session)
+    patched = 0
+    for name, module in list(sys.modules.items()):
+        if name != package and not name.startswith(package + "."):
+            continue
+        if getattr(module, "requests", None) is requests:
+            module.requests = proxy
+            patched += 1
+    return patched
+
+
+def http_pool_stats(session):
+    """
+    统计共享连接池的连接复用情况
+
+    参数:
+        session: PooledSession对象
+
+    返回:
+        (汇总统计字典, 按主机统计的DataFrame)
+    """
+    rows = []
+    pools = session.adapter.poolmanager.pools
+    for key in list(pools.keys()):
+        pool = pools.get(key)
+        if pool is None:
+            continue
+        rows.append({
+            "主机": f"{pool.scheme}://{pool.host}:{pool.port}",
+            "请求数": pool.num_requests,
+            "新建连接数": pool.num_connections,
+            "空闲连接数": pool.pool.qsize() if pool.pool is not None else 0,
+        })
+    hosts_df = pd.DataFrame(rows, columns=["主机", "请求数", "新建连接数", "空闲连接数"])
+
+    total_requests = int(hosts_df["请求数"].sum())
+    total_connections = int(hosts_df["新建连接数"].sum())
+    summary = {
+        "请求数": session.request_count,
+        "失败数": session.error_count,
+        "新建连接数": total_connections,
+        "连接复用率": 1 - total_connections / total_requests if total_requests else 0.0,
+        "平均耗时(ms)": 1000 * session.total_latency / session.request_count if session.request_count else 0.0,
+    }
+    return summary, hosts_df
@@ -0,0 +1,441 @@
+"""
+股票行业与概念分析应用的并发会话压测工具
+
+使用Streamlit的AppTest在同一进程内无界面地驱动 stock_analyzer.py，模拟N个同时进行
+分析的会话，统计各并发数下的吞吐量、p50/p95/p99延迟以及每个会话的内存占用，
+用于估算单个服务进程能承载的分析人员数量。
+
+上游数据通过回放提供：先用 record 子命令录制一次真实的AKShare响应，之后的压测都从
+录制文件中回放，不访问网络，结果可重复。
+
+用法:
+    python load_test.py record --codes "600519 000001 300750" --output replay.pkl.gz
+    python load_test.py run --replay replay.pkl.gz --sessions 1,2,4,8 --iterations 3
+"""
+
+import argparse
+import gc
+import gzip
+import os
+import pickle
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import types
+from unittest.mock import MagicMock
+
+import numpy as np
+import pandas as pd
+import streamlit
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stock_analyzer.py")
+
+# 应用使用到的AKShare接口，录制和回放只针对这些接口
+AKSHARE_FUNCTIONS = (
+    "stock_info_a_code_name",
+    "stock_board_industry_name_em",
+    "stock_board_concept_name_em",
+    "stock_board_industry_cons_em",
+    "stock_board_concept_cons_em",
+    "stock_individual_info_em",
+    "tool_trade_date_hist_sina",
+    "sw_index_first_info",
+    "index_component_sw",
+    "stock_sector_spot",
+    "stock_sector_detail",
+)
+
+# 每次分析后依次操作的分布下拉框
+DISTRIBUTION_BOXES = ("selected_industry_box", "selected_concept_box")
+
+# install_shared_runtime 依赖Streamlit的内部实现，只在这个版本上验证过
+SUPPORTED_STREAMLIT_VERSION = "1.32.0"
+
+
+def _call_key(name, args, kwargs):
+    """将一次接口调用转换为可哈希的回放键"""
+    return (name, tuple(args), tuple(sorted(kwargs.items())))
+
+
+class RecordingAkshare(types.ModuleType):
+    """包装真实的akshare模块，记录应用发起的每一次接口调用及其响应"""
+
+    def __init__(self, real_module):
+        super().__init__("akshare")
+        self._real = real_module
+        self.responses = {}
+
+    def __getattr__(self, name):
+        func = getattr(self._real, name)
+        if name not in AKSHARE_FUNCTIONS:
+            return func
+
+        def recorder(*args, **kwargs):
+            key = _call_key(name, args, kwargs)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                # 异常也一并录制，回放时以同样的信息抛出
+                self.responses[key] = RuntimeError(str(e))
+                raise
+            self.responses[key] = result.copy() if isinstance(result, pd.DataFrame) else result
+            return result
+
+        return recorder
+
+
+class ReplayAkshare(types.ModuleType):
+    """从录制文件回放AKShare响应，可选地为每次调用模拟上游延迟"""
+
+    def __init__(self, responses, upstream_latency=0.0):
+        super().__init__("akshare")
+        self.responses = responses
+        self.upstream_latency = upstream_latency
+        self.call_count = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name not in AKSHARE_FUNCTIONS:
+            raise AttributeError(f"回放数据不支持接口 {name}")
+
+        def replay(*args, **kwargs):
+            with self._lock:
+                self.call_count += 1
+            if self.upstream_latency:
+                time.sleep(self.upstream_latency)
+            key = _call_key(name, args, kwargs)
+            if key not in self.responses:
+                raise KeyError(f"回放数据中没有 {name}{args} 的响应，请重新录制")
+            result = self.responses[key]
+            if isinstance(result, Exception):
+                raise result
+            # 应用可能会修改返回的DataFrame，每次都返回副本
+            return result.copy() if isinstance(result, pd.DataFrame) else result
+
+        return replay
+
+    def universe(self):
+        """返回录制数据中的全部股票代码，用于生成模拟组合"""
+        stock_info = self.responses.get(_call_key("stock_info_a_code_name", (), {}))
+        if not isinstance(stock_info, pd.DataFrame) or stock_info.empty:
+            raise ValueError("回放数据中没有股票列表，请重新录制")
+        return stock_info["code"].astype(str).tolist()
+
+
+def pin_choice_widgets(at, skip=()):
+    """
+    AppTest 1.32 重新提交带 format_func 的下拉框和单选框时，会用原始值去匹配格式化后的
+    选项而抛出 ValueError。运行前把未操作的下拉框和单选框按选项文本设为当前下标
+    （proto.default）对应的选项，提交的下标与页面上的选择一致，应用收到的仍是原始值
+
+    参数:
+    at: AppTest实例
+    skip: 本次运行中已经操作过的控件key，保持其选择不变
+    """
+    for widget in list(at.selectbox) + list(at.radio):
+        if widget.key in skip or not widget.options:
+            continue
+        widget.set_value(widget.options[widget.proto.default])
+
+
+def install_shared_runtime():
+    """
+    AppTest 每次运行都会替换全局的 Runtime 实例并在结束时将其清空，并且每次都重新编译
+    脚本，多个会话并发运行时会互相破坏（Python 3.11 并发 compile 还会报 AST 递归深度错误）。
+    压测时改为所有会话共用一个模拟运行时和脚本缓存，与真实服务中各会话共享同一个运行时
+    的情况一致。AppTest 的公开接口无法做到这一点，只能替换内部对象，因此只支持
+    SUPPORTED_STREAMLIT_VERSION，其他版本直接报错，不会悄悄得到错误的压测结果
+    """
+    if streamlit.__version__ != SUPPORTED_STREAMLIT_VERSION:
+        raise RuntimeError(
+            f"并发压测只支持 Streamlit {SUPPORTED_STREAMLIT_VERSION}，当前版本为 {streamlit.__version__}；"
+            f"升级后请先核对 install_shared_runtime 替换的内部对象"
+        )
+
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test
+    from streamlit.testing.v1 import local_script_runner
+
+    shared_runtime = MagicMock(spec=Runtime)
+    shared_runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    shared_runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = shared_runtime
+    # AppTest 对 Runtime._instance 的赋值落到这个占位对象上，不再影响共享的运行时
+    app_test.Runtime = types.SimpleNamespace(_instance=None)
+    shared_script_cache = ScriptCache()
+    local_script_runner.ScriptCache = lambda: shared_script_cache
+
+
+def configure_environment():
+    """隔离压测进程的环境：不启动API、不共享快照文件，历史快照写入临时目录"""
+    os.environ.setdefault("STOCK_ANALYZER_API_PORT", "0")
+    os.environ.setdefault("STOCK_ANALYZER_SHARED_SNAPSHOT", "")
+    os.environ.setdefault("STOCK_ANALYZER_HISTORY_DIR", tempfile.mkdtemp(prefix="stock_analyzer_history_"))
+
+
+def current_rss():
+    """返回当前进程的常驻内存（字节），非Linux系统退回到峰值常驻内存"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # macOS 上 ru_maxrss 的单位是字节，Linux 上是KB
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class MemorySampler(threading.Thread):
+    """在压测期间周期性采样常驻内存，记录峰值"""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.peak = max(self.peak, current_rss())
+        return self.peak
+
+
+def _app_failures(at):
+    """返回本次运行中出现的异常和错误提示"""
+    failures = [e.value for e in at.exception] + [e.value for e in at.error]
+    # 脚本编译失败时AppTest不会产生异常元素，只会得到空页面
+    if not at.main.children:
+        failures.append("脚本未渲染任何内容")
+    return failures
+
+
+def _timed_run(at, operation, samples, errors):
+    """执行一次脚本运行并记录耗时，失败时记录错误信息"""
+    start = time.perf_counter()
+    try:
+        at.run()
+    except Exception as e:
+        errors.append((operation, str(e)))
+        return False
+    samples.append((operation, time.perf_counter() - start))
+    failures = _app_failures(at)
+    if failures:
+        errors.append((operation, failures[0]))
+        return False
+    return True
+
+
+def run_session(portfolios, samples, errors, sessions, timeout):
+    """
+    模拟一个会话：打开页面，依次分析每个组合，并在每次分析后操作行业和概念下拉框
+
+    参数:
+    portfolios: 本会话依次分析的股票代码列表
+    samples: 收集 (操作, 耗时) 的列表
+    errors: 收集 (操作, 错误信息) 的列表
+    sessions: 保存AppTest实例的列表，在统计内存前保持会话存活
+    timeout: 单次脚本运行的超时秒数
+    """
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    sessions.append(at)
+    if not _timed_run(at, "打开页面", samples, errors):
+        return
+
+    for codes in portfolios:
+        at.text_area(key="stock_input").input(" ".join(codes))
+        at.button(key="analyze_button").click()
+        pin_choice_widgets(at)
+        if not _timed_run(at, "分析", samples, errors):
+            return
+
+        for box_key in DISTRIBUTION_BOXES:
+            boxes = [box for box in at.selectbox if box.key == box_key]
+            if not boxes or len(boxes[0].options) < 2:
+                continue
+            boxes[0].select_index(1)
+            pin_choice_widgets(at, skip={box_key})
+            if not _timed_run(at, "切换分布", samples, errors):
+                return
+
+
+def run_level(session_count, universe, args, rng):
+    """
+    同时运行 session_count 个会话并汇总延迟、吞吐量和内存
+
+    返回:
+    list: 每种操作一行统计结果
+    """
+    gc.collect()
+    rss_before = current_rss()
+    samples, errors, sessions = [], [], []
+
+    portfolio_size = min(args.codes, len(universe))
+    shared_portfolio = rng.sample(universe, portfolio_size)
+    workers = []
+    for _ in range(session_count):
+        if args.repeat_portfolio:
+            portfolios = [shared_portfolio] * args.iterations
+        else:
+            portfolios = [rng.sample(universe, portfolio_size) for _ in range(args.iterations)]
+        workers.append(threading.Thread(
+            target=run_session, args=(portfolios, samples, errors, sessions, args.timeout)
+        ))
+
+    sampler = MemorySampler()
+    sampler.start()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    wall_time = time.perf_counter() - start
+    peak_rss = sampler.stop()
+
+    # 会话仍然存活时统计常驻内存，得到每个会话的平均增量
+    rss_after = current_rss()
+    per_session_mb = max(rss_after - rss_before, 0) / session_count / 1024 / 1024
+    peak_per_session_mb = max(peak_rss - rss_before, 0) / session_count / 1024 / 1024
+    del sessions
+
+    rows = []
+    samples_df = pd.DataFrame(samples, columns=["操作", "耗时"])
+    for operation, group in samples_df.groupby("操作", sort=False):
+        latencies = group["耗时"].to_numpy()
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        rows.append({
+            "会话数": session_count,
+            "操作": operation,
+            "次数": len(latencies),
+            "吞吐量(次/秒)": len(latencies) / wall_time,
+            "p50(秒)": p50,
+            "p95(秒)": p95,
+            "p99(秒)": p99,
+            "错误数": sum(1 for op, _ in errors if op == operation),
+            "内存/会话(MB)": per_session_mb,
+            "峰值内存/会话(MB)": peak_per_session_mb,
+        })
+    for operation, message in errors[:3]:
+        print(f"  [{session_count}个会话] {operation} 失败: {message}")
+    return rows
+
+
+def record(args):
+    """运行一次真实分析并录制应用发起的全部AKShare调用"""
+    import akshare
+
+    configure_environment()
+    recorder = RecordingAkshare(akshare)
+    sys.modules["akshare"] = recorder
+    try:
+        at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+        at.run()
+        at.text_area(key="stock_input").input(args.codes)
+        at.button(key="analyze_button").click().run()
+        failures = _app_failures(at)
+        if failures:
+            print(f"录制过程中应用报错: {failures[0]}")
+    finally:
+        sys.modules["akshare"] = akshare
+
+    with gzip.open(args.output, "wb") as f:
+        pickle.dump(recorder.responses, f)
+    print(f"已录制 {len(recorder.responses)} 次接口调用到 {args.output}")
+
+
+def run(args):
+    """按给定的并发数依次压测并输出统计表"""
+    configure_environment()
+    install_shared_runtime()
+    with gzip.open(args.replay, "rb") as f:
+        provider = ReplayAkshare(pickle.load(f), upstream_latency=args.upstream_latency)
+    sys.modules["akshare"] = provider
+    universe = provider.universe()
+    rng = random.Random(args.seed)
+
+    # 预热：构建成分股快照，之后的各轮压测都命中进程内的共享缓存
+    print("预热中（构建成分股快照）...")
+    warmup_samples, warmup_errors = [], []
+    run_session([rng.sample(universe, min(args.codes, len(universe)))],
+                warmup_samples, warmup_errors, [], args.timeout)
+    if warmup_errors:
+        print(f"预热失败: {warmup_errors[0][1]}")
+        return 1
+    warmup_time = sum(elapsed for _, elapsed in warmup_samples)
+    print(f"预热完成，耗时 {warmup_time:.2f} 秒，上游调用 {provider.call_count} 次")
+
+    rows = []
+    for session_count in args.sessions:
+        print(f"压测 {session_count} 个并发会话...")
+        rows.extend(run_level(session_count, universe, args, rng))
+
+    results_df = pd.DataFrame(rows)
+    with pd.option_context("display.max_columns", None, "display.width", 200,
+                           "display.float_format", "{:.3f}".format):
+        print(results_df.to_string(index=False))
+    if args.csv:
+        results_df.to_csv(args.csv, index=False, encoding="utf-8-sig")
+        print(f"结果已保存到 {args.csv}")
+
+    # 容量：分析p95延迟不超过目标且无错误的最大并发会话数
+    analysis_df = results_df[results_df["操作"] == "分析"]
+    within_target = analysis_df[(analysis_df["p95(秒)"] <= args.target_p95) & (analysis_df["错误数"] == 0)]
+    if within_target.empty:
+        print(f"所有并发数下分析的p95延迟都超过了 {args.target_p95} 秒")
+    else:
+        print(f"分析p95延迟不超过 {args.target_p95} 秒的最大并发会话数: {within_target['会话数'].max()}")
+    return 0
+
+
+def _session_counts(value):
+    """解析以逗号分隔的并发会话数列表"""
+    counts = [int(item) for item in value.split(",") if item.strip()]
+    if not counts or min(counts) < 1:
+        raise argparse.ArgumentTypeError("并发会话数必须是正整数")
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="股票行业与概念分析应用的并发会话压测工具")
+    parser.add_argument("--timeout", type=float, default=300, help="单次脚本运行的超时秒数")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="录制一次真实分析的AKShare响应")
+    record_parser.add_argument("--codes", required=True, help="录制时分析的股票代码")
+    record_parser.add_argument("--output", default="replay.pkl.gz", help="录制文件路径")
+
+    run_parser = subparsers.add_parser("run", help="回放录制数据进行并发压测")
+    run_parser.add_argument("--replay", default="replay.pkl.gz", help="录制文件路径")
+    run_parser.add_argument("--sessions", type=_session_counts, default=[1, 2, 4, 8],
+                            help="以逗号分隔的并发会话数，例如 1,2,4,8")
+    run_parser.add_argument("--iterations", type=int, default=3, help="每个会话进行的分析次数")
+    run_parser.add_argument("--codes", type=int, default=50, help="每次分析的股票数量")
+    run_parser.add_argument("--repeat-portfolio", action="store_true",
+                            help="所有会话分析同一个组合（测试结果缓存命中的情况）")
+    run_parser.add_argument("--upstream-latency", type=float, default=0.0,
+                            help="为每次回放的上游调用模拟的延迟秒数")
+    run_parser.add_argument("--target-p95", type=float, default=5.0,
+                            help="估算容量时分析p95延迟的上限秒数")
+    run_parser.add_argument("--seed", type=int, default=0, help="生成模拟组合的随机种子")
+    run_parser.add_argument("--csv", help="将统计结果保存为CSV文件")
+
+    args = parser.parse_args(argv)
+    if args.command == "record":
+        record(args)
+        return 0
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
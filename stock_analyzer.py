@@ -4,7 +4,8 @@ import matplotlib.pyplot as plt
 import re
 import akshare as ak
 import numpy as np
-from collections import Counter
+import scipy.sparse as sp
+from collections import Counter, OrderedDict, deque
 import time
 import plotly.express as px
 import plotly.graph_objects as go
@@ -12,6 +13,28 @@ import json
 from streamlit.components.v1 import html
 import streamlit.components.v1 as components
 import io
+import math
+import threading
+import os
+import gzip
+import csv
+import codecs
+import tempfile
+import hashlib
+import datetime
+import bisect
+import cProfile
+import pstats
+import marshal
+import tracemalloc
+from contextlib import contextmanager
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import to_rgb
+from matplotlib import font_manager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from http_pool import PooledSession, install_pooled_session, http_pool_stats
 
 # 设置页面配置
 st.set_page_config(
@@ -150,7 +173,7 @@ st.markdown("""
     <div class="tip-card">
         <p><strong>使用方法：</strong></p>
         <ul>
-            <li>请输入1-500个股票代码，用空格、顿号(、)或逗号(,，)分隔</li>
+            <li>请输入1-500个股票代码，用空格、顿号(、)或逗号(,，)分隔；勾选"大规模模式"可分析更多股票或全市场</li>
             <li>点击"自动分析"按钮后系统将展示股票的基本信息表格</li>
             <li>分析结果包括行业和概念的分布饼图，点击可查看详情</li>
         </ul>
@@ -158,57 +181,1703 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# 创建缓存函数获取股票基本信息
-@st.cache_data(ttl=3600)  # 缓存1小时
+# 创建进程内共享的上游HTTP会话
+@st.cache_resource
+def get_http_session():
+    """创建共享的长连接池，并让AKShare的上游请求使用它"""
+    session = PooledSession()
+    install_pooled_session(session)
+    return session
+
+get_http_session()
+
+# A股交易时段（北京时间，无夏令时）
+MARKET_TZ = datetime.timezone(datetime.timedelta(hours=8))
+TRADING_SESSIONS = (
+    (datetime.time(9, 30), datetime.time(11, 30)),
+    (datetime.time(13, 0), datetime.time(15, 0)),
+)
+# 交易时段内板块行情（涨跌幅等）的刷新间隔（秒）
+QUOTE_TTL = int(os.environ.get("STOCK_ANALYZER_QUOTE_TTL", "300"))
+# 交易日历的刷新间隔和获取失败后的重试间隔（秒）
+TRADE_CALENDAR_TTL = 24 * 3600
+TRADE_CALENDAR_RETRY = 600
+
+# 创建进程内共享的交易日历
+@st.cache_resource
+def get_trade_calendar_store():
+    """所有会话共享的交易日历，days为按日期排序的交易日列表"""
+    return {"days": None, "fetched_at": 0.0, "lock": threading.Lock()}
+
+def trading_days(calendar=None):
+    """
+    获取A股交易日列表，每天刷新一次
+
+    参数:
+        calendar: 交易日历存储，默认使用所有会话共享的交易日历
+
+    返回:
+        按日期排序的交易日列表，从未成功获取时返回None
+    """
+    store = get_trade_calendar_store() if calendar is None else calendar
+    with store["lock"]:
+        now = time.time()
+        if (store["days"] is None and now - store["fetched_at"] >= TRADE_CALENDAR_RETRY) or \
+                now - store["fetched_at"] >= TRADE_CALENDAR_TTL:
+            store["fetched_at"] = now
+            try:
+                trade_dates = ak.tool_trade_date_hist_sina()["trade_date"]
+                store["days"] = sorted(set(pd.to_datetime(trade_dates).dt.date))
+            except Exception:
+                # 获取失败时保留上一次的日历，没有日历时按工作日判断
+                pass
+        return store["days"]
+
+def is_trading_day(day, calendar=None):
+    """判断某一天是否为A股交易日，超出日历范围时按周一至周五判断"""
+    days = trading_days(calendar)
+    if days and days[0] <= day <= days[-1]:
+        i = bisect.bisect_left(days, day)
+        return i < len(days) and days[i] == day
+    return day.weekday() < 5
+
+def next_trading_day(day, calendar=None):
+    """某一天之后（不含当天）的第一个交易日"""
+    day += datetime.timedelta(days=1)
+    # 最长的休市（春节、国庆）不超过两周
+    for _ in range(30):
+        if is_trading_day(day, calendar):
+            break
+        day += datetime.timedelta(days=1)
+    return day
+
+def _market_timestamp(day, moment):
+    """北京时间的日期和时刻对应的时间戳"""
+    return datetime.datetime.combine(day, moment, MARKET_TZ).timestamp()
+
+def next_market_open(ts, calendar=None):
+    """
+    时间戳ts之后的下一个交易日开盘时间
+
+    参数:
+        ts: 时间戳
+        calendar: 交易日历存储，默认使用所有会话共享的交易日历
+
+    返回:
+        开盘时间戳；ts为交易日开盘前时返回当天开盘时间
+    """
+    now = datetime.datetime.fromtimestamp(ts, MARKET_TZ)
+    open_time = TRADING_SESSIONS[0][0]
+    day = now.date()
+    if not (is_trading_day(day, calendar) and now.time() < open_time):
+        day = next_trading_day(day, calendar)
+    return _market_timestamp(day, open_time)
+
+def in_trading_session(ts=None):
+    """时间戳ts（默认当前时间）是否处于A股交易时段"""
+    now = datetime.datetime.fromtimestamp(time.time() if ts is None else ts, MARKET_TZ)
+    return is_trading_day(now.date()) and any(start <= now.time() < end for start, end in TRADING_SESSIONS)
+
+def membership_expiry(ts, calendar=None):
+    """
+    板块成分股等成员关系数据的过期时间：保留到下一个交易日开盘
+
+    在两次开盘之间返回值保持不变，可直接作为缓存键
+    """
+    return next_market_open(ts, calendar)
+
+def quote_expiry(ts):
+    """
+    板块涨跌幅等行情数据的过期时间
+
+    交易时段内按QUOTE_TTL对齐刷新，时段结束时再刷新一次以取得收盘行情，
+    午间休市、收盘后和非交易日保持到下一个交易时段开始。
+    在同一个刷新区间内返回值保持不变，可直接作为缓存键
+    """
+    now = datetime.datetime.fromtimestamp(ts, MARKET_TZ)
+    day = now.date()
+    if is_trading_day(day):
+        for start, end in TRADING_SESSIONS:
+            start_ts = _market_timestamp(day, start)
+            end_ts = _market_timestamp(day, end)
+            if ts < start_ts:
+                return start_ts
+            if ts < end_ts:
+                return min(start_ts + (int((ts - start_ts) // QUOTE_TTL) + 1) * QUOTE_TTL, end_ts)
+    return next_market_open(ts)
+
+# 获取股票基本信息，成员关系数据保留到下一个交易日开盘
+@st.cache_data(max_entries=2, show_spinner=False)
+def _load_stock_basic_info(expires_at):
+    return ak.stock_info_a_code_name()
+
 def get_stock_basic_info():
     """获取A股所有股票的基本信息"""
     try:
-        return ak.stock_info_a_code_name()
+        return _load_stock_basic_info(membership_expiry(time.time()))
     except Exception as e:
         st.error(f"获取股票基本信息时出错: {e}")
         return pd.DataFrame(columns=['code', 'name'])
 
-# 创建缓存函数获取行业板块信息
-@st.cache_data(ttl=3600)  # 缓存1小时
+# 获取板块列表，列表中包含涨跌幅等行情字段，只在交易时段内刷新
+@st.cache_data(max_entries=2, show_spinner=False)
+def _load_industry_list(expires_at):
+    return ak.stock_board_industry_name_em()
+
 def get_industry_list():
     """获取东方财富-行业板块列表"""
     try:
-        return ak.stock_board_industry_name_em()
+        return _load_industry_list(quote_expiry(time.time()))
     except Exception as e:
         st.error(f"获取行业板块列表时出错: {e}")
         return pd.DataFrame(columns=['板块名称', '板块代码'])
 
-# 创建缓存函数获取概念板块信息
-@st.cache_data(ttl=3600)  # 缓存1小时
+@st.cache_data(max_entries=2, show_spinner=False)
+def _load_concept_list(expires_at):
+    return ak.stock_board_concept_name_em()
+
 def get_concept_list():
     """获取东方财富-概念板块列表"""
     try:
-        return ak.stock_board_concept_name_em()
+        return _load_concept_list(quote_expiry(time.time()))
     except Exception as e:
         st.error(f"获取概念板块列表时出错: {e}")
         return pd.DataFrame(columns=['板块名称', '板块代码'])
 
-# 创建缓存函数获取行业成分股
-@st.cache_data(ttl=3600)  # 缓存1小时
-def get_industry_stocks(industry_name):
-    """获取特定行业的成分股"""
+def freshness_status(ts=None):
+    """当前的交易状态以及成分股和行情数据的下次刷新时间，用于运行统计"""
+    ts = time.time() if ts is None else ts
+    def fmt(expiry):
+        return datetime.datetime.fromtimestamp(expiry, MARKET_TZ).strftime('%m-%d %H:%M')
+    return {
+        "交易状态": "交易中" if in_trading_session(ts) else "休市",
+        "成分股下次刷新": fmt(membership_expiry(ts)),
+        "行情下次刷新": fmt(quote_expiry(ts)),
+    }
+
+# 板块成分股缓存的内存预算（MB），缓存条目保留到下一个交易日开盘
+BOARD_CACHE_BUDGET_MB = float(os.environ.get("STOCK_ANALYZER_BOARD_CACHE_MB", "256"))
+
+def _dataframe_size(df):
+    """DataFrame的实际内存占用（字节）"""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+class BudgetedCache:
+    """
+    按内存预算淘汰的缓存
+
+    每个条目按sizeof计算的内存占用计数，总占用超过预算时淘汰最久未使用的条目，
+    过期条目在访问时移除。条目的过期时间默认为写入后ttl秒，也可以通过expiry
+    根据写入时间计算（如按交易日历）。缓存的对象在会话之间共享，调用方不应修改
+    """
+
+    def __init__(self, budget_bytes, ttl=None, sizeof=_dataframe_size, expiry=None):
+        self.budget_bytes = budget_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.expiry = expiry if expiry is not None else (lambda written_at: written_at + ttl)
+        self._entries = OrderedDict()  # key -> (缓存对象, 字节数, 过期时间)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.current_bytes -= size
+
+    def get(self, key):
+        """读取缓存条目，不存在或已过期时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() >= entry[2]:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """写入缓存条目，并按最近最少使用的顺序淘汰超出预算的条目"""
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            # 单个条目超过预算时不缓存
+            if size > self.budget_bytes:
+                return
+            self._entries[key] = (value, size, self.expiry(time.time()))
+            self.current_bytes += size
+            while self.current_bytes > self.budget_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """
+        读取缓存条目，未命中时调用loader加载并写入缓存
+
+        loader返回None表示加载失败，失败结果不写入缓存
+        """
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is None:
+                return None
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        """缓存的命中、淘汰和内存占用统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "条目数": len(self._entries),
+                "内存占用(MB)": self.current_bytes / 1024 / 1024,
+                "内存预算(MB)": self.budget_bytes / 1024 / 1024,
+                "命中率": self.hits / lookups if lookups else 0.0,
+                "命中数": self.hits,
+                "未命中数": self.misses,
+                "淘汰数": self.evictions,
+                "过期数": self.expirations,
+            }
+
+# 创建进程内共享的板块成分股缓存
+@st.cache_resource
+def get_board_cache():
+    """所有会话共享的板块成分股缓存"""
+    # 绑定共享的交易日历，后台加载线程写入缓存时不需要脚本上下文
+    calendar = get_trade_calendar_store()
+    return BudgetedCache(int(BOARD_CACHE_BUDGET_MB * 1024 * 1024),
+                         expiry=lambda written_at: membership_expiry(written_at, calendar))
+
+def _fetch_board_stocks(fetcher, board_name, label, errors=None):
+    """调用上游接口获取板块成分股，失败时返回None；提供errors列表时将错误信息追加到其中而不直接显示"""
     try:
-        df = ak.stock_board_industry_cons_em(symbol=industry_name)
-        return df
+        return fetcher(symbol=board_name)
     except Exception as e:
-        st.warning(f"获取行业 '{industry_name}' 成分股时出错: {e}")
-        return pd.DataFrame(columns=['代码', '名称'])
+        message = f"获取{label} '{board_name}' 成分股时出错: {e}"
+        if errors is not None:
+            errors.append(message)
+        else:
+            st.warning(message)
+        return None
 
-# 创建缓存函数获取概念成分股
-@st.cache_data(ttl=3600)  # 缓存1小时
-def get_concept_stocks(concept_name):
-    """获取特定概念的成分股"""
+# 获取行业成分股（经过板块缓存）
+def get_industry_stocks(industry_name, errors=None, cache=None):
+    """获取特定行业的成分股，cache默认为共享的板块成分股缓存"""
+    df = (get_board_cache() if cache is None else cache).get_or_load(
+        ("industry", industry_name),
+        lambda: _fetch_board_stocks(ak.stock_board_industry_cons_em, industry_name, "行业", errors)
+    )
+    return df if df is not None else pd.DataFrame(columns=['代码', '名称'])
+
+# 获取概念成分股（经过板块缓存）
+def get_concept_stocks(concept_name, errors=None, cache=None):
+    """获取特定概念的成分股，cache默认为共享的板块成分股缓存"""
+    df = (get_board_cache() if cache is None else cache).get_or_load(
+        ("concept", concept_name),
+        lambda: _fetch_board_stocks(ak.stock_board_concept_cons_em, concept_name, "概念", errors)
+    )
+    return df if df is not None else pd.DataFrame(columns=['代码', '名称'])
+
+# 默认的行业分类标准，即东方财富行业板块
+DEFAULT_TAXONOMY = "东方财富"
+# 额外加载的行业分类标准，逗号分隔，设置为空字符串时只使用东方财富行业板块
+EXTRA_TAXONOMIES = [name.strip() for name in os.environ.get("STOCK_ANALYZER_TAXONOMIES", "申万,证监会").split(",") if name.strip()]
+
+def _sw_board_list():
+    """申万一级行业列表，板块代码去掉.SI后缀"""
+    boards = ak.sw_index_first_info()
+    return pd.DataFrame({
+        "板块名称": boards["行业名称"].astype(str),
+        "板块代码": boards["行业代码"].astype(str).str.replace(".SI", "", regex=False),
+    })
+
+def _csrc_board_list():
+    """新浪按证监会行业分类的板块列表"""
+    boards = ak.stock_sector_spot(indicator="行业")
+    return pd.DataFrame({"板块名称": boards["板块"].astype(str), "板块代码": boards["label"].astype(str)})
+
+# 各行业分类标准的板块列表接口、成分股接口以及成分股数据中的代码列
+TAXONOMY_SOURCES = {
+    "申万": (_sw_board_list, lambda symbol: ak.index_component_sw(symbol=symbol), "证券代码"),
+    "证监会": (_csrc_board_list, lambda symbol: ak.stock_sector_detail(sector=symbol), "code"),
+}
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _load_taxonomy_boards(taxonomy, expires_at):
+    return TAXONOMY_SOURCES[taxonomy][0]()
+
+def get_taxonomy_boards(taxonomy):
+    """获取指定行业分类标准的板块列表，成员关系数据保留到下一个交易日开盘"""
     try:
-        df = ak.stock_board_concept_cons_em(symbol=concept_name)
-        return df
+        return _load_taxonomy_boards(taxonomy, membership_expiry(time.time()))
     except Exception as e:
-        st.warning(f"获取概念 '{concept_name}' 成分股时出错: {e}")
-        return pd.DataFrame(columns=['代码', '名称'])
+        st.warning(f"获取{taxonomy}行业列表时出错: {e}")
+        return pd.DataFrame(columns=['板块名称', '板块代码'])
+
+def get_taxonomy_board_stocks(taxonomy, board_name, board_code, errors=None, cache=None):
+    """获取指定行业分类标准下某个行业的成分股（经过板块缓存），代码列统一为'代码'"""
+    _, fetcher, code_column = TAXONOMY_SOURCES[taxonomy]
+
+    def load():
+        df = _fetch_board_stocks(fetcher, board_code, f"{taxonomy}行业", errors)
+        if df is None:
+            return None
+        codes = df[code_column].astype(str).str.zfill(6)
+        return pd.DataFrame({'代码': codes.to_numpy(dtype=object)})
+
+    df = (get_board_cache() if cache is None else cache).get_or_load(("taxonomy", taxonomy, board_name), load)
+    return df if df is not None else pd.DataFrame(columns=['代码'])
+
+# 普通模式下单次分析允许的最大股票数量
+MAX_STOCK_CODES = 500
+# 大规模模式下每批分类的股票数量
+SCALE_CHUNK_SIZE = 1000
+# 每只股票最多保留的相关概念数量
+TOP_CONCEPTS = 5
+# 概念相关性得分中板块排序权重、精确度和热度三个因素的默认系数
+DEFAULT_SCORE_WEIGHTS = (0.5, 0.5, 0.2)
+# 分布饼图默认展示的类别数量（含"其他"）
+DISTRIBUTION_BUCKETS = 10
+# 分页表格可选的每页行数
+TABLE_PAGE_SIZE_OPTIONS = [50, 100, 200, 500]
+# 跨进程共享的内存映射快照文件，设置为空字符串时不共享
+SHARED_SNAPSHOT_PATH = os.environ.get(
+    "STOCK_ANALYZER_SHARED_SNAPSHOT",
+    os.path.join(tempfile.gettempdir(), "stock_analyzer_membership.snap")
+)
+# 共享快照文件的格式标识
+SHARED_SNAPSHOT_MAGIC = b"STKSNAP2"
+# 共享快照文件中数组的对齐字节数
+SHARED_SNAPSHOT_ALIGN = 64
+# 等待后台加载板块数据时刷新进度的间隔（秒）
+LOAD_PROGRESS_INTERVAL = 0.5
+# 默认的分析时限（秒），0表示一直等待板块数据加载完成
+ANALYSIS_DEADLINE = int(os.environ.get("STOCK_ANALYZER_DEADLINE", "0"))
+# 展示暂定结果时检查后台加载是否完成的间隔（秒）
+PROVISIONAL_POLL_INTERVAL = 3
+# 相似股票索引中每只股票保留的相似股票数量
+SIMILAR_TOP_K = 20
+# 计算相似度时每批处理的股票数量，限制稠密中间结果的内存占用
+SIMILARITY_BLOCK_SIZE = 512
+
+# 创建进程内共享的快照存储
+@st.cache_resource
+def get_snapshot_store():
+    """进程内所有会话共享的成分股快照存储"""
+    return {"snapshot": None, "lock": threading.Lock()}
+
+def parse_change_rate(value):
+    """将涨跌幅字段（数值或带%的字符串）解析为浮点数，无法解析时返回NaN"""
+    try:
+        return float(str(value).replace('%', ''))
+    except (TypeError, ValueError):
+        return np.nan
+
+def _member_codes(board_stocks):
+    """提取板块成分股的代码数组"""
+    if board_stocks is None or board_stocks.empty or '代码' not in board_stocks.columns:
+        return np.array([], dtype=object)
+    return board_stocks['代码'].astype(str).to_numpy(dtype=object)
+
+def compute_concept_scores(concept_data, concept_names, concept_sizes):
+    """
+    计算每个概念板块的相关性得分：排序权重、精确度和热度按0.5/0.5/0.2加权
+
+    原先的逐股打分对akshare返回的数值型涨跌幅调用字符串替换会抛出异常，热度项实际从未计入；
+    这里统一用parse_change_rate解析，热度项按设计参与排序，因此概念排序与旧版本略有不同
+
+    参数:
+        concept_data: 概念分类数据
+        concept_names: 概念名称列表
+        concept_sizes: 各概念的成分股数量
+
+    返回:
+        (排序权重, 精确度得分, 热度得分, 综合得分) 四个数组
+    """
+    # 越靠前的概念板块权重越高
+    total_boards = len(concept_data)
+    weight_map = dict(zip(concept_data['板块名称'], total_boards - np.arange(total_boards)))
+    weights = np.array([weight_map.get(name, 0) for name in concept_names], dtype=float)
+
+    # 成分股在30-100之间的概念最合适，太少可能太小众，太多可能太宽泛
+    sizes = np.asarray(concept_sizes, dtype=float)
+    precision = np.where(
+        (sizes >= 30) & (sizes <= 100), 100.0,
+        np.where(sizes < 30, sizes, np.maximum(1.0, 200.0 - sizes))
+    )
+
+    # 涨跌幅的绝对值作为热度指标，最高100分
+    heat = np.zeros(len(concept_names))
+    if '涨跌幅' in concept_data.columns:
+        first_rows = concept_data.drop_duplicates('板块名称').set_index('板块名称')['涨跌幅']
+        change_rates = np.array([parse_change_rate(first_rows.get(name)) for name in concept_names], dtype=float)
+        heat = np.nan_to_num(np.minimum(np.abs(change_rates) * 5, 100), nan=0.0)
+
+    rank_weight, precision_weight, heat_weight = DEFAULT_SCORE_WEIGHTS
+    scores = weights * rank_weight + precision * precision_weight + heat * heat_weight
+    return weights, precision, heat, scores
+
+def _concept_rank(scores):
+    """概念名次：得分越高名次越靠前，同分时保持板块原始顺序"""
+    rank = np.empty(len(scores), dtype=np.int64)
+    rank[np.argsort(-scores, kind='stable')] = np.arange(len(scores))
+    return rank
+
+def build_taxonomy_index(code_index, taxonomy_members):
+    """
+    将多个行业分类标准的成员关系写入同一张代码表
+
+    每个分类标准占行业编号矩阵的一行，行业编号为在全部行业名称数组中的位置，
+    各分类标准的行业名称依次排列。一只股票属于同一分类标准下的多个行业时取排在前面的行业
+
+    参数:
+        code_index: 快照代码表，需包含所有成分股代码
+        taxonomy_members: {分类标准: {行业名称: 成分股代码数组}}，第一个为默认分类标准
+
+    返回:
+        (分类标准名称数组, 各分类标准的行业编号起点数组, 全部行业名称数组, 分类标准×股票的行业编号矩阵)
+    """
+    taxonomies = list(taxonomy_members)
+    offsets = np.zeros(len(taxonomies) + 1, dtype=np.int64)
+    names = []
+    taxonomy_of = np.full((len(taxonomies), len(code_index)), -1, dtype=np.int32)
+    for t, taxonomy in enumerate(taxonomies):
+        boards = list(taxonomy_members[taxonomy].items())
+        offsets[t + 1] = offsets[t] + len(boards)
+        names.extend(name for name, _ in boards)
+        # 倒序写入行业编号，使排在前面的行业优先
+        for board_idx in range(len(boards) - 1, -1, -1):
+            taxonomy_of[t, code_index.get_indexer(boards[board_idx][1])] = offsets[t] + board_idx
+    return np.array(taxonomies, dtype=object), offsets, np.array(names, dtype=object), taxonomy_of
+
+def taxonomy_industries(snapshot, stock_codes, taxonomy=DEFAULT_TAXONOMY):
+    """
+    按指定的行业分类标准查询股票所属行业
+
+    参数:
+        snapshot: 成分股快照
+        stock_codes: 股票代码列表
+        taxonomy: 行业分类标准名称
+
+    返回:
+        行业名称数组，快照中没有的股票或行业记为"未知行业"
+    """
+    t = list(snapshot["taxonomies"]).index(taxonomy)
+    positions = snapshot["code_index"].get_indexer(np.asarray(stock_codes, dtype=object))
+    # 快照中没有的股票取到末尾追加的-1，行业编号为-1时恰好取到末尾追加的"未知行业"
+    industry_idx = np.append(snapshot["taxonomy_of"][t], -1)[positions]
+    return np.append(snapshot["taxonomy_names"], "未知行业")[industry_idx]
+
+def build_membership_snapshot(stock_info, industry_data, industry_stocks_cache, concept_data, concept_stocks_cache, built_at=None, taxonomy_stocks=None):
+    """
+    将板块成分股数据构建为成分股快照，供批量分类使用
+
+    快照包含代码表、板块表和股票×板块的成员关系数组。行业按板块顺序取第一个命中的行业，
+    概念成员关系以CSR格式存储，每只股票的概念已按相关性得分从高到低排列。
+
+    参数:
+        stock_info: A股代码和名称数据
+        industry_data: 行业分类数据
+        industry_stocks_cache: 行业成分股缓存
+        concept_data: 概念分类数据
+        concept_stocks_cache: 概念成分股缓存
+        built_at: 快照对应的时间戳，默认为当前时间
+        taxonomy_stocks: 额外行业分类标准的成分股数据 {分类标准: {行业名称: 成分股DataFrame}}，可选
+
+    返回:
+        快照字典
+    """
+    industry_names = np.array(list(industry_stocks_cache.keys()), dtype=object)
+    concept_names = np.array(list(concept_stocks_cache.keys()), dtype=object)
+    industry_members = [_member_codes(industry_stocks_cache[name]) for name in industry_names]
+    concept_members = [_member_codes(concept_stocks_cache[name]) for name in concept_names]
+    taxonomy_members = {DEFAULT_TAXONOMY: dict(zip(industry_names, industry_members))}
+    for taxonomy, board_stocks in (taxonomy_stocks or {}).items():
+        taxonomy_members[taxonomy] = {name: _member_codes(df) for name, df in board_stocks.items()}
+    extra_members = [members for taxonomy, boards in taxonomy_members.items() if taxonomy != DEFAULT_TAXONOMY
+                     for members in boards.values()]
+
+    # 代码表：全部A股与所有成分股代码的并集
+    basic_codes = stock_info['code'].astype(str).to_numpy(dtype=object)
+    codes = pd.unique(np.concatenate([basic_codes] + industry_members + concept_members + extra_members))
+    code_index = pd.Index(codes)
+
+    # 股票名称，重复代码以最后一条为准
+    name_series = pd.Series(stock_info['name'].to_numpy(dtype=object), index=basic_codes)
+    name_series = name_series[~name_series.index.duplicated(keep='last')]
+    names = name_series.reindex(code_index).to_numpy(dtype=object)
+
+    # 所有行业分类标准共用代码表，默认分类标准的行业编号与逐个行业查找的结果一致
+    taxonomies, taxonomy_offsets, taxonomy_names, taxonomy_of = build_taxonomy_index(code_index, taxonomy_members)
+    industry_of = taxonomy_of[0]
+
+    # 成分股数量按去重后的代码计，与历史快照重建时的口径一致
+    concept_sizes = np.array([len(pd.unique(members)) for members in concept_members], dtype=np.int64)
+    concept_weights, concept_precision, concept_heat, concept_scores = compute_concept_scores(
+        concept_data, concept_names, concept_sizes
+    )
+
+    concept_rank = _concept_rank(concept_scores)
+
+    # 构建 (股票, 概念) 成员关系并按 (股票, 概念名次) 排序去重
+    rows = np.concatenate([code_index.get_indexer(m) for m in concept_members] + [np.array([], dtype=np.int64)])
+    cols = np.concatenate([np.full(len(m), i, dtype=np.int64) for i, m in enumerate(concept_members)] + [np.array([], dtype=np.int64)])
+    order = np.lexsort((concept_rank[cols], rows))
+    rows, cols = rows[order], cols[order]
+    keep = np.ones(len(rows), dtype=bool)
+    keep[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    rows, cols = rows[keep], cols[keep]
+
+    concept_indptr = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(codes)), out=concept_indptr[1:])
+
+    if built_at is None:
+        built_at = time.time()
+    return {
+        "version": time.strftime('%Y%m%d%H%M%S', time.localtime(built_at)),
+        "built_at": built_at,
+        "codes": codes,
+        "code_index": code_index,
+        "names": names,
+        "industry_data": industry_data,
+        "concept_data": concept_data,
+        "industry_names": industry_names,
+        "industry_of": industry_of,
+        "taxonomies": taxonomies,
+        "taxonomy_offsets": taxonomy_offsets,
+        "taxonomy_names": taxonomy_names,
+        "taxonomy_of": taxonomy_of,
+        "concept_names": concept_names,
+        "concept_sizes": concept_sizes,
+        "concept_weights": concept_weights,
+        "concept_precision": concept_precision,
+        "concept_heat": concept_heat,
+        "concept_scores": concept_scores,
+        "concept_indptr": concept_indptr,
+        "concept_indices": cols.astype(np.int32),
+    }
+
+def apply_board_quotes(snapshot, concept_data, quotes_version=None):
+    """
+    用最新的概念板块列表（行情层）更新快照的概念得分，成员关系（成员层）保持不变
+
+    板块排序权重和热度都来自板块列表中的行情，精确度只取决于成分股数量。
+    重新计算得分后按新的名次重排每只股票的概念，无需重新获取任何成分股
+
+    参数:
+        snapshot: 成员层快照
+        concept_data: 最新的概念板块列表
+        quotes_version: 行情版本标识，用于区分同一成员层上叠加的不同行情
+
+    返回:
+        新的快照字典，与成员层快照共享成员关系数组
+    """
+    weights, precision, heat, scores = compute_concept_scores(
+        concept_data, snapshot["concept_names"], snapshot["concept_sizes"]
+    )
+    indptr = snapshot["concept_indptr"]
+    indices = snapshot["concept_indices"]
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    order = np.lexsort((_concept_rank(scores)[indices], rows))
+
+    quoted = dict(snapshot)
+    quoted.update({
+        "concept_weights": weights,
+        "concept_precision": precision,
+        "concept_heat": heat,
+        "concept_scores": scores,
+        "concept_indices": indices[order],
+        "quotes_version": quotes_version,
+    })
+    return quoted
+
+def with_current_quotes(store, snapshot):
+    """
+    为成员层快照叠加当前的行情层，同一个行情刷新区间内只叠加一次
+
+    行情来自按交易时段刷新的概念板块列表，获取失败时沿用构建快照时的得分
+    """
+    expires_at = quote_expiry(time.time())
+    cached = store.get("quoted")
+    if cached is not None and cached[0] == expires_at and cached[1]["version"] == snapshot["version"]:
+        return cached[1]
+
+    concept_data = get_concept_list()
+    if concept_data.empty:
+        return snapshot
+    # 相似度索引只依赖成员关系，先在成员层上计算，叠加行情后的快照直接共享
+    get_similarity_index(snapshot)
+    quotes_version = datetime.datetime.fromtimestamp(expires_at, MARKET_TZ).strftime('%Y%m%d%H%M%S')
+    quoted = apply_board_quotes(snapshot, concept_data, quotes_version)
+    store["quoted"] = (expires_at, quoted)
+    return quoted
+
+class BoardLoadJob:
+    """
+    在后台线程中加载所有板块的成分股数据
+
+    后台线程先获取股票列表和各分类标准的板块列表，再按行业、概念、其他行业分类标准的顺序
+    逐个加载成分股，加载过程中可以随时取出已加载的部分构建暂定快照。股票列表或行业、概念
+    板块列表获取失败时整个任务失败，其他行业分类标准的列表或单个板块加载失败时记录错误并继续。
+    任务在所有会话之间共享，线程不绑定会话的脚本上下文，只使用创建任务时取得的共享缓存，
+    错误信息记入errors由等待完成的会话显示。性能分析模式采样期间，每一步加载在线程内单独采样
+    """
+
+    def __init__(self, taxonomies=None):
+        self.taxonomies = []
+        for taxonomy in (EXTRA_TAXONOMIES if taxonomies is None else taxonomies):
+            if taxonomy not in TAXONOMY_SOURCES or taxonomy == DEFAULT_TAXONOMY:
+                st.warning(f"不支持的行业分类标准: {taxonomy}")
+                continue
+            self.taxonomies.append(taxonomy)
+        self.board_cache = get_board_cache()
+        self.profiler_state = get_profiler_state()
+
+        self.stock_info = None
+        self.industry_data = None
+        self.concept_data = None
+        self.taxonomy_boards = {}
+        self.lists_ready = threading.Event()
+        self.industry_stocks = {}
+        self.concept_stocks = {}
+        self.taxonomy_stocks = {}
+        self.errors = []
+        self.failed_industries = set()
+        self.failed_concepts = set()
+        self.error = None
+        self.total = 0
+        self.loaded = 0
+        self.done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="board-loader", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _fetch_list(self, fetcher, label, columns):
+        """调用上游接口获取列表数据，失败时记录错误并返回只有列名的空表"""
+        try:
+            return fetcher()
+        except Exception as e:
+            self.errors.append(f"获取{label}时出错: {e}")
+            return pd.DataFrame(columns=columns)
+
+    def _fetch_required_list(self, fetcher, label):
+        """调用上游接口获取快照必需的列表数据，获取失败或为空时抛出异常使整个任务失败"""
+        try:
+            df = fetcher()
+        except Exception as e:
+            raise RuntimeError(f"获取{label}时出错: {e}") from e
+        if df.empty:
+            raise RuntimeError(f"获取的{label}为空")
+        return df
+
+    def _load_lists(self):
+        """获取股票列表和各行业分类标准的板块列表，并据此确定需要加载的板块总数"""
+        # 股票列表和行业、概念板块列表缺失时构建的快照不完整，不能作为完整快照发布或记入历史，
+        # 其他行业分类标准的列表获取失败时只是不加载该标准
+        self.stock_info = self._fetch_required_list(ak.stock_info_a_code_name, "股票基本信息")
+        self.industry_data = self._fetch_required_list(ak.stock_board_industry_name_em, "行业板块列表")
+        self.concept_data = self._fetch_required_list(ak.stock_board_concept_name_em, "概念板块列表")
+        for taxonomy in self.taxonomies:
+            boards = self._fetch_list(TAXONOMY_SOURCES[taxonomy][0], f"{taxonomy}行业列表", ['板块名称', '板块代码'])
+            if not boards.empty:
+                self.taxonomy_boards[taxonomy] = boards
+        self.total = len(self.industry_data) + len(self.concept_data) + sum(len(b) for b in self.taxonomy_boards.values())
+        self.lists_ready.set()
+
+    def _load_board(self, loader, board_name, failed):
+        """加载一个板块的成分股，加载失败时将板块名称记入failed"""
+        error_count = len(self.errors)
+        board_stocks = run_profiled(self.profiler_state, loader, board_name, self.errors, cache=self.board_cache)
+        if len(self.errors) > error_count:
+            failed.add(board_name)
+        return board_stocks
+
+    def _run(self):
+        try:
+            run_profiled(self.profiler_state, self._load_lists)
+            for industry_name in self.industry_data['板块名称']:
+                self.industry_stocks[industry_name] = self._load_board(get_industry_stocks, industry_name, self.failed_industries)
+                self.loaded += 1
+            for concept_name in self.concept_data['板块名称']:
+                self.concept_stocks[concept_name] = self._load_board(get_concept_stocks, concept_name, self.failed_concepts)
+                self.loaded += 1
+            # 其他行业分类标准全部加载完成后才加入快照，避免同一标准下只有部分行业
+            for taxonomy, boards in self.taxonomy_boards.items():
+                board_stocks = {}
+                for board_name, board_code in zip(boards['板块名称'], boards['板块代码']):
+                    board_stocks[board_name] = run_profiled(self.profiler_state, get_taxonomy_board_stocks, taxonomy,
+                                                            board_name, board_code, self.errors, cache=self.board_cache)
+                    self.loaded += 1
+                self.taxonomy_stocks[taxonomy] = board_stocks
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+    def partial(self):
+        """已加载的 (行业成分股, 概念成分股, 其他行业分类标准成分股)"""
+        return dict(self.industry_stocks), dict(self.concept_stocks), dict(self.taxonomy_stocks)
+
+def _wait_for_load_job(job, deadline, progress_container, status_container):
+    """
+    等待板块加载任务完成并显示进度
+
+    参数:
+        job: 板块加载任务
+        deadline: 最长等待秒数，None表示一直等待
+        progress_container: 进度条容器
+        status_container: 状态文本容器
+
+    返回:
+        任务是否已完成
+    """
+    wait_until = None if deadline is None else time.time() + deadline
+    with progress_container.container():
+        st.markdown("<p><div class='loading-spinner'></div> <b>正在加载所有行业和概念数据 (这可能需要几分钟时间)...</b></p>", unsafe_allow_html=True)
+        progress_bar = st.progress(0)
+        while not job.done.is_set():
+            progress_bar.progress(job.loaded / job.total if job.total else 0.0)
+            if job.lists_ready.is_set():
+                status_container.markdown(f"已加载 {job.loaded}/{job.total} 个板块")
+            else:
+                status_container.markdown("正在获取股票和板块列表...")
+            timeout = LOAD_PROGRESS_INTERVAL if wait_until is None else min(LOAD_PROGRESS_INTERVAL, wait_until - time.time())
+            if timeout <= 0:
+                break
+            job.done.wait(timeout)
+    progress_container.empty()
+    status_container.empty()
+    return job.done.is_set()
+
+def build_provisional_snapshot(job, reference=None):
+    """
+    用板块加载任务中已加载的板块构建暂定快照
+
+    参数:
+        job: 尚未完成的板块加载任务
+        reference: 上一次的完整快照（可能已过期），用于判断哪些股票的结果可能变化
+
+    返回:
+        快照字典，provisional字段记录加载任务、板块列表是否尚未获取、未加载的行业和概念以及参考快照
+    """
+    if not job.lists_ready.is_set():
+        # 板块列表还未获取完成时沿用参考快照（没有参考快照时为空快照），所有股票均记为暂定
+        if reference is not None:
+            snapshot = dict(reference)
+        else:
+            empty_boards = pd.DataFrame(columns=['板块名称', '板块代码'])
+            snapshot = build_membership_snapshot(pd.DataFrame(columns=['code', 'name']), empty_boards, {}, empty_boards, {})
+        snapshot["version"] = f"{snapshot['version']}-pending"
+        snapshot["provisional"] = {
+            "job": job,
+            "lists_pending": True,
+            "pending_industries": [],
+            "pending_concepts": [],
+            "reference": reference,
+        }
+        return snapshot
+
+    industry_stocks, concept_stocks, taxonomy_stocks = job.partial()
+    snapshot = build_membership_snapshot(job.stock_info, job.industry_data, industry_stocks,
+                                         job.concept_data, concept_stocks, taxonomy_stocks=taxonomy_stocks)
+    # 版本中带上已加载的板块数量，避免与完整快照或其他暂定快照的分析结果缓存混用
+    snapshot["version"] = f"{snapshot['version']}-{len(industry_stocks)}-{len(concept_stocks)}"
+    snapshot["provisional"] = {
+        "job": job,
+        "lists_pending": False,
+        "pending_industries": [name for name in job.industry_data['板块名称'] if name not in industry_stocks],
+        "pending_concepts": [name for name in job.concept_data['板块名称'] if name not in concept_stocks],
+        "reference": reference,
+    }
+    return snapshot
+
+def provisional_mask(snapshot, stock_codes):
+    """
+    标记暂定快照中结果可能随后台加载而变化的股票
+
+    有参考快照时，参考快照中属于未加载行业或概念的股票、以及参考快照中没有的股票记为暂定；
+    没有参考快照或板块列表尚未获取时无法判断，只要还有未加载的板块就全部记为暂定
+
+    参数:
+        snapshot: 快照字典
+        stock_codes: 股票代码列表
+
+    返回:
+        布尔数组，完整快照返回全False
+    """
+    codes = np.asarray(stock_codes, dtype=object)
+    info = snapshot.get("provisional")
+    if info is None:
+        return np.zeros(len(codes), dtype=bool)
+    if info["lists_pending"]:
+        return np.ones(len(codes), dtype=bool)
+    pending_industries, pending_concepts = info["pending_industries"], info["pending_concepts"]
+    reference = info["reference"]
+    if reference is None:
+        return np.full(len(codes), bool(pending_industries or pending_concepts))
+
+    positions = reference["code_index"].get_indexer(codes)
+    affected = (positions < 0) & bool(pending_industries or pending_concepts)
+    known = positions >= 0
+    if pending_industries:
+        industry_idx = reference["industry_of"][positions[known]]
+        pending = np.append(np.isin(reference["industry_names"], pending_industries), False)
+        affected[known] |= pending[industry_idx]
+    if pending_concepts:
+        indptr = reference["concept_indptr"]
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        pending = np.isin(reference["concept_names"], pending_concepts)[reference["concept_indices"]]
+        affected[known] |= np.isin(positions[known], rows[pending])
+    return affected
+
+def _finish_load_job(store, job):
+    """
+    用已完成的板块加载任务构建完整快照，多个会话同时完成等待时只构建一次
+
+    返回:
+        完整快照
+    """
+    with store["lock"]:
+        if store.get("load_job") is job:
+            store["load_job"] = None
+        elif job.error is None or _snapshot_fresh(store["snapshot"]):
+            return store["snapshot"]
+        if job.error is not None:
+            raise RuntimeError(f"加载板块数据时出错: {job.error}")
+        for message in job.errors:
+            st.warning(message)
+
+        boards = (job.industry_data, job.industry_stocks, job.concept_data, job.concept_stocks)
+        snapshot = build_membership_snapshot(job.stock_info, *boards, taxonomy_stocks=job.taxonomy_stocks)
+
+        # 随快照一起预先计算相似股票索引
+        get_similarity_index(snapshot)
+        store["snapshot"] = snapshot
+
+        # 发布为共享快照，并改用内存映射的版本，释放本进程的副本
+        if SHARED_SNAPSHOT_PATH:
+            try:
+                publish_shared_snapshot(snapshot)
+                store["snapshot"] = snapshot = load_shared_snapshot()
+                store["shared_identity"] = shared_snapshot_identity()
+            except Exception as e:
+                st.warning(f"发布共享快照时出错: {e}")
+
+        # 将本次刷新记录到历史快照中，历史记录失败不影响分析
+        try:
+            record_snapshot_history(job.stock_info, *boards, timestamp=snapshot["version"],
+                                    failed_industries=job.failed_industries, failed_concepts=job.failed_concepts)
+        except Exception as e:
+            st.warning(f"记录历史快照时出错: {e}")
+        return snapshot
+
+def _snapshot_fresh(snapshot):
+    """快照是否存在且未过期，与板块成分股缓存一样保留到下一个交易日开盘"""
+    return snapshot is not None and time.time() < membership_expiry(snapshot["built_at"])
+
+def get_membership_snapshot(progress_container=None, status_container=None, deadline=None):
+    """
+    获取当前的成分股快照，快照不存在或已过期时在后台加载板块数据并构建
+
+    优先挂载其他工作进程发布的共享快照，只有共享快照也不可用时才重新加载板块数据，
+    构建完成后发布为共享快照供其他进程使用。同一时间只有一个后台加载任务，其余会话
+    等待同一个任务。成分股（成员层）保留到下一个交易日开盘，概念得分则按交易时段内
+    刷新的板块行情（行情层）重新计算
+
+    参数:
+        progress_container: 加载板块数据时使用的进度条容器
+        status_container: 加载板块数据时使用的状态文本容器
+        deadline: 等待板块数据加载的最长秒数，超时后返回基于已加载板块的暂定快照，
+            其余板块在后台继续加载；默认一直等待
+
+    返回:
+        叠加了当前行情的快照字典；超时返回的暂定快照带有provisional字段
+    """
+    store = get_snapshot_store()
+    snapshot = store["snapshot"]
+    if _snapshot_fresh(snapshot) and store.get("shared_identity") == shared_snapshot_identity():
+        return with_current_quotes(store, snapshot)
+
+    with store["lock"]:
+        # 其他进程发布了新的共享快照时直接挂载
+        identity = shared_snapshot_identity()
+        if identity is not None and identity != store.get("shared_identity"):
+            try:
+                shared = load_shared_snapshot()
+                if _snapshot_fresh(shared) and (store["snapshot"] is None or shared["built_at"] >= store["snapshot"]["built_at"]):
+                    store["snapshot"] = shared
+            except Exception as e:
+                st.warning(f"挂载共享快照时出错: {e}")
+            store["shared_identity"] = identity
+
+        snapshot = store["snapshot"]
+        job = store.get("load_job")
+        if not _snapshot_fresh(snapshot) and job is None:
+            job = store["load_job"] = BoardLoadJob().start()
+    if _snapshot_fresh(snapshot):
+        return with_current_quotes(store, snapshot)
+
+    if progress_container is None:
+        progress_container = st.empty()
+    if status_container is None:
+        status_container = st.empty()
+    if not _wait_for_load_job(job, deadline, progress_container, status_container):
+        return build_provisional_snapshot(job, reference=snapshot)
+    return with_current_quotes(store, _finish_load_job(store, job))
+
+def _align(size):
+    """按共享快照的对齐字节数向上取整"""
+    return (size + SHARED_SNAPSHOT_ALIGN - 1) // SHARED_SNAPSHOT_ALIGN * SHARED_SNAPSHOT_ALIGN
+
+def _snapshot_arrays(snapshot):
+    """将快照转换为可写入共享文件的定长数组，字符串使用定长Unicode，缺失名称存为空字符串"""
+    arrays = {
+        "codes": snapshot["codes"].astype(str),
+        "names": pd.Series(snapshot["names"], dtype=object).fillna("").to_numpy().astype(str),
+        "industry_names": snapshot["industry_names"].astype(str),
+        "concept_names": snapshot["concept_names"].astype(str),
+        "taxonomies": snapshot["taxonomies"].astype(str),
+        "taxonomy_names": snapshot["taxonomy_names"].astype(str),
+    }
+    for key in ("industry_of", "taxonomy_offsets", "taxonomy_of", "concept_sizes", "concept_weights", "concept_precision",
+                "concept_heat", "concept_scores", "concept_indptr", "concept_indices"):
+        arrays[key] = snapshot[key]
+
+    index = snapshot.get("similarity_index")
+    if index is not None:
+        arrays["similar_positions"] = index["similar_positions"]
+        arrays["similar_scores"] = index["similar_scores"]
+    return {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+
+def publish_shared_snapshot(snapshot, path=None):
+    """
+    将快照写入共享的内存映射文件
+
+    文件由格式标识、JSON文件头和按64字节对齐的数组组成。先写入临时文件再原子替换，
+    已挂载旧版本的进程不受影响，新版本对之后挂载的进程立即可见
+
+    参数:
+        snapshot: 成分股快照
+        path: 共享文件路径，默认为SHARED_SNAPSHOT_PATH
+    """
+    path = path or SHARED_SNAPSHOT_PATH
+    arrays = _snapshot_arrays(snapshot)
+
+    header = {
+        "version": snapshot["version"],
+        "built_at": snapshot["built_at"],
+        "tables": {
+            "industry_data": snapshot["industry_data"].to_json(orient="split", force_ascii=False),
+            "concept_data": snapshot["concept_data"].to_json(orient="split", force_ascii=False),
+        },
+        "arrays": {},
+    }
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += _align(array.nbytes)
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    data_start = _align(len(SHARED_SNAPSHOT_MAGIC) + 8 + len(header_bytes))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(SHARED_SNAPSHOT_MAGIC)
+            f.write(len(header_bytes).to_bytes(8, "little"))
+            f.write(header_bytes)
+            for name, array in arrays.items():
+                f.seek(data_start + header["arrays"][name]["offset"])
+                array.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def shared_snapshot_identity(path=None):
+    """共享快照文件的标识（inode和修改时间），文件不存在时返回None"""
+    path = path or SHARED_SNAPSHOT_PATH
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns)
+
+def load_shared_snapshot(path=None):
+    """
+    以只读内存映射的方式挂载共享快照，数组数据不复制，同一主机的所有进程共享物理内存
+
+    参数:
+        path: 共享文件路径，默认为SHARED_SNAPSHOT_PATH
+
+    返回:
+        快照字典；文件不存在时返回None
+    """
+    path = path or SHARED_SNAPSHOT_PATH
+    if not path or not os.path.exists(path):
+        return None
+
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    magic_end = len(SHARED_SNAPSHOT_MAGIC)
+    if bytes(buffer[:magic_end]) != SHARED_SNAPSHOT_MAGIC:
+        raise ValueError(f"{path} 不是有效的共享快照文件")
+    header_length = int.from_bytes(bytes(buffer[magic_end:magic_end + 8]), "little")
+    header = json.loads(bytes(buffer[magic_end + 8:magic_end + 8 + header_length]).decode("utf-8"))
+    data_start = _align(magic_end + 8 + header_length)
+
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype, shape = np.dtype(spec["dtype"]), tuple(spec["shape"])
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.empty(shape, dtype=dtype)
+        else:
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=data_start + spec["offset"])
+
+    snapshot = {
+        "version": header["version"],
+        "built_at": header["built_at"],
+        "code_index": pd.Index(arrays["codes"]),
+        "industry_data": pd.read_json(io.StringIO(header["tables"]["industry_data"]), orient="split", dtype=False),
+        "concept_data": pd.read_json(io.StringIO(header["tables"]["concept_data"]), orient="split", dtype=False),
+    }
+    for key in ("codes", "names", "industry_names", "concept_names", "industry_of", "concept_sizes",
+                "concept_weights", "concept_precision", "concept_heat", "concept_scores",
+                "concept_indptr", "concept_indices", "taxonomies", "taxonomy_offsets",
+                "taxonomy_names", "taxonomy_of"):
+        snapshot[key] = arrays[key]
+
+    if "similar_positions" in arrays:
+        snapshot["similarity_index"] = {
+            "similar_positions": arrays["similar_positions"],
+            "similar_scores": arrays["similar_scores"],
+        }
+    return snapshot
+
+def format_top_concepts(positions, snapshot, top_k=TOP_CONCEPTS):
+    """
+    根据快照生成每只股票前top_k个相关概念的字符串
+
+    参数:
+        positions: 股票在快照代码表中的位置数组，-1表示不在快照中
+        snapshot: 成分股快照
+        top_k: 每只股票保留的概念数量
+
+    返回:
+        概念字符串列表，多个概念以逗号分隔
+    """
+    indptr = snapshot["concept_indptr"]
+    indices = snapshot["concept_indices"]
+    concept_names = snapshot["concept_names"]
+
+    labels = []
+    for pos in positions:
+        if pos < 0 or indptr[pos] == indptr[pos + 1]:
+            labels.append("暂无相关概念")
+            continue
+        start = indptr[pos]
+        end = min(indptr[pos + 1], start + top_k)
+        labels.append(", ".join(concept_names[indices[start:end]]))
+    return labels
+
+def classify_stocks(stock_codes, snapshot, top_k=TOP_CONCEPTS):
+    """
+    基于快照批量获取股票的名称、所属行业和相关概念
+
+    参数:
+        stock_codes: 股票代码列表
+        snapshot: 成分股快照
+        top_k: 每只股票保留的概念数量
+
+    返回:
+        股票信息DataFrame（不含序号列）和未找到的股票代码列表
+    """
+    codes = np.asarray(stock_codes, dtype=object)
+    positions = snapshot["code_index"].get_indexer(codes)
+
+    # 共享快照中缺失的名称存为空字符串；位置为-1时取到末尾追加的None，快照为空时同样适用
+    names = np.append(np.asarray(snapshot["names"], dtype=object), None)[positions]
+    missing_name = pd.isna(names) | (names == "")
+    names[missing_name] = "未知股票"
+
+    # 行业编号为-1时恰好取到末尾追加的"未知行业"
+    industry_idx = np.append(snapshot["industry_of"], -1)[positions]
+    industries = np.append(snapshot["industry_names"], "未知行业")[industry_idx]
+
+    result_df = pd.DataFrame({
+        "股票代码": codes,
+        "股票名称": names,
+        "所属行业": industries,
+        "相关概念": format_top_concepts(positions, snapshot, top_k),
+    })
+    return result_df, codes[missing_name].tolist()
+
+def weighted_concept_scores(snapshot, score_weights=DEFAULT_SCORE_WEIGHTS, excluded=()):
+    """
+    按给定系数重新计算快照中各概念的相关性得分
+
+    参数:
+        snapshot: 成分股快照
+        score_weights: (板块排序权重, 精确度, 热度) 三个因素的系数
+        excluded: 排除的概念名称，得分记为负无穷
+
+    返回:
+        各概念的综合得分数组
+    """
+    rank_weight, precision_weight, heat_weight = score_weights
+    scores = (snapshot["concept_weights"] * rank_weight
+              + snapshot["concept_precision"] * precision_weight
+              + snapshot["concept_heat"] * heat_weight)
+    if excluded:
+        scores = np.where(np.isin(snapshot["concept_names"], list(excluded)), -np.inf, scores)
+    return scores
+
+def rank_stock_concepts(positions, snapshot, scores, top_k=TOP_CONCEPTS):
+    """
+    从快照的概念成员关系中为每只股票选出得分最高的top_k个概念
+
+    参数:
+        positions: 股票在快照代码表中的位置数组，-1表示不在快照中
+        snapshot: 成分股快照
+        scores: 各概念的综合得分，负无穷表示排除
+        top_k: 每只股票保留的概念数量
+
+    返回:
+        (股票序号, 概念编号) 两个数组，按股票序号和概念名次排列
+    """
+    indptr = snapshot["concept_indptr"]
+    positions = np.asarray(positions)
+    found = positions >= 0
+    safe_positions = np.where(found, positions, 0)
+    starts = indptr[safe_positions]
+    lengths = np.where(found, indptr[safe_positions + 1] - starts, 0)
+
+    # 展开所选股票的全部 (股票, 概念) 成员关系
+    rows = np.repeat(np.arange(len(positions)), lengths)
+    offsets = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    concepts = snapshot["concept_indices"][offsets]
+    entry_scores = scores[concepts]
+    keep = entry_scores > -np.inf
+    rows, concepts, entry_scores = rows[keep], concepts[keep], entry_scores[keep]
+
+    # 按股票、得分从高到低排序，同分时保持板块原始顺序，与快照中的概念名次一致
+    order = np.lexsort((concepts, -entry_scores, rows))
+    rows, concepts = rows[order], concepts[order]
+    rank_in_row = np.arange(len(rows)) - np.searchsorted(rows, rows, side="left")
+    top = rank_in_row < top_k
+    return rows[top], concepts[top]
+
+def rescore_portfolio(stocks_df, snapshot, score_weights=DEFAULT_SCORE_WEIGHTS, top_k=TOP_CONCEPTS, excluded=()):
+    """
+    按新的评分参数重新选出每只股票的相关概念并统计概念分布，
+    只使用快照中保留的成员关系和得分数组，无需重新获取数据
+
+    参数:
+        stocks_df: 已分析的股票信息DataFrame
+        snapshot: 分析时使用的成分股快照
+        score_weights: (板块排序权重, 精确度, 热度) 三个因素的系数
+        top_k: 每只股票保留的概念数量
+        excluded: 排除的概念名称
+
+    返回:
+        (更新了相关概念列的股票DataFrame, 概念分布Counter, 概念-股票映射字典)
+    """
+    result_df = stocks_df.copy()
+    if result_df.empty:
+        return result_df, Counter(), {}
+
+    codes = result_df["股票代码"].to_numpy()
+    names = result_df["股票名称"].to_numpy()
+    positions = snapshot["code_index"].get_indexer(codes)
+    scores = weighted_concept_scores(snapshot, score_weights, excluded)
+    rows, concepts = rank_stock_concepts(positions, snapshot, scores, top_k)
+    concept_names = np.asarray(snapshot["concept_names"]).astype(object)
+
+    # 每只股票的相关概念字符串
+    per_stock = np.split(concept_names[concepts], np.searchsorted(rows, np.arange(1, len(result_df))))
+    result_df["相关概念"] = [", ".join(labels) if len(labels) else "暂无相关概念" for labels in per_stock]
+
+    # 按概念首次出现的顺序统计分布，与analyze_concept_distribution的结果一致
+    unique_concepts, first_seen, counts = np.unique(concepts, return_index=True, return_counts=True)
+    member_rows = np.split(rows[np.argsort(concepts, kind="stable")], np.cumsum(counts)[:-1])
+    concept_distribution = Counter()
+    concept_stocks_map = {}
+    for i in np.argsort(first_seen):
+        concept = str(concept_names[unique_concepts[i]])
+        concept_distribution[concept] = int(counts[i])
+        concept_stocks_map[concept] = [{"代码": codes[r], "名称": names[r]} for r in member_rows[i]]
+    return result_df, concept_distribution, concept_stocks_map
+
+def concept_membership_matrix(snapshot):
+    """
+    将快照中的概念成员关系转换为稀疏矩阵
+
+    参数:
+        snapshot: 成分股快照
+
+    返回:
+        股票×概念的CSR稀疏矩阵，成员关系为1
+    """
+    indices = snapshot["concept_indices"]
+    return sp.csr_matrix(
+        (np.ones(len(indices), dtype=np.float32), indices, snapshot["concept_indptr"]),
+        shape=(len(snapshot["codes"]), len(snapshot["concept_names"]))
+    )
+
+def build_similarity_index(snapshot, top_k=SIMILAR_TOP_K, block_size=SIMILARITY_BLOCK_SIZE):
+    """
+    构建相似股票索引
+
+    股票之间的相似度为概念成员关系的Jaccard系数，按批次用稀疏矩阵乘法计算交集，
+    每只股票只保留相似度最高的top_k只股票
+
+    参数:
+        snapshot: 成分股快照
+        top_k: 每只股票保留的相似股票数量
+        block_size: 每批计算的股票数量
+
+    返回:
+        索引字典，包含相似股票位置和相似度
+    """
+    membership = concept_membership_matrix(snapshot)
+    membership_t = membership.T.tocsr()
+    concept_counts = np.diff(snapshot["concept_indptr"]).astype(np.float32)
+    total_stocks = membership.shape[0]
+    top_k = max(0, min(top_k, total_stocks - 1))
+
+    similar_positions = np.full((total_stocks, top_k), -1, dtype=np.int32)
+    similar_scores = np.zeros((total_stocks, top_k), dtype=np.float32)
+
+    for start in range(0, total_stocks, block_size):
+        end = min(start + block_size, total_stocks)
+        rows = np.arange(end - start)
+        intersection = (membership[start:end] @ membership_t).toarray()
+        union = concept_counts[start:end, None] + concept_counts[None, :] - intersection
+        jaccard = np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+        # 排除股票自身
+        jaccard[rows, np.arange(start, end)] = 0
+
+        if top_k == 0:
+            continue
+        candidates = np.argpartition(-jaccard, top_k - 1, axis=1)[:, :top_k]
+        candidate_scores = jaccard[rows[:, None], candidates]
+        order = np.argsort(-candidate_scores, axis=1, kind='stable')
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+
+        similar_positions[start:end] = np.where(candidate_scores > 0, candidates, -1)
+        similar_scores[start:end] = candidate_scores
+
+    return {
+        "similar_positions": similar_positions,
+        "similar_scores": similar_scores,
+    }
+
+def get_similarity_index(snapshot):
+    """获取快照对应的相似度索引，首次使用时计算并随快照保存"""
+    if "similarity_index" not in snapshot:
+        snapshot["similarity_index"] = build_similarity_index(snapshot)
+    return snapshot["similarity_index"]
+
+def _reverse_membership(member_of_rows, n_boards):
+    """
+    将 (股票, 板块) 成员关系按板块重新分组
+
+    参数:
+        member_of_rows: (股票位置数组, 板块编号数组)
+        n_boards: 板块数量
+
+    返回:
+        (indptr, members)，板块j的成分股位置为 members[indptr[j]:indptr[j + 1]]，按代码表顺序排列
+    """
+    rows, boards = member_of_rows
+    order = np.argsort(boards, kind="stable")
+    indptr = np.zeros(n_boards + 1, dtype=np.int64)
+    np.cumsum(np.bincount(boards, minlength=n_boards), out=indptr[1:])
+    return indptr, rows[order]
+
+def build_board_index(snapshot):
+    """
+    构建板块到全市场成分股的反向索引
+
+    行业按每个行业分类标准下股票的所属行业分组，概念按概念成员关系分组
+
+    返回:
+        反向索引字典，键为各行业分类标准名称和"概念"，包含板块名称到编号的映射以及分组后的成分股位置
+    """
+    index = {}
+    offsets = snapshot["taxonomy_offsets"]
+    for t, taxonomy in enumerate(np.asarray(snapshot["taxonomies"]).tolist()):
+        industry_of = snapshot["taxonomy_of"][t]
+        assigned = np.flatnonzero(industry_of >= 0)
+        industry_names = np.asarray(snapshot["taxonomy_names"][offsets[t]:offsets[t + 1]]).tolist()
+        index[taxonomy] = {
+            "ids": {name: i for i, name in enumerate(industry_names)},
+            "members": _reverse_membership((assigned, industry_of[assigned] - offsets[t]), len(industry_names)),
+        }
+
+    concept_indptr = snapshot["concept_indptr"]
+    concept_rows = np.repeat(np.arange(len(concept_indptr) - 1), np.diff(concept_indptr))
+    concept_names = np.asarray(snapshot["concept_names"]).tolist()
+    index["概念"] = {
+        "ids": {name: i for i, name in enumerate(concept_names)},
+        "members": _reverse_membership((concept_rows, snapshot["concept_indices"]), len(concept_names)),
+    }
+    return index
+
+def get_board_index(snapshot):
+    """获取快照对应的板块反向索引，首次使用时计算并随快照保存"""
+    if "board_index" not in snapshot:
+        snapshot["board_index"] = build_board_index(snapshot)
+    return snapshot["board_index"]
+
+def board_overlap(snapshot, dimension, board_name, held_codes, taxonomy=DEFAULT_TAXONOMY):
+    """
+    查询板块的全市场成分股以及与组合的重合情况
+
+    参数:
+        snapshot: 成分股快照
+        dimension: "行业"或"概念"
+        board_name: 板块名称
+        held_codes: 组合中的股票代码
+        taxonomy: 维度为行业时使用的行业分类标准
+
+    返回:
+        (成分股DataFrame, 重合统计字典)；快照中没有该板块时返回 (None, None)
+    """
+    index = get_board_index(snapshot)[taxonomy if dimension == "行业" else dimension]
+    board_id = index["ids"].get(board_name)
+    if board_id is None:
+        return None, None
+
+    indptr, members = index["members"]
+    positions = members[indptr[board_id]:indptr[board_id + 1]]
+    held_positions = snapshot["code_index"].get_indexer(list(held_codes))
+    held = np.isin(positions, held_positions[held_positions >= 0])
+
+    names = pd.Series(snapshot["names"][positions], dtype=object)
+    members_df = pd.DataFrame({
+        "股票代码": np.asarray(snapshot["codes"][positions], dtype=object),
+        "股票名称": names.where(names.notna() & (names != ""), "未知股票").to_numpy(),
+        "是否持有": held,
+    })
+    # 已持有的股票排在前面
+    members_df = members_df.sort_values("是否持有", ascending=False, kind="stable").reset_index(drop=True)
+
+    held_count = int(held.sum())
+    portfolio_size = len(set(held_codes))
+    overlap = {
+        "板块成分股数": len(positions),
+        "已持有": held_count,
+        "未持有": len(positions) - held_count,
+        "板块覆盖率": held_count / len(positions) if len(positions) else 0.0,
+        "组合占比": held_count / portfolio_size if portfolio_size else 0.0,
+    }
+    return members_df, overlap
+
+def find_similar_stocks(snapshot, stock_code, top_k=10, held_codes=None):
+    """
+    查询与指定股票概念最相近的股票
+
+    参数:
+        snapshot: 成分股快照
+        stock_code: 股票代码
+        top_k: 返回的相似股票数量
+        held_codes: 当前组合中的股票代码，用于标记是否持有
+
+    返回:
+        相似股票DataFrame
+    """
+    columns = ["股票代码", "股票名称", "相似度", "共同概念数", "共同概念", "是否持有"]
+    position = snapshot["code_index"].get_indexer([stock_code])[0]
+    if position < 0:
+        return pd.DataFrame(columns=columns)
+
+    index = get_similarity_index(snapshot)
+    positions = index["similar_positions"][position, :top_k]
+    scores = index["similar_scores"][position, :top_k]
+    valid = positions >= 0
+    positions, scores = positions[valid], scores[valid]
+
+    indptr = snapshot["concept_indptr"]
+    indices = snapshot["concept_indices"]
+    own_concepts = indices[indptr[position]:indptr[position + 1]]
+    shared = [
+        np.intersect1d(own_concepts, indices[indptr[p]:indptr[p + 1]])
+        for p in positions
+    ]
+    held_codes = set(held_codes or [])
+    codes = snapshot["codes"][positions]
+    names = pd.Series(snapshot["names"][positions], dtype=object)
+    names[names.isna() | (names == "")] = "未知股票"
+    return pd.DataFrame({
+        "股票代码": codes,
+        "股票名称": names.to_numpy(),
+        "相似度": np.round(scores, 3),
+        "共同概念数": [len(c) for c in shared],
+        "共同概念": [", ".join(snapshot["concept_names"][c][:5]) for c in shared],
+        "是否持有": ["是" if code in held_codes else "否" for code in codes],
+    }, columns=columns)
+
+def portfolio_concept_cooccurrence(snapshot, stock_codes, top_n=20):
+    """
+    统计组合内股票的概念共现情况
+
+    参数:
+        snapshot: 成分股快照
+        stock_codes: 组合的股票代码列表
+        top_n: 返回的概念对数量
+
+    返回:
+        (共现最多的概念对DataFrame, 组合内的概念共现矩阵, 对应的概念位置数组)
+    """
+    positions = snapshot["code_index"].get_indexer(pd.unique(np.asarray(stock_codes, dtype=object)))
+    positions = positions[positions >= 0]
+    membership = concept_membership_matrix(snapshot)[positions]
+    cooccurrence = (membership.T @ membership).tocoo()
+
+    # 只取上三角（不含对角线）的概念对
+    upper = cooccurrence.row < cooccurrence.col
+    rows, cols, counts = cooccurrence.row[upper], cooccurrence.col[upper], cooccurrence.data[upper]
+    order = np.argsort(-counts, kind='stable')[:top_n]
+    concept_names = snapshot["concept_names"]
+    pairs_df = pd.DataFrame({
+        "概念A": concept_names[rows[order]],
+        "概念B": concept_names[cols[order]],
+        "共同股票数": counts[order].astype(int),
+    })
+
+    # 组合内出现最多的概念及其共现矩阵，用于绘制热力图
+    concept_totals = np.asarray(membership.sum(axis=0)).ravel()
+    top_concepts = np.argsort(-concept_totals, kind='stable')[:15]
+    top_concepts = top_concepts[concept_totals[top_concepts] > 0]
+    matrix = cooccurrence.tocsr()[top_concepts][:, top_concepts].toarray().astype(int)
+    return pairs_df, matrix, top_concepts
+
+# 历史快照存储目录
+HISTORY_DIR = os.environ.get("STOCK_ANALYZER_HISTORY_DIR", "snapshot_history")
+# 每隔多少条增量记录写入一次完整基线
+HISTORY_BASE_EVERY = 24
+
+def list_history_records():
+    """
+    列出历史快照目录中的所有记录
+
+    返回:
+        按时间升序排列的 (时间戳, 类型, 文件路径) 列表，类型为"base"或"delta"
+    """
+    if not os.path.isdir(HISTORY_DIR):
+        return []
+    records = []
+    for filename in os.listdir(HISTORY_DIR):
+        match = re.match(r'^(\d{14})\.(base|delta)\.json\.gz$', filename)
+        if match:
+            records.append((match.group(1), match.group(2), os.path.join(HISTORY_DIR, filename)))
+    return sorted(records)
+
+def _read_history_record(path):
+    """读取一条历史快照记录"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+def _write_history_record(record, timestamp, kind):
+    """原子地写入一条历史快照记录"""
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    path = os.path.join(HISTORY_DIR, f"{timestamp}.{kind}.json.gz")
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump(record, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return path
+
+def _board_table(board_data):
+    """提取板块表的名称和涨跌幅，按原始顺序保存"""
+    change_rates = board_data['涨跌幅'] if '涨跌幅' in board_data.columns else [None] * len(board_data)
+    table = []
+    for name, rate in zip(board_data['板块名称'], change_rates):
+        rate = parse_change_rate(rate)
+        table.append([name, None if np.isnan(rate) else rate])
+    return table
+
+def _history_state(stock_info, industry_data, industry_stocks_cache, concept_data, concept_stocks_cache):
+    """将当前的板块数据转换为历史快照状态"""
+    return {
+        "names": dict(zip(stock_info['code'].astype(str), stock_info['name'])),
+        "industry_boards": _board_table(industry_data),
+        "concept_boards": _board_table(concept_data),
+        "industry_members": {name: set(_member_codes(df)) for name, df in industry_stocks_cache.items()},
+        "concept_members": {name: set(_member_codes(df)) for name, df in concept_stocks_cache.items()},
+    }
+
+def _apply_history_record(state, record):
+    """将一条基线或增量记录应用到历史快照状态上"""
+    if record["kind"] == "base":
+        return {
+            "names": dict(record["names"]),
+            "industry_boards": record["industry_boards"],
+            "concept_boards": record["concept_boards"],
+            "industry_members": {name: set(codes) for name, codes in record["industry_members"].items()},
+            "concept_members": {name: set(codes) for name, codes in record["concept_members"].items()},
+        }
+
+    state["names"].update(record["names"])
+    for code in record["removed_names"]:
+        state["names"].pop(code, None)
+    state["industry_boards"] = record["industry_boards"]
+    state["concept_boards"] = record["concept_boards"]
+    for kind in ("industry_members", "concept_members"):
+        members = state[kind]
+        for name, change in record[kind].items():
+            codes = members.setdefault(name, set())
+            codes.difference_update(change["removed"])
+            codes.update(change["added"])
+    return state
+
+def reconstruct_history_state(timestamp=None):
+    """
+    重建某个时间点的历史快照状态
+
+    参数:
+        timestamp: 目标记录的时间戳（YYYYmmddHHMMSS），默认为最新记录
+
+    返回:
+        历史快照状态字典和实际使用的记录时间戳；没有可用记录时返回 (None, None)
+    """
+    records = [r for r in list_history_records() if timestamp is None or r[0] <= timestamp]
+    base_positions = [i for i, r in enumerate(records) if r[1] == "base"]
+    if not base_positions:
+        return None, None
+
+    # 从最近的基线开始依次应用增量
+    state = None
+    for _, _, path in records[base_positions[-1]:]:
+        state = _apply_history_record(state, _read_history_record(path))
+    return state, records[-1][0]
+
+def record_snapshot_history(stock_info, industry_data, industry_stocks_cache, concept_data, concept_stocks_cache, timestamp,
+                            failed_industries=(), failed_concepts=()):
+    """
+    将一次刷新得到的板块数据记录到历史快照中
+
+    相对上一条记录只保存各板块新增和移除的成分股，每隔HISTORY_BASE_EVERY条增量写入一次完整基线。
+    获取失败的板块沿用上一条记录中的成分股，没有上一条记录时不记录该板块，不会被当作成分股全部移出
+
+    参数:
+        stock_info: A股代码和名称数据
+        industry_data: 行业分类数据
+        industry_stocks_cache: 行业成分股缓存
+        concept_data: 概念分类数据
+        concept_stocks_cache: 概念成分股缓存
+        timestamp: 记录时间戳（YYYYmmddHHMMSS）
+        failed_industries: 本次获取成分股失败的行业名称
+        failed_concepts: 本次获取成分股失败的概念名称
+
+    返回:
+        写入的记录文件路径
+    """
+    current = _history_state(stock_info, industry_data, industry_stocks_cache, concept_data, concept_stocks_cache)
+    records = list_history_records()
+    base_positions = [i for i, r in enumerate(records) if r[1] == "base"]
+    previous, _ = reconstruct_history_state()
+
+    for kind, failed in (("industry_members", failed_industries), ("concept_members", failed_concepts)):
+        for name in failed:
+            if previous is not None and name in previous[kind]:
+                current[kind][name] = previous[kind][name]
+            else:
+                current[kind].pop(name, None)
+
+    if previous is None or len(records) - 1 - base_positions[-1] >= HISTORY_BASE_EVERY:
+        record = {
+            "kind": "base",
+            "timestamp": timestamp,
+            "names": current["names"],
+            "industry_boards": current["industry_boards"],
+            "concept_boards": current["concept_boards"],
+            "industry_members": {name: sorted(codes) for name, codes in current["industry_members"].items()},
+            "concept_members": {name: sorted(codes) for name, codes in current["concept_members"].items()},
+        }
+        return _write_history_record(record, timestamp, "base")
+
+    record = {
+        "kind": "delta",
+        "timestamp": timestamp,
+        "names": {code: name for code, name in current["names"].items() if previous["names"].get(code) != name},
+        "removed_names": sorted(set(previous["names"]) - set(current["names"])),
+        "industry_boards": current["industry_boards"],
+        "concept_boards": current["concept_boards"],
+    }
+    for kind in ("industry_members", "concept_members"):
+        changes = {}
+        for name in set(previous[kind]) | set(current[kind]):
+            old_codes = previous[kind].get(name, set())
+            new_codes = current[kind].get(name, set())
+            if old_codes != new_codes:
+                changes[name] = {"added": sorted(new_codes - old_codes), "removed": sorted(old_codes - new_codes)}
+        record[kind] = changes
+    return _write_history_record(record, timestamp, "delta")
+
+# 创建缓存函数加载历史快照
+@st.cache_resource(max_entries=8, show_spinner=False)
+def load_history_snapshot(timestamp):
+    """
+    根据历史记录重建指定时间点的成分股快照，无需联网
+
+    参数:
+        timestamp: 目标记录的时间戳
+
+    返回:
+        快照字典；没有可用记录时返回None
+    """
+    state, record_ts = reconstruct_history_state(timestamp)
+    if state is None:
+        return None
+
+    def board_frame(boards):
+        return pd.DataFrame(boards, columns=['板块名称', '涨跌幅'])
+
+    def member_frames(boards, members):
+        # 按板块表顺序组织成分股，与实时加载时的顺序一致
+        return {name: pd.DataFrame({'代码': sorted(members.get(name, ()))}) for name, _ in boards}
+
+    stock_info = pd.DataFrame(list(state["names"].items()), columns=['code', 'name'])
+    built_at = time.mktime(time.strptime(record_ts, '%Y%m%d%H%M%S'))
+    return build_membership_snapshot(
+        stock_info,
+        board_frame(state["industry_boards"]),
+        member_frames(state["industry_boards"], state["industry_members"]),
+        board_frame(state["concept_boards"]),
+        member_frames(state["concept_boards"], state["concept_members"]),
+        built_at=built_at,
+    )
+
+def history_snapshot_options():
+    """
+    历史快照的可选日期，每个日期对应当天的最后一条记录
+
+    返回:
+        {日期字符串: 记录时间戳} 字典，按日期从新到旧排列
+    """
+    latest_by_date = {}
+    for record_ts, _, _ in list_history_records():
+        latest_by_date[f"{record_ts[:4]}-{record_ts[4:6]}-{record_ts[6:8]}"] = record_ts
+    return dict(sorted(latest_by_date.items(), reverse=True))
 
 # 股票代码输入区域
 stock_codes_input = st.text_area(
@@ -219,6 +1888,78 @@ stock_codes_input = st.text_area(
     placeholder="在此输入股票代码，如：600519、000858、002594，601398..."
 )
 
+# 持仓文件上传区域
+uploaded_file = st.file_uploader(
+    "或上传持仓文件（CSV/XLSX）:",
+    type=["csv", "xlsx"],
+    key="holdings_file",
+    help="自动识别代码列和权重列，支持SH/SZ/BJ前缀和.SH/.SZ/.BJ后缀，相同股票的权重会合并"
+)
+
+# 大规模模式选项
+scale_col1, scale_col2 = st.columns(2)
+with scale_col1:
+    scale_mode = st.checkbox(
+        "大规模模式",
+        key="scale_mode",
+        help=f"不受{MAX_STOCK_CODES}只的数量限制，分批分类并优先展示汇总结果，股票表格分页显示"
+    )
+with scale_col2:
+    full_market = st.checkbox(
+        "分析全市场A股",
+        key="full_market",
+        disabled=not scale_mode,
+        help="忽略输入框，直接分析全部A股"
+    )
+
+# 历史快照选择，选择历史日期时直接使用当天最后一次记录的成分股，不再联网获取
+history_options = history_snapshot_options()
+snapshot_choice = st.selectbox(
+    "成分股快照日期",
+    ["最新"] + list(history_options.keys()),
+    key="snapshot_date",
+    help="选择历史日期可查看当时的行业和概念分布"
+)
+
+# 分析时限，成分股数据需要重新加载且超过时限时先展示暂定结果
+analysis_deadline = st.number_input(
+    "分析时限（秒）",
+    min_value=0,
+    value=ANALYSIS_DEADLINE,
+    step=5,
+    key="analysis_deadline",
+    help="成分股数据需要重新加载时，超过时限后先展示基于已加载板块的暂定结果，其余板块在后台继续加载，完成后自动更新为完整结果；0表示等待全部加载完成"
+)
+
+# 股票代码格式：可选的交易所前缀或后缀 + 6位数字
+STOCK_CODE_PATTERN = r'^(?:SH|SZ|BJ)?\.?(\d{6})(?:\.(?:SH|SZ|BJ|SS))?$'
+# 持仓文件中不足6位的数字代码（Excel会去掉前导零）
+PADDED_STOCK_CODE_PATTERN = r'^(?:SH|SZ|BJ)?\.?(\d{1,6})(?:\.(?:SH|SZ|BJ|SS))?$'
+# 持仓文件每批读取的行数
+HOLDINGS_CHUNK_ROWS = 50000
+# 持仓文件中可能的代码列和权重列名称（按优先级排列）
+CODE_COLUMN_NAMES = ['股票代码', '证券代码', '代码', '证券编码', 'code', 'symbol', 'ticker', 'stock_code']
+# 持仓数量等股数列不是权重，未列入
+WEIGHT_COLUMN_NAMES = ['权重', '持仓权重', '持仓市值', '市值', '参考市值', 'weight', 'market_value']
+
+def normalize_stock_codes(values, pad=False):
+    """
+    批量标准化股票代码，去除SH/SZ/BJ前缀和.SH/.SZ/.BJ后缀
+
+    参数:
+        values: 股票代码的Series或列表
+        pad: 是否将不足6位的数字代码补齐前导零（用于Excel等会丢失前导零的文件）
+
+    返回:
+        标准化后的6位代码Series，无效代码为NaN
+    """
+    text = pd.Series(values, dtype=object).astype(str).str.strip().str.upper()
+    if not pad:
+        return text.str.extract(STOCK_CODE_PATTERN, expand=False)
+    # 数值单元格可能带有".0"
+    text = text.str.replace(r'^(\d+)\.0+$', r'\1', regex=True)
+    return text.str.extract(PADDED_STOCK_CODE_PATTERN, expand=False).str.zfill(6)
+
 # 解析股票代码函数
 def parse_stock_codes(input_text):
     """
@@ -236,143 +1977,231 @@ def parse_stock_codes(input_text):
     # 替换顿号和逗号（包括中英文）为空格，然后按空格分割
     codes = re.split(r'[、,，\s]+', input_text.strip())
     # 移除空字符串
-    codes = [code for code in codes if code]
-    
-    # 标准化股票代码格式并验证
-    formatted_codes = []
-    invalid_codes = []
+    codes = pd.Series([code for code in codes if code], dtype=object)
     
-    for code in codes:
-        # 移除可能的前缀
-        if code.upper().startswith(('SH', 'SZ')):
-            code = code[2:]
-        
-        # 验证股票代码格式：必须是6位数字
-        if re.match(r'^\d{6}$', code):
-            formatted_codes.append(code)
+    # 标准化股票代码格式并验证：必须是6位数字
+    normalized = normalize_stock_codes(codes)
+    valid = normalized.notna()
+    return normalized[valid].tolist(), codes[~valid].tolist()
+
+def detect_holdings_columns(sample_df):
+    """
+    识别持仓文件中的代码列和权重列
+
+    优先按列名匹配，列名无法识别时选择样本中可解析为股票代码比例最高的列
+
+    参数:
+        sample_df: 持仓文件的样本数据（所有列均为字符串）
+
+    返回:
+        (代码列名, 权重列名)，未找到权重列时为None
+    """
+    columns = [str(c).strip() for c in sample_df.columns]
+    lower_columns = {c.lower(): original for c, original in zip(columns, sample_df.columns)}
+
+    code_column = next((lower_columns[name.lower()] for name in CODE_COLUMN_NAMES if name.lower() in lower_columns), None)
+    if code_column is None:
+        match_rates = {
+            column: normalize_stock_codes(sample_df[column].dropna(), pad=True).notna().mean()
+            for column in sample_df.columns if sample_df[column].notna().any()
+        }
+        if match_rates and max(match_rates.values()) >= 0.5:
+            code_column = max(match_rates, key=match_rates.get)
+
+    weight_column = next((lower_columns[name.lower()] for name in WEIGHT_COLUMN_NAMES if name.lower() in lower_columns), None)
+    return code_column, weight_column
+
+def _iter_csv_chunks(file):
+    """按批读取CSV持仓文件，自动识别编码和分隔符"""
+    sample = file.read(65536)
+    file.seek(0)
+    try:
+        text = codecs.getincrementaldecoder('utf-8-sig')().decode(sample, final=False)
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError:
+        text = sample.decode('gbk', errors='ignore')
+        encoding = 'gbk'
+    try:
+        delimiter = csv.Sniffer().sniff(text.split('\n', 1)[0], delimiters=',\t;|').delimiter
+    except csv.Error:
+        delimiter = ','
+
+    yield from pd.read_csv(file, dtype=str, encoding=encoding, sep=delimiter,
+                           chunksize=HOLDINGS_CHUNK_ROWS, skipinitialspace=True)
+
+def _text_frame(rows, header):
+    """将单元格数据转换为字符串列的DataFrame，空单元格保留为NaN"""
+    df = pd.DataFrame(rows, columns=header, dtype=object)
+    return df.apply(lambda column: column.where(column.isna(), column.astype(str)))
+
+def _iter_xlsx_chunks(file):
+    """以只读模式按批读取XLSX持仓文件的第一个工作表"""
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = None
+        for row in rows:
+            if any(cell is not None for cell in row):
+                header = [str(cell).strip() if cell is not None else f"列{i + 1}" for i, cell in enumerate(row)]
+                break
+        if header is None:
+            return
+
+        width = len(header)
+        batch = []
+        for row in rows:
+            batch.append(tuple(row[:width]) + (None,) * (width - len(row)))
+            if len(batch) >= HOLDINGS_CHUNK_ROWS:
+                yield _text_frame(batch, header)
+                batch = []
+        if batch:
+            yield _text_frame(batch, header)
+    finally:
+        workbook.close()
+
+def read_holdings_file(file, filename):
+    """
+    流式读取持仓文件，识别代码列并按股票合并权重
+
+    文件按批读取，每批只保留代码列和权重列并立即聚合，内存占用只与股票数量有关
+
+    参数:
+        file: 文件对象
+        filename: 文件名，用于判断文件类型
+
+    返回:
+        (持仓DataFrame, 统计信息字典)，持仓DataFrame包含"股票代码"和"持仓权重"两列，
+        按股票首次出现的顺序排列，权重已归一化
+    """
+    chunks = _iter_xlsx_chunks(file) if filename.lower().endswith('.xlsx') else _iter_csv_chunks(file)
+
+    code_column, weight_column = None, None
+    aggregated = []
+    total_rows, invalid_rows = 0, 0
+    for chunk in chunks:
+        if code_column is None:
+            code_column, weight_column = detect_holdings_columns(chunk.head(200))
+            if code_column is None:
+                raise ValueError("未能在文件中识别出股票代码列")
+
+        codes = normalize_stock_codes(chunk[code_column], pad=True)
+        if weight_column is not None:
+            # 去掉千分位逗号和百分号，"3.2%"按3.2计，归一化后与小数权重等价
+            weights = chunk[weight_column].str.replace(r'[,，%％\s]', '', regex=True)
+            weights = pd.to_numeric(weights, errors='coerce').fillna(0.0)
         else:
-            invalid_codes.append(code)
-    
-    return formatted_codes, invalid_codes
+            # 没有权重列时只做去重，不输出权重
+            weights = pd.Series(0.0, index=chunk.index)
+
+        valid = codes.notna()
+        total_rows += len(chunk)
+        invalid_rows += int((~valid & chunk[code_column].notna()).sum())
+        aggregated.append(weights[valid].groupby(codes[valid], sort=False).sum())
+
+    if aggregated:
+        holdings = pd.concat(aggregated).groupby(level=0, sort=False).sum()
+    else:
+        holdings = pd.Series(dtype=float)
+    total_weight = holdings.sum()
+    holdings_df = pd.DataFrame({
+        "股票代码": holdings.index.astype(str),
+        "持仓权重": (holdings / total_weight).to_numpy() if weight_column is not None and total_weight else np.nan,
+    })
+    stats = {
+        "总行数": total_rows,
+        "无效代码行数": invalid_rows,
+        "股票数量": len(holdings_df),
+        "代码列": code_column,
+        "权重列": weight_column,
+    }
+    return holdings_df, stats
+
+def get_uploaded_holdings(uploaded_file):
+    """解析上传的持仓文件，同一文件只解析一次"""
+    file_key = (uploaded_file.name, uploaded_file.size, getattr(uploaded_file, "file_id", None))
+    if st.session_state.get("holdings_file_key") != file_key:
+        uploaded_file.seek(0)
+        st.session_state.holdings_result = read_holdings_file(uploaded_file, uploaded_file.name)
+        st.session_state.holdings_file_key = file_key
+    return st.session_state.holdings_result
 
 # 获取股票信息的函数
-def get_stock_info(stock_codes):
+def render_not_found_warning(not_found_stocks):
+    """显示快照中未找到的股票代码，最多列出50个"""
+    if not_found_stocks:
+        shown = not_found_stocks[:50]
+        more = f" 等{len(not_found_stocks)}个" if len(not_found_stocks) > len(shown) else ""
+        st.warning(f"以下股票代码未找到: {', '.join(shown)}{more}")
+
+def get_stock_info(stock_codes, chunk_size=SCALE_CHUNK_SIZE, online_fallback=True, snapshot=None, not_found=None):
     """
     获取股票的基本信息、所属行业和概念
-    
+
+    股票按批次基于成分股快照进行分类，每批结束后更新一次进度，
+    避免逐只股票拼接DataFrame和线性扫描所有板块
+
     参数:
         stock_codes: 股票代码列表
-        
-    返回:
-        包含股票信息的DataFrame
-    """
-    # 初始化结果DataFrame
-    result_df = pd.DataFrame(columns=["序号", "股票代码", "股票名称", "所属行业", "相关概念"])
-    
-    # 获取股票基本信息
-    stock_info = get_stock_basic_info()
-    
-    # 创建股票代码到名称的映射
-    code_to_name = dict(zip(stock_info['code'], stock_info['name']))
-    
-    # 获取行业分类数据
-    industry_data = get_industry_list()
-    
-    # 获取概念分类数据
-    concept_data = get_concept_list()
-    
+        chunk_size: 每批分类的股票数量
+        online_fallback: 快照中找不到行业时是否实时查询
+        snapshot: 使用指定的成分股快照（如历史快照），默认使用当前快照
+        not_found: 提供列表时将未找到的股票代码追加到其中，不直接显示警告
+
+    返回:
+        包含股票信息的DataFrame
+    """
     # 创建进度条容器
     progress_container = st.empty()
     status_container = st.empty()
-    
-    # 提前缓存所有行业的成分股数据
-    industry_stocks_cache = {}
-    with progress_container.container():
-        st.markdown("<p><div class='loading-spinner'></div> <b>正在加载所有行业数据...</b></p>", unsafe_allow_html=True)
-        progress_bar = st.progress(0)
-        
-        total_industries = len(industry_data)
-        for i, (_, row) in enumerate(industry_data.iterrows()):
-            industry_name = row['板块名称']
-            industry_stocks_cache[industry_name] = get_industry_stocks(industry_name)
-            
-            # 更新进度和状态
-            progress = (i + 1) / total_industries
-            progress_bar.progress(progress)
-            status_container.markdown(f"正在加载: {industry_name} ({i+1}/{total_industries})")
-            
-            # 每加载10个行业更新一次界面
-            if (i + 1) % 10 == 0 or i == total_industries - 1:
-                status_container.markdown(f"已加载 {i+1}/{total_industries} 个行业")
-    
-    # 提前缓存所有概念的成分股数据
-    concept_stocks_cache = {}
-    with progress_container.container():
-        st.markdown("<p><div class='loading-spinner'></div> <b>正在加载所有概念数据 (这可能需要几分钟时间)...</b></p>", unsafe_allow_html=True)
-        progress_bar = st.progress(0)
-        
-        total_concepts = len(concept_data)
-        for i, (_, row) in enumerate(concept_data.iterrows()):
-            concept_name = row['板块名称']
-            concept_stocks_cache[concept_name] = get_concept_stocks(concept_name)
-            
-            # 更新进度和状态
-            progress = (i + 1) / total_concepts
-            progress_bar.progress(progress)
-            status_container.markdown(f"正在加载: {concept_name} ({i+1}/{total_concepts})")
-            
-            # 每加载20个概念更新一次界面
-            if (i + 1) % 20 == 0 or i == total_concepts - 1:
-                status_container.markdown(f"已加载 {i+1}/{total_concepts} 个概念")
-    
-    # 分析股票数据
+
+    # 获取成分股快照（必要时加载所有板块数据）
+    if snapshot is None:
+        snapshot = get_membership_snapshot(progress_container, status_container)
+
+    # 分批分析股票数据
+    chunks = []
+    not_found_stocks = []
     with progress_container.container():
         st.markdown("<p><div class='loading-spinner'></div> <b>正在分析股票数据...</b></p>", unsafe_allow_html=True)
         progress_bar = st.progress(0)
-        
+
         total_stocks = len(stock_codes)
-        processed_stocks = 0
-        not_found_stocks = []
-        
-        for idx, code in enumerate(stock_codes, 1):
-            # 查找股票名称
-            stock_name = code_to_name.get(code, None)
-            
-            if stock_name is None:
-                not_found_stocks.append(code)
-                stock_name = "未知股票"
-            
-            # 获取行业信息
-            industry = get_stock_industry(code, industry_data, industry_stocks_cache)
-            
-            # 获取概念信息
-            concepts = get_stock_concepts(code, concept_data, concept_stocks_cache)
-            
-            # 添加到结果DataFrame
-            result_df = pd.concat([result_df, pd.DataFrame({
-                "序号": [idx],
-                "股票代码": [code],
-                "股票名称": [stock_name],
-                "所属行业": [industry],
-                "相关概念": [concepts]
-            })], ignore_index=True)
-            
-            # 更新进度
-            processed_stocks += 1
+        for start in range(0, total_stocks, chunk_size):
+            chunk_df, chunk_missing = classify_stocks(stock_codes[start:start + chunk_size], snapshot)
+
+            # 如果在快照中没找到行业，尝试实时查询（可能是新股或缓存不完整）
+            if online_fallback:
+                unknown = chunk_df["所属行业"] == "未知行业"
+                chunk_df.loc[unknown, "所属行业"] = [
+                    get_stock_industry(code, snapshot["industry_data"], {})
+                    for code in chunk_df.loc[unknown, "股票代码"]
+                ]
+
+            chunks.append(chunk_df)
+            not_found_stocks.extend(chunk_missing)
+
+            # 每处理完一批更新一次状态
+            processed_stocks = min(start + chunk_size, total_stocks)
             progress_bar.progress(processed_stocks / total_stocks)
-            
-            # 每处理5个股票更新一次状态
-            if idx % 5 == 0 or idx == len(stock_codes):
-                status_container.markdown(f"已分析 {idx}/{total_stocks} 只股票")
-        
-        # 清除进度容器
-        progress_container.empty()
-        status_container.empty()
-        
-        # 如果有未找到的股票，显示警告
-        if not_found_stocks:
-            st.warning(f"以下股票代码未找到: {', '.join(not_found_stocks)}")
-    
+            status_container.markdown(f"已分析 {processed_stocks}/{total_stocks} 只股票")
+
+    # 清除进度容器
+    progress_container.empty()
+    status_container.empty()
+
+    # 如果有未找到的股票，显示警告或交给调用方处理
+    if not_found is not None:
+        not_found.extend(not_found_stocks)
+    else:
+        render_not_found_warning(not_found_stocks)
+
+    if chunks:
+        result_df = pd.concat(chunks, ignore_index=True)
+    else:
+        result_df = pd.DataFrame(columns=["股票代码", "股票名称", "所属行业", "相关概念"])
+    result_df.insert(0, "序号", np.arange(1, len(result_df) + 1))
     return result_df
 
 def get_stock_industry(stock_code, industry_data, industry_stocks_cache):
@@ -407,71 +2236,6 @@ def get_stock_industry(stock_code, industry_data, industry_stocks_cache):
     
     return "未知行业"
 
-def get_stock_concepts(stock_code, concept_data, concept_stocks_cache):
-    """
-    获取股票相关概念，使用改进的相关性算法
-    
-    参数:
-        stock_code: 股票代码
-        concept_data: 概念分类数据
-        concept_stocks_cache: 概念成分股缓存
-        
-    返回:
-        概念名称字符串，多个概念以逗号分隔，最多返回5个最相关的概念
-    """
-    matched_concepts = []
-    
-    # 建立概念板块权重表 (基于concept_data的排序)
-    concept_weights = {}
-    for i, (_, row) in enumerate(concept_data.iterrows()):
-        # 越靠前的概念板块权重越高
-        concept_weights[row['板块名称']] = len(concept_data) - i
-    
-    # 从缓存中查找所有概念
-    for concept_name, concept_stocks in concept_stocks_cache.items():
-        if not concept_stocks.empty and '代码' in concept_stocks.columns:
-            if stock_code in concept_stocks['代码'].values:
-                # 计算相关性得分 (考虑多个因素)
-                relevance_score = 0
-                
-                # 因素1: 概念的热度/权重 (基于原始排序)
-                weight = concept_weights.get(concept_name, 0)
-                relevance_score += weight * 0.5  # 权重因素占50%
-                
-                # 因素2: 概念的精确度 (成分股数量越少越精确)
-                stock_count = len(concept_stocks)
-                # 成分股在30-100之间的概念最合适，太少可能太小众，太多可能太宽泛
-                if 30 <= stock_count <= 100:
-                    precision_score = 100
-                elif stock_count < 30:
-                    precision_score = stock_count
-                else:  # stock_count > 100
-                    precision_score = max(1, 200 - stock_count)  # 数量越多分数越低
-                
-                relevance_score += precision_score * 0.5  # 精确度因素占50%
-                
-                # 因素3: 考虑概念的热度/关注度 (如果有该数据)
-                try:
-                    concept_detail = concept_data[concept_data['板块名称'] == concept_name]
-                    if not concept_detail.empty and '涨跌幅' in concept_detail.columns:
-                        # 涨跌幅的绝对值可以作为热度的一个指标
-                        change_rate = abs(float(concept_detail['涨跌幅'].values[0].replace('%', '')))
-                        heat_score = min(change_rate * 5, 100)  # 最高100分
-                        relevance_score += heat_score * 0.2  # 热度因素加成20%
-                except Exception:
-                    pass
-                
-                matched_concepts.append((concept_name, relevance_score))
-    
-    if matched_concepts:
-        # 按照相关性得分排序 (得分越高越相关)
-        sorted_concepts = sorted(matched_concepts, key=lambda x: x[1], reverse=True)
-        # 只取前5个最相关的概念
-        top_concepts = [concept[0] for concept in sorted_concepts[:5]]
-        return ", ".join(top_concepts)
-    else:
-        return "暂无相关概念"
-
 # 分析行业分布的函数
 def analyze_industry_distribution(stocks_df):
     """
@@ -483,19 +2247,15 @@ def analyze_industry_distribution(stocks_df):
     返回:
         行业分布的Counter对象和行业-股票映射字典
     """
-    industries = stocks_df["所属行业"].tolist()
     # 过滤掉"未知行业"
-    industries = [ind for ind in industries if ind != "未知行业"]
-    
+    known = stocks_df[stocks_df["所属行业"] != "未知行业"]
+    industries = known["所属行业"].tolist()
+
     # 创建行业-股票映射字典
     industry_stocks = {}
-    for _, row in stocks_df.iterrows():
-        industry = row["所属行业"]
-        if industry != "未知行业":
-            if industry not in industry_stocks:
-                industry_stocks[industry] = []
-            industry_stocks[industry].append({"代码": row["股票代码"], "名称": row["股票名称"]})
-    
+    for industry, code, name in zip(industries, known["股票代码"], known["股票名称"]):
+        industry_stocks.setdefault(industry, []).append({"代码": code, "名称": name})
+
     return Counter(industries), industry_stocks
 
 # 分析概念分布的函数
@@ -512,25 +2272,720 @@ def analyze_concept_distribution(stocks_df):
     # 收集所有概念
     all_concepts = []
     concept_stocks = {}
-    
-    for _, row in stocks_df.iterrows():
-        concepts_str = row["相关概念"]
+
+    for concepts_str, code, name in zip(stocks_df["相关概念"], stocks_df["股票代码"], stocks_df["股票名称"]):
         if concepts_str != "暂无相关概念":
             concepts = [c.strip() for c in concepts_str.split(",")]
             all_concepts.extend(concepts)
-            
+
             # 建立概念-股票映射
             for concept in concepts:
-                if concept not in concept_stocks:
-                    concept_stocks[concept] = []
-                concept_stocks[concept].append({"代码": row["股票代码"], "名称": row["股票名称"]})
-    
+                concept_stocks.setdefault(concept, []).append({"代码": code, "名称": name})
+
     # 统计概念出现次数
     concept_counter = Counter(all_concepts)
     return concept_counter, concept_stocks
 
+# 集中度指标中统计的前N大板块占比
+CONCENTRATION_TOP_N = (1, 3, 5)
+
+def _board_assignments(stocks_df, dimension, snapshot=None, taxonomy=DEFAULT_TAXONOMY):
+    """
+    将组合展开为 (股票序号, 板块名称) 成员关系
+
+    有快照时直接取快照中组合股票所在位置的成员关系：行业来自行业编号矩阵，概念来自CSR
+    成员关系，包含股票的全部概念，不受表格中展示的概念数量和排除的概念影响。快照中没有
+    行业的股票沿用表格中的行业（如实时查询得到的行业）。没有快照时解析表格中的文本
+
+    参数:
+        stocks_df: 包含股票信息的DataFrame
+        dimension: "行业"或"概念"
+        snapshot: 本次分析使用的成分股快照，可选
+        taxonomy: 行业维度使用的行业分类标准
+
+    返回:
+        (股票序号数组, 板块名称数组)，未知行业和暂无概念的股票不计入
+    """
+    table_industries = stocks_df["所属行业"].to_numpy(dtype=object)
+    if snapshot is None:
+        if dimension == "行业":
+            labels = pd.Series(table_industries)
+            labels = labels[labels != "未知行业"]
+        else:
+            labels = stocks_df["相关概念"].reset_index(drop=True)
+            labels = labels[labels != "暂无相关概念"].str.split(", ").explode()
+        return labels.index.to_numpy(dtype=np.int64), labels.to_numpy(dtype=object)
+
+    codes = stocks_df["股票代码"].astype(str).to_numpy(dtype=object)
+    if dimension == "行业":
+        labels = taxonomy_industries(snapshot, codes, taxonomy)
+        labels = np.where(labels == "未知行业", table_industries, labels)
+        rows = np.flatnonzero(labels != "未知行业")
+        return rows, labels[rows]
+
+    positions = snapshot["code_index"].get_indexer(codes)
+    known = np.flatnonzero(positions >= 0)
+    indptr = snapshot["concept_indptr"]
+    starts, counts = indptr[positions[known]], np.diff(indptr)[positions[known]]
+    rows = np.repeat(known, counts)
+    # 每只股票的概念在CSR中是连续的一段，按段展开得到全部成员关系的下标
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    concept_ids = snapshot["concept_indices"][np.repeat(starts, counts) + offsets]
+    return rows.astype(np.int64), snapshot["concept_names"][concept_ids]
+
+def portfolio_weights(stocks_df, weight_column="持仓权重"):
+    """
+    组合的计算口径和对应的股票权重
+
+    返回:
+        {口径名称: 权重数组} 字典，总是包含"等权"，提供了持仓权重时再包含"持仓加权"
+    """
+    n = len(stocks_df)
+    weights = {"等权": np.full(n, 1.0 / n) if n else np.zeros(0)}
+    if weight_column in stocks_df.columns:
+        position_weights = pd.to_numeric(stocks_df[weight_column], errors="coerce").fillna(0.0).to_numpy(dtype=float)
+        if position_weights.sum() > 0:
+            weights["持仓加权"] = position_weights / position_weights.sum()
+    return weights
+
+def concentration_metrics(stocks_df, weight_column="持仓权重", top_n=CONCENTRATION_TOP_N, snapshot=None,
+                          taxonomy=DEFAULT_TAXONOMY):
+    """
+    计算行业和概念两个维度的集中度指标和板块暴露
+
+    每个维度把股票×板块成员关系展开后，用bincount一次得到各口径下每个板块的暴露，
+    再由暴露的占比计算HHI、有效板块数量和前N大板块占比。概念维度一只股票属于多个概念，
+    暴露之和可能超过100%，占比按全部概念暴露之和归一
+
+    参数:
+        stocks_df: 包含股票信息的DataFrame，可包含持仓权重列
+        weight_column: 持仓权重列名
+        top_n: 统计的前N大板块占比
+        snapshot: 成分股快照，提供时按快照中的全部成员关系计算
+        taxonomy: 行业维度使用的行业分类标准
+
+    返回:
+        (集中度指标DataFrame, {维度: 板块暴露DataFrame})
+    """
+    weights = portfolio_weights(stocks_df, weight_column)
+    weight_matrix = np.column_stack(list(weights.values())) if len(stocks_df) else np.zeros((0, len(weights)))
+
+    metric_rows = []
+    exposures = {}
+    for dimension in ("行业", "概念"):
+        rows, labels = _board_assignments(stocks_df, dimension, snapshot, taxonomy)
+        board_ids, board_names = pd.factorize(labels)
+        board_count = len(board_names)
+
+        # 各板块的股票数量和各口径下的暴露
+        stock_counts = np.bincount(board_ids, minlength=board_count)
+        board_exposure = np.column_stack([
+            np.bincount(board_ids, weights=weight_matrix[rows, j], minlength=board_count)
+            for j in range(weight_matrix.shape[1])
+        ]) if board_count else np.zeros((0, len(weights)))
+        # 至少属于一个板块的股票所占的权重
+        covered = np.zeros(len(stocks_df), dtype=bool)
+        covered[rows] = True
+        coverage = weight_matrix[covered].sum(axis=0)
+
+        totals = board_exposure.sum(axis=0)
+        shares = np.divide(board_exposure, totals, out=np.zeros_like(board_exposure), where=totals > 0)
+        sorted_shares = -np.sort(-shares, axis=0)
+        cumulative = np.cumsum(sorted_shares, axis=0)
+        hhi = (shares ** 2).sum(axis=0)
+
+        for j, basis in enumerate(weights):
+            row = {
+                "维度": dimension,
+                "口径": basis,
+                "板块数量": board_count,
+                "HHI": hhi[j],
+                "有效板块数": 1.0 / hhi[j] if hhi[j] > 0 else 0.0,
+            }
+            for n in top_n:
+                row[f"前{n}占比"] = cumulative[min(n, board_count) - 1, j] if board_count else 0.0
+            row["覆盖率"] = coverage[j]
+            metric_rows.append(row)
+
+        exposure_df = pd.DataFrame({dimension: board_names, "股票数量": stock_counts})
+        for j, basis in enumerate(weights):
+            exposure_df[f"{basis}暴露"] = board_exposure[:, j]
+        exposures[dimension] = exposure_df.sort_values(
+            f"{list(weights)[-1]}暴露", ascending=False, kind="stable"
+        ).reset_index(drop=True)
+
+    return pd.DataFrame(metric_rows), exposures
+
+# 组合分析结果缓存的内存预算（MB）和有效期（秒）
+RESULT_CACHE_BUDGET_MB = float(os.environ.get("STOCK_ANALYZER_RESULT_CACHE_MB", "128"))
+RESULT_CACHE_TTL = 24 * 3600
+
+def _analysis_result_size(result):
+    """估算组合分析结果的内存占用，分布映射与股票表格大小相当"""
+    return _dataframe_size(result["stocks_df"]) * 3
+
+# 创建进程内共享的组合分析结果缓存
+@st.cache_resource
+def get_result_cache():
+    """所有会话共享的组合分析结果缓存"""
+    return BudgetedCache(int(RESULT_CACHE_BUDGET_MB * 1024 * 1024), RESULT_CACHE_TTL, sizeof=_analysis_result_size)
+
+def portfolio_cache_key(stock_codes, snapshot, scoring):
+    """
+    组合分析结果的缓存键
+
+    参数:
+        stock_codes: 股票代码列表
+        snapshot: 成分股快照
+        scoring: 影响分析结果的参数字典
+
+    返回:
+        (去重排序后代码集合的摘要, 快照版本, 行情版本, 参数元组)
+    """
+    digest = hashlib.sha1("\n".join(sorted(set(stock_codes))).encode("utf-8")).hexdigest()
+    return digest, snapshot["version"], snapshot.get("quotes_version"), tuple(sorted(scoring.items()))
+
+# 新增股票超过组合的该比例时不再增量更新，直接完整分析
+INCREMENTAL_MAX_ADDED_RATIO = 0.5
+
+def merge_distribution(distribution, stocks_map, removed, added, positions, category_rank=None):
+    """
+    从分布和类别-股票映射中去掉移除的股票，再并入新增股票
+
+    参数:
+        distribution: 原分布Counter
+        stocks_map: 原类别-股票映射字典
+        removed: 移除股票的 (分布Counter, 类别-股票映射)
+        added: 新增股票的 (分布Counter, 类别-股票映射)
+        positions: 股票代码到其在新组合中位置的字典
+        category_rank: 根据 (股票代码, 类别) 返回该类别在这只股票各类别中的名次的函数，
+            默认每只股票只属于一个类别
+
+    返回:
+        更新后的分布Counter和类别-股票映射字典，不修改传入的对象。类别按在新组合中首次出现的
+        顺序排列，类别内的股票按新组合的顺序排列，与对新组合完整分析的结果一致
+    """
+    removed_distribution, removed_map = removed
+    added_distribution, added_map = added
+    distribution = Counter(distribution)
+    distribution -= removed_distribution
+    distribution.update(added_distribution)
+
+    stocks_map = dict(stocks_map)
+    for category, items in removed_map.items():
+        removed_codes = {item["代码"] for item in items}
+        remaining = [item for item in stocks_map[category] if item["代码"] not in removed_codes]
+        if remaining:
+            stocks_map[category] = remaining
+        else:
+            del stocks_map[category]
+    for category, items in added_map.items():
+        stocks_map[category] = stocks_map.get(category, []) + items
+
+    # 类别内的股票保持与组合一致的顺序，类别按首次出现的股票及其在该股票中的名次排序
+    for category, items in stocks_map.items():
+        stocks_map[category] = sorted(items, key=lambda item: positions[item["代码"]])
+    def first_seen(category):
+        code = stocks_map[category][0]["代码"]
+        return positions[code], (category_rank(code, category) if category_rank is not None else 0)
+    order = sorted(stocks_map, key=first_seen)
+    return Counter({category: distribution[category] for category in order}), {category: stocks_map[category] for category in order}
+
+def update_portfolio_result(previous, stock_codes, snapshot, online_fallback):
+    """
+    在上一次的分析结果上增量更新：只分析新增的股票，去掉移除的股票
+
+    参数:
+        previous: 上一次的分析结果字典
+        stock_codes: 去重后的股票代码列表
+        snapshot: 成分股快照
+        online_fallback: 快照中找不到行业时是否实时查询
+
+    返回:
+        (分析结果字典, 新增股票数, 移除股票数)
+    """
+    previous_df = previous["stocks_df"]
+    kept = previous_df["股票代码"].isin(set(stock_codes)).to_numpy()
+    previous_codes = set(previous_df["股票代码"])
+    added_codes = [code for code in stock_codes if code not in previous_codes]
+
+    added_not_found = []
+    added_df = get_stock_info(added_codes, online_fallback=online_fallback, snapshot=snapshot, not_found=added_not_found)
+    removed_df = previous_df[~kept]
+    positions = {code: i for i, code in enumerate(stock_codes)}
+
+    # 上一次的结果可能附加了持仓权重等列，只保留分析得到的列
+    stocks_df = pd.concat([previous_df.loc[kept, added_df.columns], added_df], ignore_index=True)
+    stocks_df = stocks_df.set_index("股票代码", drop=False).loc[stock_codes].reset_index(drop=True)
+    stocks_df["序号"] = np.arange(1, len(stocks_df) + 1)
+    concepts_of = dict(zip(stocks_df["股票代码"], stocks_df["相关概念"]))
+
+    def concept_rank(code, concept):
+        return [c.strip() for c in concepts_of[code].split(",")].index(concept)
+
+    industry_distribution, industry_stocks_map = merge_distribution(
+        previous["industry_distribution"], previous["industry_stocks_map"],
+        analyze_industry_distribution(removed_df), analyze_industry_distribution(added_df), positions
+    )
+    concept_distribution, concept_stocks_map = merge_distribution(
+        previous["concept_distribution"], previous["concept_stocks_map"],
+        analyze_concept_distribution(removed_df), analyze_concept_distribution(added_df), positions, concept_rank
+    )
+    not_found = [code for code in previous.get("not_found", []) if code in positions] + added_not_found
+    return {
+        "stocks_df": stocks_df,
+        "industry_distribution": industry_distribution,
+        "industry_stocks_map": industry_stocks_map,
+        "concept_distribution": concept_distribution,
+        "concept_stocks_map": concept_stocks_map,
+        "not_found": sorted(not_found, key=positions.get),
+    }, len(added_codes), int((~kept).sum())
+
+def analyze_portfolio(stock_codes, snapshot, online_fallback=True, previous=None):
+    """
+    分析组合的股票信息和行业、概念分布，相同的股票集合、快照版本和参数直接复用缓存结果
+
+    提供上一次的分析结果且快照版本和参数相同时，只分析新增的股票并增量更新分布
+
+    参数:
+        stock_codes: 股票代码列表，重复代码只分析一次
+        snapshot: 成分股快照
+        online_fallback: 快照中找不到行业时是否实时查询
+        previous: 上一次的分析结果字典（含key），可选
+
+    返回:
+        (分析结果字典, 是否命中缓存)。结果字典包含stocks_df、industry_distribution、
+        industry_stocks_map、concept_distribution、concept_stocks_map、缓存键key，
+        快照中未找到的股票代码not_found，以及增量更新时的新增、移除股票数changes（否则为None），
+        均为可修改的副本。未找到的代码随结果一起缓存，由调用方显示警告
+    """
+    # 去重，保留首次出现的顺序
+    stock_codes = list(dict.fromkeys(stock_codes))
+    scoring = {"top_k": TOP_CONCEPTS, "online_fallback": online_fallback}
+    key = portfolio_cache_key(stock_codes, snapshot, scoring)
+
+    cache = get_result_cache()
+    result = cache.get(key)
+    hit = result is not None
+    changes = None
+    if not hit:
+        # 上一次的结果基于相同的快照和参数时可以增量更新
+        incremental = previous is not None and previous.get("key", ())[1:] == key[1:]
+        if incremental:
+            overlap = previous["stocks_df"]["股票代码"].isin(set(stock_codes)).sum()
+            incremental = overlap > 0 and len(stock_codes) - overlap <= len(stock_codes) * INCREMENTAL_MAX_ADDED_RATIO
+        if incremental:
+            result, added_count, removed_count = update_portfolio_result(previous, stock_codes, snapshot, online_fallback)
+            changes = {"新增": added_count, "移除": removed_count}
+        else:
+            not_found = []
+            stocks_df = get_stock_info(stock_codes, online_fallback=online_fallback, snapshot=snapshot, not_found=not_found)
+            industry_distribution, industry_stocks_map = analyze_industry_distribution(stocks_df)
+            concept_distribution, concept_stocks_map = analyze_concept_distribution(stocks_df)
+            result = {
+                "stocks_df": stocks_df,
+                "industry_distribution": industry_distribution,
+                "industry_stocks_map": industry_stocks_map,
+                "concept_distribution": concept_distribution,
+                "concept_stocks_map": concept_stocks_map,
+                "not_found": not_found,
+            }
+        cache.put(key, result)
+
+    # 缓存结果在会话之间共享，返回副本；股票顺序与本次输入一致
+    stocks_df = result["stocks_df"]
+    if stocks_df["股票代码"].tolist() != stock_codes:
+        stocks_df = stocks_df.set_index("股票代码", drop=False).loc[stock_codes].reset_index(drop=True)
+        stocks_df["序号"] = np.arange(1, len(stocks_df) + 1)
+    else:
+        stocks_df = stocks_df.copy()
+    return {
+        "stocks_df": stocks_df,
+        "industry_distribution": Counter(result["industry_distribution"]),
+        "industry_stocks_map": dict(result["industry_stocks_map"]),
+        "concept_distribution": Counter(result["concept_distribution"]),
+        "concept_stocks_map": dict(result["concept_stocks_map"]),
+        "not_found": list(result["not_found"]),
+        "key": key,
+        "changes": changes,
+    }, hit
+
+# 静态分布图缓存的内存预算（MB），相同的分布只渲染一次
+CHART_CACHE_BUDGET_MB = float(os.environ.get("STOCK_ANALYZER_CHART_CACHE_MB", "32"))
+# 静态分布图支持的格式及其MIME类型
+CHART_IMAGE_FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+# 静态分布图的尺寸（英寸）和PNG分辨率
+CHART_FIGSIZE = (8, 6)
+CHART_DPI = 150
+# 导出的Excel中分布图的显示宽度（像素）
+CHART_EXCEL_WIDTH = 640
+# 静态分布图使用的中文字体，按顺序回退，只使用系统中已安装的字体
+CHART_FONTS = ["Microsoft YaHei", "SimHei", "PingFang SC", "Noto Sans CJK SC", "Noto Sans CJK JP", "Source Han Sans SC",
+               "WenQuanYi Micro Hei", "WenQuanYi Zen Hei", "Arial Unicode MS"]
+# 静态分布图使用的中文字体文件，设置后优先于CHART_FONTS，适用于没有安装中文字体的服务器
+CHART_FONT_PATH = os.environ.get("STOCK_ANALYZER_CHART_FONT", "")
+# 各颜色方案的扇区颜色序列和最大扇区的强调色，与Plotly饼图一致
+CHART_PALETTES = {
+    'blues': (px.colors.sequential.Blues_r[1:] + px.colors.sequential.PuBu_r[1:], "#1E88E5"),
+    'oranges': (px.colors.sequential.Oranges_r[1:] + px.colors.sequential.OrRd_r[1:], "#F57C00"),
+}
+
+# 创建进程内共享的静态分布图缓存
+@st.cache_resource
+def get_chart_cache():
+    """所有会话和分类API共享的静态分布图缓存，按分布内容的摘要索引"""
+    return BudgetedCache(int(CHART_CACHE_BUDGET_MB * 1024 * 1024), ttl=RESULT_CACHE_TTL, sizeof=len)
+
+def chart_fonts():
+    """
+    静态分布图实际使用的中文字体
+
+    设置了STOCK_ANALYZER_CHART_FONT时注册并使用该字体文件，否则按CHART_FONTS的顺序
+    使用系统中已安装的字体。matplotlib默认的DejaVu Sans没有中文字形，不作为回退
+
+    返回:
+        字体名称列表
+
+    异常:
+        RuntimeError: 找不到可用的中文字体
+    """
+    if CHART_FONT_PATH:
+        if not any(font.fname == CHART_FONT_PATH for font in font_manager.fontManager.ttflist):
+            font_manager.fontManager.addfont(CHART_FONT_PATH)
+        return [font_manager.FontProperties(fname=CHART_FONT_PATH).get_name()]
+    installed = {font.name for font in font_manager.fontManager.ttflist}
+    fonts = [name for name in CHART_FONTS if name in installed]
+    if not fonts:
+        raise RuntimeError("未找到中文字体，无法渲染静态分布图：请安装中文字体（如 fonts-noto-cjk），"
+                           "或通过环境变量 STOCK_ANALYZER_CHART_FONT 指定字体文件")
+    return fonts
+
+def distribution_buckets(counter, max_buckets=DISTRIBUTION_BUCKETS):
+    """
+    取分布中数量最多的类别，超出max_buckets的部分合并为"其他"
+
+    返回:
+        (类别名称列表, 数量列表)
+    """
+    if len(counter) <= max_buckets:
+        return list(counter.keys()), list(counter.values())
+    items = counter.most_common()
+    top_items = items[:max_buckets - 1]
+    other_sum = sum(count for _, count in items[max_buckets - 1:])
+    if other_sum > 0:
+        top_items.append(("其他", other_sum))
+    return [item[0] for item in top_items], [item[1] for item in top_items]
+
+def _draw_distribution_image(labels, values, title, color_scheme, image_format):
+    """用matplotlib的面向对象接口绘制环形分布图，不使用pyplot的全局状态，可在多个线程中同时调用"""
+    fig = Figure(figsize=CHART_FIGSIZE)
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    fonts = chart_fonts()
+    ax.set_title(title, fontsize=16, fontfamily=fonts)
+    if not values:
+        ax.text(0.5, 0.5, "暂无数据", ha="center", va="center", fontsize=18, fontfamily=fonts)
+        ax.set_axis_off()
+    else:
+        palette, highlight = CHART_PALETTES.get(color_scheme, CHART_PALETTES['blues'])
+        # 类别数超过颜色数量时循环使用颜色序列
+        colors = [tuple(c / 255 for c in px.colors.unlabel_rgb(palette[i % len(palette)])) for i in range(len(labels))]
+        # 与交互饼图一样突出数量最多的类别
+        max_idx = values.index(max(values))
+        colors[max_idx] = highlight
+        explode = [0.02] * len(values)
+        explode[max_idx] = 0.1
+        total = sum(values)
+        wedges, _, autotexts = ax.pie(
+            values, colors=colors, explode=explode, startangle=45, counterclock=False,
+            autopct=lambda pct: f"{pct:.1f}%\n{int(round(pct * total / 100))}" if pct >= 3 else "",
+            pctdistance=0.78, wedgeprops=dict(width=0.6, edgecolor="white", linewidth=2),
+            textprops=dict(fontsize=9, fontfamily=fonts),
+        )
+        # 深色扇区上用白色文字，浅色扇区上用深色文字
+        for autotext, color in zip(autotexts, colors):
+            red, green, blue = to_rgb(color)
+            autotext.set_color("white" if 0.299 * red + 0.587 * green + 0.114 * blue < 0.6 else "#333333")
+        ax.legend(wedges, [f"{label} ({value})" for label, value in zip(labels, values)],
+                  loc="center left", bbox_to_anchor=(1.0, 0.5), frameon=False, prop={"family": fonts, "size": 10})
+        ax.set_aspect("equal")
+    fig.tight_layout()
+
+    output = io.BytesIO()
+    fig.savefig(output, format=image_format, dpi=CHART_DPI, bbox_inches="tight")
+    return output.getvalue()
+
+def render_distribution_image(counter, title, color_scheme='blues', max_buckets=DISTRIBUTION_BUCKETS, image_format="png", cache=None):
+    """
+    在服务器端将分布渲染为静态图片，相同的分布、标题和样式直接复用缓存的图片
+
+    参数:
+        counter: 分布计数器
+        title: 图表标题
+        color_scheme: 颜色方案
+        max_buckets: 最多展示的类别数量，超出部分归为"其他"
+        image_format: "png"或"svg"
+        cache: 图片缓存，默认为共享的静态分布图缓存
+
+    返回:
+        图片的字节内容
+    """
+    if image_format not in CHART_IMAGE_FORMATS:
+        raise ValueError(f"不支持的图片格式: {image_format}")
+    labels, values = distribution_buckets(counter, max_buckets)
+    payload = json.dumps([title, color_scheme, labels, values], ensure_ascii=False)
+    key = (hashlib.sha1(payload.encode("utf-8")).hexdigest(), image_format)
+    cache = cache if cache is not None else get_chart_cache()
+    return cache.get_or_load(key, lambda: _draw_distribution_image(labels, values, title, color_scheme, image_format))
+
+# 分类API的监听地址和端口，端口设置为0时不启动
+API_HOST = os.environ.get("STOCK_ANALYZER_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("STOCK_ANALYZER_API_PORT", "8502"))
+# 单次API请求允许的最大股票数量
+API_MAX_CODES = 10000
+# 每个接口保留的最近请求耗时数量，用于计算延迟分位数
+API_LATENCY_WINDOW = 10000
+
+class ApiStats:
+    """记录分类API各接口的请求数、错误数和最近请求的耗时"""
+
+    def __init__(self, window=API_LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._counts = Counter()
+        self._errors = Counter()
+        self.window = window
+
+    def record(self, endpoint, seconds, ok=True):
+        with self._lock:
+            self._latencies.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+            self._counts[endpoint] += 1
+            if not ok:
+                self._errors[endpoint] += 1
+
+    def summary(self):
+        """各接口的请求数和延迟分位数（毫秒）"""
+        with self._lock:
+            rows = []
+            for endpoint, latencies in self._latencies.items():
+                p50, p95, p99 = np.percentile(np.fromiter(latencies, dtype=float), [50, 95, 99]) * 1000
+                rows.append({
+                    "接口": endpoint,
+                    "请求数": self._counts[endpoint],
+                    "错误数": self._errors[endpoint],
+                    "p50(ms)": round(p50, 2),
+                    "p95(ms)": round(p95, 2),
+                    "p99(ms)": round(p99, 2),
+                })
+        return pd.DataFrame(rows, columns=["接口", "请求数", "错误数", "p50(ms)", "p95(ms)", "p99(ms)"])
+
+def api_snapshot(store):
+    """
+    分类API使用的快照：进程内已加载的快照，或其他进程发布的共享快照
+
+    API不会触发板块数据加载；正在构建快照时不等待，继续使用已有的快照。
+    网页会话已为当前快照叠加行情时使用叠加后的版本
+    """
+    identity = shared_snapshot_identity()
+    if identity is not None and identity != store.get("shared_identity") and store["lock"].acquire(blocking=False):
+        try:
+            shared = load_shared_snapshot()
+            if shared is not None and (store["snapshot"] is None or shared["built_at"] >= store["snapshot"]["built_at"]):
+                store["snapshot"] = shared
+            store["shared_identity"] = identity
+        except Exception:
+            pass
+        finally:
+            store["lock"].release()
+    snapshot = store["snapshot"]
+    quoted = store.get("quoted")
+    if snapshot is not None and quoted is not None and quoted[1]["version"] == snapshot["version"]:
+        return quoted[1]
+    return snapshot
+
+def classify_for_api(codes, snapshot, top_k=TOP_CONCEPTS, include_distribution=False):
+    """
+    为API请求分类股票
+
+    参数:
+        codes: 股票代码列表，支持SH/SZ/BJ前缀和后缀
+        snapshot: 成分股快照
+        top_k: 每只股票返回的概念数量
+        include_distribution: 是否同时返回行业和概念分布
+
+    返回:
+        可序列化为JSON的结果字典
+    """
+    if top_k < 1:
+        raise ValueError("top_k 不应小于1")
+    normalized = normalize_stock_codes(codes)
+    invalid = [code for code, ok in zip(codes, normalized.notna()) if not ok]
+    stocks_df, not_found = classify_stocks(normalized.dropna().tolist(), snapshot, top_k)
+
+    result = {
+        "snapshot_version": snapshot["version"],
+        "quotes_version": snapshot.get("quotes_version"),
+        "results": [
+            {
+                "code": code,
+                "name": name,
+                "industry": industry,
+                "concepts": [] if concepts == "暂无相关概念" else concepts.split(", "),
+            }
+            for code, name, industry, concepts in zip(
+                stocks_df["股票代码"], stocks_df["股票名称"], stocks_df["所属行业"], stocks_df["相关概念"]
+            )
+        ],
+        "not_found": not_found,
+        "invalid": invalid,
+    }
+    if include_distribution:
+        industry_distribution, _ = analyze_industry_distribution(stocks_df)
+        concept_distribution, _ = analyze_concept_distribution(stocks_df)
+        result["industry_distribution"] = dict(industry_distribution.most_common())
+        result["concept_distribution"] = dict(concept_distribution.most_common())
+    return result
+
+def chart_for_api(result, dimension, image_format, max_buckets, cache=None):
+    """
+    将API分类结果中的行业或概念分布渲染为静态图片
+
+    参数:
+        result: 包含分布的classify_for_api结果
+        dimension: "industry"或"concept"
+        image_format: "png"或"svg"
+        max_buckets: 最多展示的类别数量
+        cache: 图片缓存
+
+    返回:
+        图片的字节内容
+    """
+    if dimension not in ("industry", "concept"):
+        raise ValueError(f"不支持的分布维度: {dimension}")
+    if max_buckets < 2:
+        raise ValueError("buckets 不应小于2")
+    category, color_scheme = ("行业", "blues") if dimension == "industry" else ("概念", "oranges")
+    return render_distribution_image(Counter(result[f"{dimension}_distribution"]), f"{category}分布",
+                                     color_scheme, max_buckets, image_format, cache)
+
+def make_api_handler(store, stats, chart_cache=None):
+    """创建绑定到快照存储、统计对象和静态分布图缓存的API请求处理类"""
+
+    class ClassificationApiHandler(BaseHTTPRequestHandler):
+        """
+        分类API
+
+        GET  /health                          服务状态和快照版本
+        GET  /stats                           各接口的延迟分位数
+        GET  /classify?codes=600519,000001    股票行业和概念
+        POST /classify      {"codes": [...], "top_k": 5}
+        POST /distribution  {"codes": [...], "top_k": 5}  股票分类及行业、概念分布
+        GET  /chart?codes=...&dimension=industry&format=png   行业或概念分布的静态图片
+        POST /chart         {"codes": [...], "dimension": "concept", "format": "svg", "buckets": 10}
+        """
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_bytes(self, body, content_type):
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _handle(self, endpoint, params):
+            start = time.perf_counter()
+            status = 200
+            try:
+                if endpoint == "/health":
+                    snapshot = store["snapshot"]
+                    payload = {"status": "ok", "snapshot_version": snapshot["version"] if snapshot else None}
+                elif endpoint == "/stats":
+                    payload = {"endpoints": stats.summary().to_dict(orient="records")}
+                elif endpoint in ("/classify", "/distribution", "/chart"):
+                    snapshot = api_snapshot(store)
+                    codes = params.get("codes") or []
+                    if snapshot is None:
+                        status, payload = 503, {"error": "成分股快照尚未加载"}
+                    elif not isinstance(codes, list) or not codes:
+                        status, payload = 400, {"error": "请提供股票代码列表 codes"}
+                    elif not all(isinstance(c, (str, int)) and not isinstance(c, bool) for c in codes):
+                        status, payload = 400, {"error": "codes 中的每一项都应是股票代码字符串"}
+                    elif len(codes) > API_MAX_CODES:
+                        status, payload = 400, {"error": f"单次请求的股票代码不应超过{API_MAX_CODES}个"}
+                    else:
+                        top_k = int(params.get("top_k", TOP_CONCEPTS))
+                        payload = classify_for_api([str(c) for c in codes], snapshot, top_k,
+                                                   include_distribution=endpoint != "/classify")
+                        if endpoint == "/chart":
+                            image_format = str(params.get("format", "png"))
+                            image = chart_for_api(payload, str(params.get("dimension", "industry")), image_format,
+                                                  int(params.get("buckets", DISTRIBUTION_BUCKETS)), chart_cache)
+                            self._send_bytes(image, CHART_IMAGE_FORMATS[image_format])
+                            stats.record(endpoint, time.perf_counter() - start)
+                            return
+                else:
+                    status, payload = 404, {"error": f"未知接口 {endpoint}"}
+            except (ValueError, TypeError) as e:
+                status, payload = 400, {"error": str(e)}
+            except Exception as e:
+                status, payload = 500, {"error": str(e)}
+            self._send_json(status, payload)
+            stats.record(endpoint, time.perf_counter() - start, ok=status < 400)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            params = {key: values[-1] for key, values in query.items()}
+            if "codes" in params:
+                params["codes"] = [c for c in re.split(r'[,，\s]+', params["codes"]) if c]
+            self._handle(url.path, params)
+
+        def do_POST(self):
+            endpoint = urlparse(self.path).path
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                params = json.loads(self.rfile.read(length) or b"{}")
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                params = None
+            if not isinstance(params, dict):
+                self._send_json(400, {"error": "请求体必须是JSON对象"})
+                stats.record(endpoint, 0.0, ok=False)
+                return
+            self._handle(endpoint, params)
+
+    return ClassificationApiHandler
+
+# 在后台线程中启动分类API（每个进程一次）
+@st.cache_resource
+def start_api_server():
+    """启动分类API，端口被占用（如同一主机的其他进程已启动API）时返回None"""
+    stats = ApiStats()
+    if not API_PORT:
+        return None, stats
+    try:
+        server = ThreadingHTTPServer((API_HOST, API_PORT), make_api_handler(get_snapshot_store(), stats, get_chart_cache()))
+    except OSError:
+        return None, stats
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="classification-api", daemon=True).start()
+    return server, stats
+
+api_server, api_stats = start_api_server()
+
 # 使用Plotly绘制饼图
-def plot_distribution_plotly(counter, stocks_map, title, color_scheme='blues'):
+def plot_distribution_plotly(counter, stocks_map, title, color_scheme='blues', lightweight=False, max_buckets=DISTRIBUTION_BUCKETS):
     """
     使用Plotly绘制分布饼图
     
@@ -539,6 +2994,8 @@ def plot_distribution_plotly(counter, stocks_map, title, color_scheme='blues'):
         stocks_map: 类别-股票映射字典
         title: 图表标题
         color_scheme: 颜色方案
+        lightweight: 是否省略点击数据和动画帧，用于大规模结果以减小图表体积
+        max_buckets: 最多展示的类别数量，超出部分归为"其他"
         
     返回:
         Plotly图表对象
@@ -557,25 +3014,15 @@ def plot_distribution_plotly(counter, stocks_map, title, color_scheme='blues'):
         )
         return fig
     
-    # 只展示前10个类别，其余归为"其他"
-    if len(counter) > 10:
-        top_items = counter.most_common(9)
-        other_sum = sum(count for item, count in counter.most_common()[9:])
-        if other_sum > 0:
-            top_items.append(("其他", other_sum))
-            
-            # 合并"其他"类别中的股票
-            other_stocks = []
-            for item, _ in counter.most_common()[9:]:
-                if item in stocks_map:
-                    other_stocks.extend(stocks_map[item])
-            stocks_map["其他"] = other_stocks
-            
-        labels = [item[0] for item in top_items]
-        values = [item[1] for item in top_items]
-    else:
-        labels = list(counter.keys())
-        values = list(counter.values())
+    # 只展示前max_buckets个类别，其余归为"其他"
+    labels, values = distribution_buckets(counter, max_buckets)
+    if "其他" in labels and len(counter) > max_buckets:
+        # 合并"其他"类别中的股票
+        other_stocks = []
+        for item, _ in counter.most_common()[max_buckets - 1:]:
+            if item in stocks_map:
+                other_stocks.extend(stocks_map[item])
+        stocks_map["其他"] = other_stocks
     
     # 计算百分比
     total = sum(values)
@@ -594,13 +3041,14 @@ def plot_distribution_plotly(counter, stocks_map, title, color_scheme='blues'):
     
     # 准备股票信息用于点击交互
     custom_data = []
-    for label in labels:
-        if label in stocks_map:
-            # 传递所有股票信息
-            stock_list = stocks_map[label]
-            custom_data.append(stock_list)
-        else:
-            custom_data.append([])
+    if not lightweight:
+        for label in labels:
+            if label in stocks_map:
+                # 传递所有股票信息
+                stock_list = stocks_map[label]
+                custom_data.append(stock_list)
+            else:
+                custom_data.append([])
     
     # 创建拉出效果的数组
     pulls = [0.02] * len(labels)
@@ -618,8 +3066,8 @@ def plot_distribution_plotly(counter, stocks_map, title, color_scheme='blues'):
         bgcolor = "rgba(255, 243, 224, 0.6)"  # 浅橙色背景
         pull_color = "#F57C00"  # 拉出部分的颜色
     
-    # 为最大值设置特殊颜色
-    colors = color_sequence[:len(labels)]
+    # 为最大值设置特殊颜色，类别数超过颜色数量时循环使用颜色序列
+    colors = [color_sequence[i % len(color_sequence)] for i in range(len(labels))]
     colors[max_idx] = pull_color
     
     # 创建饼图
@@ -639,7 +3087,7 @@ def plot_distribution_plotly(counter, stocks_map, title, color_scheme='blues'):
         textfont=dict(size=14, family="Microsoft YaHei, Arial"),  # 设置中文字体
         textposition='inside',  # 文本放在饼图内部
         hole=.4,  # 中心孔
-        customdata=custom_data,  # 用于点击交互
+        customdata=custom_data or None,  # 用于点击交互
         pull=pulls,  # 拉出效果
         rotation=45,  # 旋转角度增加动感
         direction='clockwise',  # 顺时针方向
@@ -704,19 +3152,21 @@ def plot_distribution_plotly(counter, stocks_map, title, color_scheme='blues'):
     )
     
     # 添加动态效果的帧
-    frames = []
-    for i in range(1, 36):
-        frames.append(
-            go.Frame(
-                data=[go.Pie(
-                    labels=labels,
-                    values=values,
-                    rotation=45 + i*10,  # 旋转角度
-                    pull=pulls
-                )]
+    # 大规模结果不添加动画帧，避免图表数据成倍膨胀
+    if not lightweight:
+        frames = []
+        for i in range(1, 36):
+            frames.append(
+                go.Frame(
+                    data=[go.Pie(
+                        labels=labels,
+                        values=values,
+                        rotation=45 + i*10,  # 旋转角度
+                        pull=pulls
+                    )]
+                )
             )
-        )
-    fig.frames = frames
+        fig.frames = frames
     
     return fig
 
@@ -778,93 +3228,123 @@ def reset_analysis():
     """重置分析结果，清空会话状态"""
     for key in ['stocks_df', 'industry_distribution', 'industry_stocks_map', 
                 'concept_distribution', 'concept_stocks_map', 'analysis_done',
-                'selected_industry', 'selected_concept']:
+                'analysis_scale_mode', 'analysis_snapshot', 'snapshot', 'analysis_key', 'analysis_not_found', 'analysis_online_fallback',
+                'selected_industry', 'selected_concept', 'profile_report']:
         if key in st.session_state:
             del st.session_state[key]
 
-# 添加重置按钮
-if st.session_state.get('analysis_done', False):
-    if st.button("重置分析", key="reset_button"):
-        reset_analysis()
-        st.experimental_rerun()
+def previous_analysis():
+    """
+    取出会话中上一次的分析结果，用于增量更新
 
-# 主程序
-if st.button("自动分析", key="analyze_button"):
-    # 检查输入是否为空
-    if not stock_codes_input:
-        st.error("⚠️ 请输入股票代码")
-    else:
-        # 解析股票代码
-        stock_codes, invalid_codes = parse_stock_codes(stock_codes_input)
-        
-        # 显示无效代码警告
-        if invalid_codes:
-            st.warning(f"⚠️ 检测到以下无效的股票代码: {', '.join(invalid_codes)}")
-        
-        # 检查股票代码数量
-        if len(stock_codes) < 1:
-            st.error("⚠️ 请至少输入1个有效的股票代码")
-        elif len(stock_codes) > 500:
-            st.error("⚠️ 输入的股票代码不应超过500个")
-        else:
-            try:
-                # 设置更长的超时时间
-                st.warning(f"正在分析 {len(stock_codes)} 只股票，请耐心等待...")
-                
-                # 获取股票信息
-                stocks_df = get_stock_info(stock_codes)
-                
-                # 将数据保存到session_state中以便于在选择框交互时不丢失
-                st.session_state.stocks_df = stocks_df
-                
-                # 分析行业和概念分布
-                industry_distribution, industry_stocks_map = analyze_industry_distribution(stocks_df)
-                concept_distribution, concept_stocks_map = analyze_concept_distribution(stocks_df)
-                
-                # 保存分布数据到session_state
-                st.session_state.industry_distribution = industry_distribution
-                st.session_state.industry_stocks_map = industry_stocks_map
-                st.session_state.concept_distribution = concept_distribution
-                st.session_state.concept_stocks_map = concept_stocks_map
-                
-                # 设置标志表示分析已完成
-                st.session_state.analysis_done = True
-                
-                # 显示分析完成提示
-                st.success("✅ 分析完成！")
-                
-                # 自动滚动到结果部分
-                js = '''
-                <script>
-                    function scroll_to_results() {
-                        var results = document.querySelector('h2:contains("股票信息表格")');
-                        if (results) {
-                            results.scrollIntoView({behavior: 'smooth'});
-                        }
-                    }
-                    setTimeout(scroll_to_results, 500);
-                </script>
-                '''
-                components.html(js, height=0)
-                
-            except Exception as e:
-                st.error(f"分析过程中发生错误: {str(e)}")
-                st.info("请尝试重新输入股票代码或稍后再试")
+    返回:
+        与analyze_portfolio结果格式相同的字典，没有可用结果时返回None
+    """
+    if not st.session_state.get('analysis_done', False) or 'analysis_key' not in st.session_state:
+        return None
+    return {
+        "stocks_df": st.session_state.stocks_df,
+        "industry_distribution": st.session_state.industry_distribution,
+        "industry_stocks_map": st.session_state.industry_stocks_map,
+        "concept_distribution": st.session_state.concept_distribution,
+        "concept_stocks_map": st.session_state.concept_stocks_map,
+        "not_found": st.session_state.get('analysis_not_found', []),
+        "key": st.session_state.analysis_key,
+    }
+
+def upgrade_provisional_analysis():
+    """
+    后台加载完成后，用完整快照重新分析会话中的暂定结果
+
+    返回:
+        是否已更新为完整结果
+    """
+    snapshot = st.session_state.get('snapshot')
+    if snapshot is None or "provisional" not in snapshot or not snapshot["provisional"]["job"].done.is_set():
+        return False
+    snapshot = get_membership_snapshot()
+    previous_df = st.session_state.stocks_df
+    result, _ = analyze_portfolio(previous_df["股票代码"].tolist(), snapshot,
+                                  online_fallback=st.session_state.get('analysis_online_fallback', False))
+    stocks_df = result["stocks_df"]
+    if "持仓权重" in previous_df.columns:
+        stocks_df["持仓权重"] = stocks_df["股票代码"].map(previous_df.set_index("股票代码")["持仓权重"])
+    
+    st.session_state.stocks_df = stocks_df
+    st.session_state.snapshot = snapshot
+    st.session_state.industry_distribution = result["industry_distribution"]
+    st.session_state.industry_stocks_map = result["industry_stocks_map"]
+    st.session_state.concept_distribution = result["concept_distribution"]
+    st.session_state.concept_stocks_map = result["concept_stocks_map"]
+    st.session_state.analysis_key = result["key"]
+    st.session_state.analysis_not_found = result["not_found"]
+    return True
+
+def render_provisional_notice(snapshot, stocks_df):
+    """显示暂定结果的说明、后台加载进度以及未加载的行业和概念"""
+    info = snapshot["provisional"]
+    job = info["job"]
+    provisional_count = int(stocks_df["暂定"].sum()) if "暂定" in stocks_df.columns else len(stocks_df)
+    if info["lists_pending"]:
+        st.warning(
+            f"⏳ 以下为暂定结果：分析时股票和板块列表尚未获取完成，{provisional_count} 只股票的行业和概念"
+            f"{'沿用上一次的快照' if info['reference'] is not None else '暂时无法确定'}。"
+            f"板块数据正在后台加载，完成后页面将自动更新为完整结果"
+        )
+        return
+    st.warning(
+        f"⏳ 以下为暂定结果：尚有 {len(info['pending_industries'])} 个行业、{len(info['pending_concepts'])} 个概念"
+        f"在分析时未加载完成，{provisional_count} 只股票的行业或概念可能变化（表格中\"暂定\"列）。"
+        f"其余板块正在后台加载（{job.loaded}/{job.total}），完成后页面将自动更新为完整结果"
+    )
+    with st.expander("未加载的行业和概念"):
+        st.markdown("**行业**：" + ("、".join(info["pending_industries"]) or "无"))
+        st.markdown("**概念**：" + ("、".join(info["pending_concepts"]) or "无"))
 
-# 检查是否已有分析结果
-if st.session_state.get('analysis_done', False):
-    # 从session_state获取数据
-    stocks_df = st.session_state.stocks_df
-    industry_distribution = st.session_state.industry_distribution
-    industry_stocks_map = st.session_state.industry_stocks_map
-    concept_distribution = st.session_state.concept_distribution
-    concept_stocks_map = st.session_state.concept_stocks_map
+def render_stat_metrics(stats, percent_keys=()):
+    """将统计字典显示为一行指标"""
+    stat_cols = st.columns(len(stats))
+    for stat_col, (label, value) in zip(stat_cols, stats.items()):
+        if label in percent_keys:
+            value = f"{value:.1%}"
+        elif isinstance(value, float):
+            value = f"{value:.1f}"
+        stat_col.metric(label, value)
+
+def paginate_dataframe(df, key):
+    """
+    分页截取DataFrame，只把当前页的数据发送到前端
     
-    # 添加分析摘要
+    参数:
+        df: 待分页的DataFrame
+        key: 分页控件的key前缀
+        
+    返回:
+        当前页的DataFrame
+    """
+    size_col, page_col, info_col = st.columns([1, 1, 2])
+    with size_col:
+        page_size = st.selectbox("每页行数", TABLE_PAGE_SIZE_OPTIONS, index=1, key=f"{key}_page_size")
+    
+    total_pages = max(1, math.ceil(len(df) / page_size))
+    # 筛选条件或每页行数变化后，页码可能超出范围
+    if st.session_state.get(f"{key}_page", 1) > total_pages:
+        st.session_state[f"{key}_page"] = total_pages
+    
+    with page_col:
+        page = st.number_input("页码", min_value=1, max_value=total_pages, step=1, key=f"{key}_page")
+    with info_col:
+        st.markdown(f"<div style='padding-top: 2rem;'>共 {len(df)} 行，{total_pages} 页</div>", unsafe_allow_html=True)
+    
+    start = (int(page) - 1) * page_size
+    return df.iloc[start:start + page_size]
+
+def render_summary(stocks_df, industry_distribution, concept_distribution, snapshot_label="最新"):
+    """显示分析摘要卡片"""
     st.markdown("""
     <div class="card" style="margin-top: 30px;">
         <h3 style="color: #0277BD; margin-top: 0;">分析摘要</h3>
-        <p>已完成对 <b>{}</b> 只股票的行业和概念分布分析。</p>
+        <p>已完成对 <b>{}</b> 只股票的行业和概念分布分析（成分股快照：{}）。</p>
         <div style="display: flex; justify-content: space-around; flex-wrap: wrap;">
             <div style="text-align: center; padding: 15px; min-width: 140px;">
                 <div style="font-size: 2rem; font-weight: bold; color: #1E88E5;">{}</div>
@@ -882,12 +3362,65 @@ if st.session_state.get('analysis_done', False):
     </div>
     """.format(
         len(stocks_df),
+        snapshot_label,
         len(stocks_df),
         len(industry_distribution),
         len(concept_distribution)
     ), unsafe_allow_html=True)
+
+def render_concentration_section(metrics_df, exposures):
+    """
+    显示行业和概念维度的集中度指标与板块暴露
+    
+    参数:
+        metrics_df: 集中度指标DataFrame
+        exposures: {维度: 板块暴露DataFrame} 字典
+    """
+    st.markdown('<h2 class="sub-header">集中度分析</h2>', unsafe_allow_html=True)
+    
+    # 占比类指标以百分比显示
+    percent_columns = [c for c in metrics_df.columns if c.endswith("占比")] + ["覆盖率"]
+    display_df = metrics_df.copy()
+    display_df[percent_columns] = display_df[percent_columns] * 100
+    column_config = {
+        c: st.column_config.ProgressColumn(c, format="%.1f%%", min_value=0, max_value=100)
+        for c in percent_columns
+    }
+    column_config["HHI"] = st.column_config.NumberColumn(
+        "HHI", format="%.4f", help="各板块占比的平方和，越接近1越集中"
+    )
+    column_config["有效板块数"] = st.column_config.NumberColumn(
+        "有效板块数", format="%.1f", help="HHI的倒数，相当于同等集中程度下的等权板块数量"
+    )
+    st.dataframe(display_df, hide_index=True, use_container_width=True, column_config=column_config)
+    st.caption("概念维度中一只股票可属于多个概念，暴露之和可能超过100%，占比按全部概念暴露之和计算")
+    
+    tabs = st.tabs([f"{dimension}暴露" for dimension in exposures])
+    for tab, (dimension, exposure_df) in zip(tabs, exposures.items()):
+        with tab:
+            exposure_columns = [c for c in exposure_df.columns if c.endswith("暴露")]
+            display_df = exposure_df.copy()
+            display_df[exposure_columns] = display_df[exposure_columns] * 100
+            max_exposure = float(display_df[exposure_columns].max().max()) if len(display_df) else 100.0
+            st.dataframe(
+                display_df,
+                hide_index=True,
+                use_container_width=True,
+                height=min(400, 35 * (len(display_df) + 1) + 3),
+                column_config={
+                    c: st.column_config.ProgressColumn(c, format="%.2f%%", min_value=0, max_value=max_exposure or 100.0)
+                    for c in exposure_columns
+                }
+            )
+
+def render_stock_table(stocks_df, paginate=False):
+    """
+    显示股票信息表格
     
-    # 显示股票信息表格
+    参数:
+        stocks_df: 包含股票信息的DataFrame
+        paginate: 是否分页显示
+    """
     st.markdown('<h2 class="sub-header">股票信息表格</h2>', unsafe_allow_html=True)
     
     # 使用自定义CSS样式美化表格
@@ -921,12 +3454,16 @@ if st.session_state.get('analysis_done', False):
     # 筛选数据
     if search_term:
         filtered_df = stocks_df[
-            stocks_df['股票代码'].str.contains(search_term) | 
-            stocks_df['股票名称'].str.contains(search_term)
+            stocks_df['股票代码'].str.contains(search_term, regex=False) | 
+            stocks_df['股票名称'].str.contains(search_term, regex=False)
         ]
     else:
         filtered_df = stocks_df
     
+    # 大规模结果只渲染当前页
+    if paginate:
+        filtered_df = paginate_dataframe(filtered_df, "stock_table")
+    
     # 显示表格
     st.dataframe(
         filtered_df, 
@@ -937,152 +3474,153 @@ if st.session_state.get('analysis_done', False):
             "股票名称": st.column_config.TextColumn(width="medium"),
             "所属行业": st.column_config.TextColumn(width="large"),
             "相关概念": st.column_config.TextColumn(width="large"),
+            "持仓权重": st.column_config.NumberColumn(format="%.4f", width="small"),
+            "暂定": st.column_config.CheckboxColumn(width="small", help="后台加载完成后行业或概念可能变化"),
         },
         hide_index=True
     )
     st.markdown('</div>', unsafe_allow_html=True)
+
+def render_board_members(category, board_name, snapshot, held_codes, key, taxonomy=DEFAULT_TAXONOMY):
+    """
+    显示所选板块的全市场成分股，区分组合已持有和未持有的股票
     
-    # 创建两列布局
-    st.markdown('<h2 class="sub-header">分布分析图表</h2>', unsafe_allow_html=True)
-    col1, col2 = st.columns(2)
+    参数:
+        category: 维度名称（"行业"或"概念"）
+        board_name: 板块名称
+        snapshot: 成分股快照
+        held_codes: 组合中的股票代码
+        key: 筛选控件的session_state键
+        taxonomy: 维度为行业时使用的行业分类标准
+    """
+    members_df, overlap = board_overlap(snapshot, category, board_name, held_codes, taxonomy)
+    if members_df is None:
+        st.caption(f"成分股快照中没有{category}「{board_name}」的全市场成分股")
+        return
     
-    # 显示行业分布图
-    with col1:
-        st.markdown('<div class="plot-container">', unsafe_allow_html=True)
-        st.subheader("行业分布")
-        if industry_distribution:
-            # 使用Plotly绘制行业分布图
-            fig_industry = plot_distribution_plotly(industry_distribution, industry_stocks_map, "行业分布", "blues")
+    st.markdown(f"<h5>{category}「{board_name}」全市场成分股：</h5>", unsafe_allow_html=True)
+    render_stat_metrics(overlap, percent_keys=("板块覆盖率", "组合占比"))
+    view = st.radio("显示", ["全部", "已持有", "未持有"], horizontal=True, key=key, label_visibility="collapsed")
+    if view != "全部":
+        members_df = members_df[members_df["是否持有"] == (view == "已持有")]
+    st.dataframe(
+        members_df,
+        column_config={
+            "股票代码": st.column_config.TextColumn("股票代码", width="medium"),
+            "股票名称": st.column_config.TextColumn("股票名称", width="medium"),
+            "是否持有": st.column_config.CheckboxColumn("是否持有"),
+        },
+        hide_index=True,
+        use_container_width=True,
+        height=min(400, 35 * (len(members_df) + 1) + 3)
+    )
+
+def render_distribution_panel(category, distribution, stocks_map, color_scheme, state_key, lightweight=False, max_buckets=DISTRIBUTION_BUCKETS, snapshot=None, held_codes=(), taxonomy=DEFAULT_TAXONOMY):
+    """
+    显示单个维度的分布饼图以及类别详情选择器
+    
+    参数:
+        category: 维度名称（"行业"或"概念"）
+        distribution: 分布计数器
+        stocks_map: 类别-股票映射字典
+        color_scheme: 颜色方案
+        state_key: 保存所选类别的session_state键
+        lightweight: 是否使用轻量图表
+        max_buckets: 饼图最多展示的类别数量
+        snapshot: 成分股快照，提供时展示所选板块的全市场成分股
+        held_codes: 组合中的股票代码
+        taxonomy: 维度为行业时使用的行业分类标准
+    """
+    st.markdown('<div class="plot-container">', unsafe_allow_html=True)
+    st.subheader(f"{category}分布")
+    if distribution:
+        # 使用Plotly绘制分布图
+        fig = plot_distribution_plotly(distribution, stocks_map, f"{category}分布", color_scheme,
+                                       lightweight=lightweight, max_buckets=max_buckets)
+        
+        # 显示饼图
+        st.plotly_chart(fig, use_container_width=True)
+        
+        # 添加关于"其他"类别的说明
+        if len(distribution) > max_buckets:
+            st.markdown(f"""
+            <div style="font-size: 0.8rem; color: #666; margin-top: 5px; margin-bottom: 15px; font-style: italic;">
+                注：当{category}数量超过{max_buckets}个时，仅显示数量最多的前{max_buckets - 1}个{category}，其余{category}归为"其他"类别。
+            </div>
+            """, unsafe_allow_html=True)
+        
+        # 创建一个选择器，让用户选择类别查看股票详情
+        st.markdown(f"<h4 style='margin-top:15px;'>选择{category}查看股票详情</h4>", unsafe_allow_html=True)
+        names = list(stocks_map.keys())
+        if names:
+            # 按照包含的股票数量从大到小排序
+            names = sorted(names, key=lambda x: len(stocks_map[x]), reverse=True)
             
-            # 显示饼图
-            st.plotly_chart(fig_industry, use_container_width=True)
+            # 将"其他"类别移动到最后面
+            if "其他" in names:
+                names.remove("其他")
+                names.append("其他")
             
-            # 添加关于"其他"类别的说明
-            if len(industry_distribution) > 10:
-                st.markdown("""
-                <div style="font-size: 0.8rem; color: #666; margin-top: 5px; margin-bottom: 15px; font-style: italic;">
-                    注：当行业数量超过10个时，仅显示数量最多的前9个行业，其余行业归为"其他"类别。
-                </div>
-                """, unsafe_allow_html=True)
+            # 使用session_state存储选择的类别，避免刷新问题
+            if state_key not in st.session_state:
+                st.session_state[state_key] = names[0]
             
-            # 创建一个选择器，让用户选择行业查看股票详情
-            st.markdown("<h4 style='margin-top:15px;'>选择行业查看股票详情</h4>", unsafe_allow_html=True)
-            industry_names = list(industry_stocks_map.keys())
-            if industry_names:
-                # 按照包含的股票数量从大到小排序行业
-                industry_names = sorted(industry_names, key=lambda x: len(industry_stocks_map[x]), reverse=True)
-                
-                # 将"其他"类别移动到最后面
-                if "其他" in industry_names:
-                    industry_names.remove("其他")
-                    industry_names.append("其他")
-                
-                # 使用session_state存储选择的行业，避免刷新问题
-                if 'selected_industry' not in st.session_state:
-                    st.session_state.selected_industry = industry_names[0]
+            select_key = f"{state_key}_box"
+            selected = st.selectbox(
+                f"选择{category}", 
+                names, 
+                key=select_key,
+                format_func=lambda x: f"{x} ({len(stocks_map[x])}只股票)",
+                index=names.index(st.session_state[state_key]) if st.session_state[state_key] in names else 0,
+                on_change=lambda: st.session_state.update({state_key: st.session_state[select_key]})
+            )
+            
+            if selected:
+                # 显示所选类别的股票
+                st.markdown(f"<h5>{category}「{selected}」包含的股票：</h5>", unsafe_allow_html=True)
+                stocks_in_category = stocks_map[selected]
                 
-                selected_industry = st.selectbox(
-                    "选择行业", 
-                    industry_names, 
-                    key="industry_select",
-                    format_func=lambda x: f"{x} ({len(industry_stocks_map[x])}只股票)",
-                    index=industry_names.index(st.session_state.selected_industry) if st.session_state.selected_industry in industry_names else 0,
-                    on_change=lambda: setattr(st.session_state, 'selected_industry', st.session_state.industry_select)
-                )
+                # 创建DataFrame来显示股票
+                if stocks_in_category:
+                    category_stocks_df = pd.DataFrame(stocks_in_category)
+                    if lightweight:
+                        category_stocks_df = paginate_dataframe(category_stocks_df, select_key)
+                    st.dataframe(
+                        category_stocks_df, 
+                        column_config={
+                            "代码": st.column_config.TextColumn("股票代码", width="medium"),
+                            "名称": st.column_config.TextColumn("股票名称", width="medium")
+                        },
+                        hide_index=True,
+                        use_container_width=True
+                    )
+                else:
+                    st.info(f"此{category}无股票数据")
                 
-                if selected_industry:
-                    # 显示所选行业的股票
-                    st.markdown(f"<h5>行业「{selected_industry}」包含的股票：</h5>", unsafe_allow_html=True)
-                    stocks_in_industry = industry_stocks_map[selected_industry]
-                    
-                    # 创建DataFrame来显示股票
-                    if stocks_in_industry:
-                        industry_stocks_df = pd.DataFrame(stocks_in_industry)
-                        st.dataframe(
-                            industry_stocks_df, 
-                            column_config={
-                                "代码": st.column_config.TextColumn("股票代码", width="medium"),
-                                "名称": st.column_config.TextColumn("股票名称", width="medium")
-                            },
-                            hide_index=True,
-                            use_container_width=True
-                        )
-                    else:
-                        st.info("此行业无股票数据")
-            
-        else:
-            st.info("未找到行业分布数据")
+                # 从快照的反向索引中查询全市场成分股，不需要额外的网络请求
+                if snapshot is not None and selected != "其他":
+                    render_board_members(category, selected, snapshot, held_codes, f"{state_key}_members", taxonomy)
         
-        st.markdown('</div>', unsafe_allow_html=True)
+    else:
+        st.info(f"未找到{category}分布数据")
+    
+    st.markdown('</div>', unsafe_allow_html=True)
+
+def render_distribution_charts(industry_distribution, industry_stocks_map, concept_distribution, concept_stocks_map, lightweight=False, max_buckets=DISTRIBUTION_BUCKETS, snapshot=None, held_codes=(), taxonomy=DEFAULT_TAXONOMY):
+    """显示行业和概念分布图表，提供快照时可查看所选板块的全市场成分股，行业按taxonomy分类标准"""
+    # 创建两列布局
+    st.markdown('<h2 class="sub-header">分布分析图表</h2>', unsafe_allow_html=True)
+    col1, col2 = st.columns(2)
+    
+    # 显示行业分布图
+    with col1:
+        render_distribution_panel("行业", industry_distribution, industry_stocks_map, "blues", "selected_industry",
+                                  lightweight, max_buckets, snapshot, held_codes, taxonomy)
     
     # 显示概念分布图
     with col2:
-        st.markdown('<div class="plot-container">', unsafe_allow_html=True)
-        st.subheader("概念分布")
-        if concept_distribution:
-            # 使用Plotly绘制概念分布图
-            fig_concept = plot_distribution_plotly(concept_distribution, concept_stocks_map, "概念分布", "oranges")
-            
-            # 显示饼图
-            st.plotly_chart(fig_concept, use_container_width=True)
-            
-            # 添加关于"其他"类别的说明
-            if len(concept_distribution) > 10:
-                st.markdown("""
-                <div style="font-size: 0.8rem; color: #666; margin-top: 5px; margin-bottom: 15px; font-style: italic;">
-                    注：当概念数量超过10个时，仅显示数量最多的前9个概念，其余概念归为"其他"类别。
-                </div>
-                """, unsafe_allow_html=True)
-            
-            # 创建一个选择器，让用户选择概念查看股票详情
-            st.markdown("<h4 style='margin-top:15px;'>选择概念查看股票详情</h4>", unsafe_allow_html=True)
-            concept_names = list(concept_stocks_map.keys())
-            if concept_names:
-                # 按照包含的股票数量从大到小排序概念
-                concept_names = sorted(concept_names, key=lambda x: len(concept_stocks_map[x]), reverse=True)
-                
-                # 将"其他"类别移动到最后面
-                if "其他" in concept_names:
-                    concept_names.remove("其他")
-                    concept_names.append("其他")
-                
-                # 使用session_state存储选择的概念，避免刷新问题
-                if 'selected_concept' not in st.session_state:
-                    st.session_state.selected_concept = concept_names[0]
-                
-                selected_concept = st.selectbox(
-                    "选择概念", 
-                    concept_names, 
-                    key="concept_select",
-                    format_func=lambda x: f"{x} ({len(concept_stocks_map[x])}只股票)",
-                    index=concept_names.index(st.session_state.selected_concept) if st.session_state.selected_concept in concept_names else 0,
-                    on_change=lambda: setattr(st.session_state, 'selected_concept', st.session_state.concept_select)
-                )
-                
-                if selected_concept:
-                    # 显示所选概念的股票
-                    st.markdown(f"<h5>概念「{selected_concept}」包含的股票：</h5>", unsafe_allow_html=True)
-                    stocks_in_concept = concept_stocks_map[selected_concept]
-                    
-                    # 创建DataFrame来显示股票
-                    if stocks_in_concept:
-                        concept_stocks_df = pd.DataFrame(stocks_in_concept)
-                        st.dataframe(
-                            concept_stocks_df, 
-                            column_config={
-                                "代码": st.column_config.TextColumn("股票代码", width="medium"),
-                                "名称": st.column_config.TextColumn("股票名称", width="medium")
-                            },
-                            hide_index=True,
-                            use_container_width=True
-                        )
-                    else:
-                        st.info("此概念无股票数据")
-            
-        else:
-            st.info("未找到概念分布数据")
-        
-        st.markdown('</div>', unsafe_allow_html=True)
+        render_distribution_panel("概念", concept_distribution, concept_stocks_map, "oranges", "selected_concept",
+                                  lightweight, max_buckets, snapshot, held_codes)
     
     # 添加点击事件说明
     st.markdown("""
@@ -1092,39 +3630,186 @@ if st.session_state.get('analysis_done', False):
         </p>
     </div>
     """, unsafe_allow_html=True)
+
+def render_similarity_section(stocks_df, snapshot):
+    """
+    显示相似股票查询和组合内的概念共现分析
     
-    # 添加下载功能
+    参数:
+        stocks_df: 包含股票信息的DataFrame
+        snapshot: 本次分析使用的成分股快照
+    """
+    st.markdown('<h2 class="sub-header">相似股票与概念共现</h2>', unsafe_allow_html=True)
+    col1, col2 = st.columns(2)
+    held_codes = stocks_df["股票代码"].tolist()
+    
+    with col1:
+        st.subheader("相似股票")
+        code_to_name = dict(zip(stocks_df["股票代码"], stocks_df["股票名称"]))
+        query_code = st.selectbox(
+            "选择股票",
+            list(code_to_name.keys()),
+            key="similar_stock_select",
+            format_func=lambda code: f"{code} {code_to_name[code]}"
+        )
+        top_k = st.slider("显示数量", min_value=5, max_value=SIMILAR_TOP_K, value=10, key="similar_top_k")
+        similar_df = find_similar_stocks(snapshot, query_code, top_k, held_codes)
+        if similar_df.empty:
+            st.info("该股票没有可比较的概念数据")
+        else:
+            st.dataframe(similar_df, hide_index=True, use_container_width=True)
+    
+    with col2:
+        st.subheader("组合概念共现")
+        pairs_df, matrix, top_concepts = portfolio_concept_cooccurrence(snapshot, held_codes)
+        if pairs_df.empty:
+            st.info("组合内没有共同出现的概念")
+        else:
+            labels = list(snapshot["concept_names"][top_concepts])
+            fig = go.Figure(data=go.Heatmap(z=matrix, x=labels, y=labels, colorscale="Blues"))
+            fig.update_layout(
+                height=450,
+                margin=dict(t=20, b=20, l=20, r=20),
+                font=dict(family="Microsoft YaHei, Arial")
+            )
+            st.plotly_chart(fig, use_container_width=True)
+            st.dataframe(pairs_df, hide_index=True, use_container_width=True)
+
+def reset_scoring_controls():
+    """将评分参数控件恢复为默认值"""
+    for key in ['score_rank_weight', 'score_precision_weight', 'score_heat_weight',
+                'score_top_k', 'distribution_buckets', 'excluded_concepts']:
+        if key in st.session_state:
+            del st.session_state[key]
+
+def render_scoring_controls(snapshot):
+    """
+    显示概念评分参数、保留概念数、排除概念和饼图类别数量的调整控件
+    
+    参数:
+        snapshot: 分析时使用的成分股快照，排除概念的可选项来自其中的概念列表
+        
+    返回:
+        当前参数字典，包含score_weights、top_k、excluded和buckets
+    """
+    rank_default, precision_default, heat_default = DEFAULT_SCORE_WEIGHTS
+    with st.expander("评分参数（调整后即时重新计算，无需重新分析）"):
+        col1, col2, col3 = st.columns(3)
+        rank_weight = col1.slider("板块排序权重", 0.0, 1.0, rank_default, 0.05, key="score_rank_weight",
+                                  help="概念板块在东方财富列表中越靠前，得分越高")
+        precision_weight = col2.slider("精确度权重", 0.0, 1.0, precision_default, 0.05, key="score_precision_weight",
+                                       help="成分股数量在30-100之间的概念得分最高")
+        heat_weight = col3.slider("热度权重", 0.0, 1.0, heat_default, 0.05, key="score_heat_weight",
+                                  help="概念板块涨跌幅的绝对值越大，得分越高")
+        
+        col4, col5 = st.columns(2)
+        top_k = col4.number_input("每只股票保留的概念数", min_value=1, max_value=20, value=TOP_CONCEPTS,
+                                  step=1, key="score_top_k")
+        buckets = col5.slider("饼图展示的类别数", min_value=3, max_value=30, value=DISTRIBUTION_BUCKETS,
+                              key="distribution_buckets", help="超出部分归为\"其他\"")
+        
+        concept_options = np.asarray(snapshot["concept_names"]).tolist()
+        # 快照更新后去掉已不存在的概念，避免多选框的值不在选项中
+        if "excluded_concepts" in st.session_state:
+            available = set(concept_options)
+            st.session_state.excluded_concepts = [c for c in st.session_state.excluded_concepts if c in available]
+        excluded = st.multiselect("排除的概念", concept_options,
+                                  key="excluded_concepts", placeholder="例如：融资融券、深股通等非主题类概念")
+        st.button("恢复默认参数", key="reset_scoring_button", on_click=reset_scoring_controls)
+    
+    return {
+        "score_weights": (rank_weight, precision_weight, heat_weight),
+        "top_k": int(top_k),
+        "excluded": tuple(excluded),
+        "buckets": buckets,
+    }
+
+def render_taxonomy_selector(snapshot):
+    """
+    显示行业分类标准选择器，快照中只有默认分类标准时不显示
+    
+    参数:
+        snapshot: 分析时使用的成分股快照
+        
+    返回:
+        所选的行业分类标准名称
+    """
+    taxonomies = np.asarray(snapshot["taxonomies"]).tolist()
+    if len(taxonomies) < 2:
+        return DEFAULT_TAXONOMY
+    # 快照更新后所选分类标准可能已不可用
+    if st.session_state.get("industry_taxonomy") not in taxonomies:
+        st.session_state.industry_taxonomy = DEFAULT_TAXONOMY
+    return st.radio("行业分类标准", taxonomies, horizontal=True, key="industry_taxonomy",
+                    help="切换后基于成分股快照即时重新统计行业分布，无需重新加载数据")
+
+def render_export(stocks_df, industry_distribution, concept_distribution, concentration=None, max_buckets=DISTRIBUTION_BUCKETS):
+    """显示数据导出区域，concentration为concentration_metrics的结果，分布图按max_buckets渲染为静态图片"""
     st.markdown('<h2 class="sub-header">数据导出</h2>', unsafe_allow_html=True)
     st.markdown('<div class="card">', unsafe_allow_html=True)
     
+    # 服务器端渲染的分布图，相同的分布直接复用缓存的图片；没有中文字体时只导出表格
+    try:
+        chart_fonts()
+        charts = {
+            "行业": lambda image_format: render_distribution_image(industry_distribution, "行业分布", "blues", max_buckets, image_format),
+            "概念": lambda image_format: render_distribution_image(concept_distribution, "概念分布", "oranges", max_buckets, image_format),
+        }
+    except RuntimeError as e:
+        st.warning(str(e))
+        charts = {}
+    
     # 添加下载选项
     col1, col2 = st.columns(2)
     
     with col1:
         @st.cache_data
-        def convert_df_to_excel(df):
+        def convert_df_to_excel(df, industry_distribution, concept_distribution, concentration, chart_images):
             output = io.BytesIO()
             with pd.ExcelWriter(output, engine='openpyxl') as writer:
                 # 将股票信息表格写入第一个Sheet
                 df.to_excel(writer, index=False, sheet_name='股票信息表格')
                 
                 # 如果存在行业分布数据，写入第二个Sheet
-                if 'industry_distribution' in st.session_state and st.session_state['industry_distribution']:
-                    industry_df = pd.DataFrame(list(st.session_state['industry_distribution'].items()), 
+                if industry_distribution:
+                    industry_df = pd.DataFrame(list(industry_distribution.items()), 
                                              columns=['行业', '股票数量'])
                     industry_df = industry_df.sort_values('股票数量', ascending=False)
                     industry_df.to_excel(writer, index=False, sheet_name='行业分布')
                 
                 # 如果存在概念分布数据，写入第三个Sheet
-                if 'concept_distribution' in st.session_state and st.session_state['concept_distribution']:
-                    concept_df = pd.DataFrame(list(st.session_state['concept_distribution'].items()), 
+                if concept_distribution:
+                    concept_df = pd.DataFrame(list(concept_distribution.items()), 
                                             columns=['概念', '股票数量'])
                     concept_df = concept_df.sort_values('股票数量', ascending=False)
                     concept_df.to_excel(writer, index=False, sheet_name='概念分布')
+                
+                # 集中度指标和各维度的板块暴露
+                if concentration is not None:
+                    metrics_df, exposures = concentration
+                    metrics_df.to_excel(writer, index=False, sheet_name='集中度指标')
+                    for dimension, exposure_df in exposures.items():
+                        exposure_df.to_excel(writer, index=False, sheet_name=f'{dimension}暴露')
+                
+                # 分布图以PNG图片嵌入单独的Sheet，上下排列
+                if chart_images:
+                    from openpyxl.drawing.image import Image as ExcelImage
+                    chart_sheet = writer.book.create_sheet('分布图表')
+                    row = 1
+                    for image in chart_images:
+                        picture = ExcelImage(io.BytesIO(image))
+                        scale = CHART_EXCEL_WIDTH / picture.width
+                        picture.width, picture.height = CHART_EXCEL_WIDTH, int(picture.height * scale)
+                        chart_sheet.add_image(picture, f"A{row}")
+                        # 默认行高为20像素，图片之间空出两行
+                        row += picture.height // 20 + 2
                     
             return output.getvalue()
         
-        excel = convert_df_to_excel(stocks_df)
+        chart_images = tuple(charts[dimension]("png") for dimension, distribution in
+                             (("行业", industry_distribution), ("概念", concept_distribution))
+                             if distribution and dimension in charts)
+        excel = convert_df_to_excel(stocks_df, industry_distribution, concept_distribution, concentration, chart_images)
         st.download_button(
             label="📥 下载Excel文件",
             data=excel,
@@ -1133,7 +3818,530 @@ if st.session_state.get('analysis_done', False):
             key="download_excel_button"
         )
     
+    with col2:
+        if charts:
+            image_format = st.radio("分布图格式", list(CHART_IMAGE_FORMATS), horizontal=True,
+                                    format_func=str.upper, key="chart_image_format")
+            for dimension, distribution in (("行业", industry_distribution), ("概念", concept_distribution)):
+                if distribution:
+                    st.download_button(
+                        label=f"📥 下载{dimension}分布图",
+                        data=charts[dimension](image_format),
+                        file_name=f"{dimension}分布.{image_format}",
+                        mime=CHART_IMAGE_FORMATS[image_format],
+                        key=f"download_{'industry' if dimension == '行业' else 'concept'}_chart_button"
+                    )
+        else:
+            st.caption("未找到中文字体，暂不提供分布图下载")
+    
     st.markdown('</div>', unsafe_allow_html=True)
 
+# 性能分析模式：通过 URL 参数 ?profile=1 或环境变量 STOCK_ANALYZER_PROFILE=1 开启
+PROFILE_ENV_ENABLED = os.environ.get("STOCK_ANALYZER_PROFILE", "").lower() in ("1", "true", "yes")
+PROFILE_TOP_N = int(os.environ.get("STOCK_ANALYZER_PROFILE_TOP_N", "30"))
+# 按文件路径或内置函数名将耗时归类，用于判断时间花在网络、pandas还是Plotly上
+PROFILE_CATEGORIES = (
+    ("网络请求", ("/socket.py", "_socket", "ssl", "/http/client.py", "/urllib3/", "/requests/")),
+    ("pandas", ("/pandas/",)),
+    ("numpy/scipy", ("/numpy/", "/scipy/")),
+    ("Plotly", ("/plotly/", "/_plotly_utils/")),
+    ("Streamlit", ("/streamlit/",)),
+    ("本应用", ("stock_analyzer.py",)),
+    ("模块导入", ("<frozen importlib",)),
+)
+
+def profiling_requested():
+    """判断当前会话是否开启了性能分析模式"""
+    if PROFILE_ENV_ENABLED:
+        return True
+    return str(st.query_params.get("profile", "")).lower() in ("1", "true", "yes")
+
+@st.cache_resource
+def get_profiler_state():
+    """
+    进程内共享的性能分析状态：cProfile和tracemalloc都作用于整个进程，同一时间只允许一个会话采样
+
+    cProfile只采样开启它的线程，采样期间设置active，后台加载线程据此在线程内单独采样每一步加载，
+    采样结果追加到thread_profilers中
+    """
+    return {"lock": threading.Lock(), "active": threading.Event(), "thread_profilers": [], "thread_lock": threading.Lock()}
+
+def run_profiled(state, func, *args, **kwargs):
+    """
+    在脚本线程以外的线程中调用func，性能分析采样期间用单独的cProfile采样这次调用
+
+    参数:
+        state: get_profiler_state返回的性能分析状态
+        func: 被调用的函数
+
+    返回:
+        func的返回值
+    """
+    if not state["active"].is_set():
+        return func(*args, **kwargs)
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # 已有其他性能分析工具作用于整个进程时不重复采样
+        return func(*args, **kwargs)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        with state["thread_lock"]:
+            state["thread_profilers"].append(profiler)
+
+def _profile_category(filename, func_name):
+    """根据文件路径和函数名判断函数所属的耗时类别"""
+    location = f"{filename.replace(os.sep, '/')} {func_name}"
+    for category, patterns in PROFILE_CATEGORIES:
+        if any(pattern in location for pattern in patterns):
+            return category
+    return "其他"
+
+def _short_location(filename, lineno):
+    """将源文件路径缩短为最后两级目录，便于在表格中查看"""
+    if filename == "~":
+        return "内置"
+    parts = filename.replace(os.sep, "/").split("/")
+    return f"{'/'.join(parts[-2:])}:{lineno}"
+
+def build_profile_report(profiler, memory_snapshot, elapsed, peak_memory, top_n=PROFILE_TOP_N, thread_profilers=()):
+    """
+    汇总cProfile和tracemalloc的采样结果
+    
+    参数:
+    profiler: 已停止的cProfile.Profile
+    thread_profilers: 采样期间后台加载线程中的cProfile.Profile，与profiler合并统计
+    memory_snapshot: tracemalloc快照
+    elapsed: 分析耗时（秒）
+    peak_memory: 分析期间的内存峰值（字节）
+    top_n: 热点函数和内存分配展示的条数
+    
+    返回:
+    dict: 包含指标、耗时类别、热点函数、内存分配表格以及可下载的.prof文件和文本摘要
+    """
+    stats = pstats.Stats(profiler, *thread_profilers)
+    rows = [
+        {
+            "函数": func_name,
+            "位置": _short_location(filename, lineno),
+            "类别": _profile_category(filename, func_name),
+            "调用次数": nc,
+            "自身耗时(秒)": tt,
+            "累计耗时(秒)": ct,
+        }
+        for (filename, lineno, func_name), (cc, nc, tt, ct, callers) in stats.stats.items()
+    ]
+    functions_df = pd.DataFrame(rows, columns=["函数", "位置", "类别", "调用次数", "自身耗时(秒)", "累计耗时(秒)"])
+    
+    # 各类别的自身耗时之和等于总采样耗时，可直接比较占比
+    category_df = (functions_df.groupby("类别")["自身耗时(秒)"].sum()
+                   .sort_values(ascending=False).reset_index())
+    total_time = category_df["自身耗时(秒)"].sum()
+    category_df["占比"] = category_df["自身耗时(秒)"] / total_time if total_time else 0.0
+    hot_df = functions_df.sort_values("累计耗时(秒)", ascending=False).head(top_n).reset_index(drop=True)
+    
+    # 忽略tracemalloc自身和导入机制产生的分配
+    memory_snapshot = memory_snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ))
+    memory_df = pd.DataFrame(
+        [
+            {
+                "位置": _short_location(stat.traceback[0].filename, stat.traceback[0].lineno),
+                "内存(KB)": stat.size / 1024,
+                "分配次数": stat.count,
+            }
+            for stat in memory_snapshot.statistics("lineno")[:top_n]
+        ],
+        columns=["位置", "内存(KB)", "分配次数"],
+    )
+    
+    # 文本摘要：pstats按累计耗时排序的原始输出加上类别和内存统计
+    pstats_text = io.StringIO()
+    pstats.Stats(profiler, *thread_profilers, stream=pstats_text).sort_stats("cumulative").print_stats(top_n)
+    summary = "\n".join([
+        f"分析耗时: {elapsed:.3f} 秒",
+        f"内存峰值: {peak_memory / 1024 / 1024:.1f} MB",
+        "",
+        "== 耗时类别（自身耗时） ==",
+        category_df.to_string(index=False),
+        "",
+        f"== 热点函数 Top {top_n}（按累计耗时） ==",
+        pstats_text.getvalue(),
+        f"== 内存分配 Top {top_n} ==",
+        memory_df.to_string(index=False),
+    ])
+    
+    return {
+        "metrics": {
+            "分析耗时(秒)": elapsed,
+            "内存峰值(MB)": peak_memory / 1024 / 1024,
+            "函数数量": len(functions_df),
+            "后台加载采样次数": len(thread_profilers),
+        },
+        "categories": category_df,
+        "functions": hot_df,
+        "memory": memory_df,
+        # 与 cProfile 的 dump_stats 格式相同，可用 pstats 或 snakeviz 打开
+        "prof": marshal.dumps(stats.stats),
+        "summary": summary,
+        "created_at": time.strftime("%Y%m%d_%H%M%S"),
+    }
+
+@contextmanager
+def profile_analysis(enabled):
+    """
+    对一次完整分析（快照获取、分类、作图和渲染）进行cProfile和tracemalloc采样，
+    采样期间后台加载线程中的板块列表和成分股加载一并采样，结果保存在 st.session_state.profile_report 中
+    
+    参数:
+    enabled: 是否采样，为False时不产生任何开销
+    """
+    if not enabled:
+        yield
+        return
+    
+    state = get_profiler_state()
+    lock = state["lock"]
+    if not lock.acquire(blocking=False):
+        st.warning("⚠️ 其他会话正在进行性能分析，本次分析不采样")
+        yield
+        return
+    
+    try:
+        profiler = cProfile.Profile()
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        with state["thread_lock"]:
+            state["thread_profilers"].clear()
+        state["active"].set()
+        start_time = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            state["active"].clear()
+            with state["thread_lock"]:
+                thread_profilers = list(state["thread_profilers"])
+                state["thread_profilers"].clear()
+            elapsed = time.perf_counter() - start_time
+            memory_snapshot = tracemalloc.take_snapshot()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            if not was_tracing:
+                tracemalloc.stop()
+        st.session_state.profile_report = build_profile_report(profiler, memory_snapshot, elapsed, peak_memory,
+                                                               thread_profilers=thread_profilers)
+    finally:
+        lock.release()
+
+def render_profile_report(report):
+    """显示性能分析结果和下载按钮"""
+    st.markdown('<h2 class="sub-header">性能分析</h2>', unsafe_allow_html=True)
+    render_stat_metrics(report["metrics"])
+    
+    st.markdown("**耗时类别（自身耗时）**")
+    st.dataframe(report["categories"], hide_index=True, use_container_width=True,
+                 column_config={"占比": st.column_config.ProgressColumn("占比", format="%.2f", min_value=0, max_value=1)})
+    
+    st.markdown(f"**热点函数 Top {len(report['functions'])}（按累计耗时）**")
+    st.dataframe(report["functions"], hide_index=True, use_container_width=True)
+    
+    st.markdown("**内存分配 Top（按代码行）**")
+    st.dataframe(report["memory"], hide_index=True, use_container_width=True)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            label="📥 下载 .prof 文件",
+            data=report["prof"],
+            file_name=f"stock_analyzer_{report['created_at']}.prof",
+            mime="application/octet-stream",
+            key="download_profile_button"
+        )
+    with col2:
+        st.download_button(
+            label="📥 下载热点摘要",
+            data=report["summary"].encode("utf-8"),
+            file_name=f"stock_analyzer_{report['created_at']}.txt",
+            mime="text/plain",
+            key="download_profile_summary_button"
+        )
+
+# 添加重置按钮
+if st.session_state.get('analysis_done', False):
+    if st.button("重置分析", key="reset_button"):
+        reset_analysis()
+        st.experimental_rerun()
+
+# 解析上传的持仓文件
+holdings_df = None
+if uploaded_file is not None:
+    try:
+        holdings_df, holdings_stats = get_uploaded_holdings(uploaded_file)
+        weight_note = f"，权重列：{holdings_stats['权重列']}" if holdings_stats['权重列'] else ""
+        st.info(
+            f"已从持仓文件的 {holdings_stats['总行数']} 行中识别出 {holdings_stats['股票数量']} 只股票"
+            f"（代码列：{holdings_stats['代码列']}{weight_note}），分析时将使用文件中的股票代码"
+        )
+        if holdings_stats['无效代码行数']:
+            st.warning(f"⚠️ 持仓文件中有 {holdings_stats['无效代码行数']} 行的股票代码无法识别，已忽略")
+    except Exception as e:
+        st.error(f"读取持仓文件时出错: {e}")
+
+def run_analysis(stock_codes_input, holdings_df, scale_mode, full_market, snapshot_choice, history_options, analysis_deadline):
+    """
+    点击"自动分析"后解析股票代码、获取快照并分析组合，结果保存到session_state中
+    
+    参数:
+        stock_codes_input: 输入的股票代码文本
+        holdings_df: 上传的持仓文件解析结果，没有上传时为None
+        scale_mode: 是否为大规模模式
+        full_market: 是否分析全市场
+        snapshot_choice: 选择的快照日期，"最新"表示当前快照
+        history_options: 历史快照日期到记录时间戳的映射
+        analysis_deadline: 等待板块数据加载的最长秒数，0表示一直等待
+    """
+    stock_codes = []
+    
+    # 全市场模式直接使用全部A股代码
+    if scale_mode and full_market:
+        stock_codes = get_stock_basic_info()['code'].astype(str).tolist()
+        if not stock_codes:
+            st.error("⚠️ 未能获取全市场股票列表")
+    else:
+        if holdings_df is not None:
+            # 使用持仓文件中去重后的股票代码
+            stock_codes = holdings_df["股票代码"].tolist()
+        # 检查输入是否为空
+        elif not stock_codes_input:
+            st.error("⚠️ 请输入股票代码")
+        else:
+            # 解析股票代码
+            stock_codes, invalid_codes = parse_stock_codes(stock_codes_input)
+            
+            # 显示无效代码警告
+            if invalid_codes:
+                st.warning(f"⚠️ 检测到以下无效的股票代码: {', '.join(invalid_codes)}")
+        
+        # 检查股票代码数量
+        if (holdings_df is not None or stock_codes_input) and len(stock_codes) < 1:
+            st.error("⚠️ 请至少输入1个有效的股票代码")
+        elif len(stock_codes) > MAX_STOCK_CODES and not scale_mode:
+            st.error(f"⚠️ 输入的股票代码不应超过{MAX_STOCK_CODES}个，如需分析更多股票请勾选\"大规模模式\"")
+            stock_codes = []
+    
+    if stock_codes:
+        try:
+            # 重复的代码只分析一次，表格中每只股票一行
+            duplicate_count = len(stock_codes) - len(set(stock_codes))
+            if duplicate_count:
+                stock_codes = list(dict.fromkeys(stock_codes))
+                st.info(f"输入中有 {duplicate_count} 个重复的股票代码，每只股票只分析一次")
+            
+            # 设置更长的超时时间
+            st.warning(f"正在分析 {len(stock_codes)} 只股票，请耐心等待...")
+            
+            # 选择历史日期时使用重建的历史快照
+            history_run = snapshot_choice != "最新"
+            if history_run:
+                snapshot = load_history_snapshot(history_options[snapshot_choice])
+                if snapshot is None:
+                    raise ValueError(f"无法重建 {snapshot_choice} 的历史快照")
+            else:
+                snapshot = get_membership_snapshot(deadline=analysis_deadline or None)
+            provisional = "provisional" in snapshot
+            
+            # 获取股票信息并分析行业和概念分布，大规模分析、历史快照分析和暂定结果不逐只实时查询缺失的行业
+            large_run = len(stock_codes) > MAX_STOCK_CODES
+            online_fallback = not (large_run or history_run or provisional)
+            result, cache_hit = analyze_portfolio(stock_codes, snapshot, online_fallback=online_fallback,
+                                                  previous=previous_analysis())
+            stocks_df = result["stocks_df"]
+            # 股票列表尚未获取时无法判断代码是否存在，更新为完整结果后再提示
+            if not (provisional and snapshot["provisional"]["lists_pending"]):
+                render_not_found_warning(result["not_found"])
+            if cache_hit:
+                st.info("⚡ 该组合在当前快照下已分析过，直接使用缓存结果")
+            elif result["changes"] is not None:
+                st.info(f"⚡ 基于上一次的分析结果增量更新：新增 {result['changes']['新增']} 只，"
+                        f"移除 {result['changes']['移除']} 只股票")
+            
+            # 持仓文件提供了权重时附加到股票信息中
+            if holdings_df is not None and holdings_df["持仓权重"].notna().any():
+                stocks_df["持仓权重"] = stocks_df["股票代码"].map(
+                    holdings_df.set_index("股票代码")["持仓权重"]
+                )
+            
+            # 暂定结果中标出可能随后台加载而变化的股票
+            if provisional:
+                stocks_df["暂定"] = provisional_mask(snapshot, stocks_df["股票代码"])
+            
+            # 将数据保存到session_state中以便于在选择框交互时不丢失
+            st.session_state.stocks_df = stocks_df
+            st.session_state.snapshot = snapshot
+            
+            # 保存分布数据到session_state
+            st.session_state.industry_distribution = result["industry_distribution"]
+            st.session_state.industry_stocks_map = result["industry_stocks_map"]
+            st.session_state.concept_distribution = result["concept_distribution"]
+            st.session_state.concept_stocks_map = result["concept_stocks_map"]
+            st.session_state.analysis_key = result["key"]
+            st.session_state.analysis_not_found = result["not_found"]
+            st.session_state.analysis_online_fallback = online_fallback
+            st.session_state.analysis_scale_mode = scale_mode or large_run
+            st.session_state.analysis_snapshot = snapshot_choice
+            
+            # 设置标志表示分析已完成
+            st.session_state.analysis_done = True
+            
+            # 显示分析完成提示
+            st.success("✅ 分析完成！")
+            
+            # 自动滚动到结果部分
+            js = """
+            <script>
+                function scroll_to_results() {
+                    var results = document.querySelector('h2:contains("股票信息表格")');
+                    if (results) {
+                        results.scrollIntoView({behavior: 'smooth'});
+                    }
+                }
+                setTimeout(scroll_to_results, 500);
+            </script>
+            """
+            components.html(js, height=0)
+            
+        except Exception as e:
+            st.error(f"分析过程中发生错误: {str(e)}")
+            st.info("请尝试重新输入股票代码或稍后再试")
+
+def render_analysis_results():
+    """显示session_state中已完成的分析结果"""
+    # 从session_state获取数据
+    stocks_df = st.session_state.stocks_df
+    industry_distribution = st.session_state.industry_distribution
+    # 绘图时会向映射中加入"其他"类别，类别数量可调，每次使用副本
+    industry_stocks_map = dict(st.session_state.industry_stocks_map)
+    concept_distribution = st.session_state.concept_distribution
+    concept_stocks_map = dict(st.session_state.concept_stocks_map)
+    large_result = st.session_state.get('analysis_scale_mode', False)
+    snapshot = st.session_state.get('snapshot')
+    
+    if snapshot is not None and "provisional" in snapshot:
+        render_provisional_notice(snapshot, stocks_df)
+    
+    # 评分参数调整后基于快照重新计算相关概念和概念分布
+    buckets = DISTRIBUTION_BUCKETS
+    taxonomy = DEFAULT_TAXONOMY
+    if snapshot is not None:
+        scoring = render_scoring_controls(snapshot)
+        buckets = scoring["buckets"]
+        if (scoring["score_weights"], scoring["top_k"], scoring["excluded"]) != (DEFAULT_SCORE_WEIGHTS, TOP_CONCEPTS, ()):
+            rescore_start = time.perf_counter()
+            stocks_df, concept_distribution, concept_stocks_map = rescore_portfolio(
+                stocks_df, snapshot, scoring["score_weights"], scoring["top_k"], scoring["excluded"]
+            )
+            st.caption(f"已按调整后的评分参数重新计算相关概念（耗时 {(time.perf_counter() - rescore_start) * 1000:.1f} 毫秒）")
+        
+        # 选择其他行业分类标准时，从快照的行业编号矩阵中直接取出所属行业
+        taxonomy = render_taxonomy_selector(snapshot)
+        if taxonomy != DEFAULT_TAXONOMY:
+            stocks_df = stocks_df.copy()
+            stocks_df["所属行业"] = taxonomy_industries(snapshot, stocks_df["股票代码"], taxonomy)
+            industry_distribution, industry_stocks_map = analyze_industry_distribution(stocks_df)
+    
+    # 添加分析摘要
+    render_summary(stocks_df, industry_distribution, concept_distribution,
+                   st.session_state.get('analysis_snapshot', "最新"))
+    
+    # 行业和概念集中度，持仓文件提供了权重时同时给出持仓加权口径
+    concentration = concentration_metrics(stocks_df, snapshot=snapshot, taxonomy=taxonomy)
+    render_concentration_section(*concentration)
+    
+    if large_result:
+        # 大规模结果先展示汇总图表，再分页展示明细表格
+        render_distribution_charts(industry_distribution, industry_stocks_map,
+                                   concept_distribution, concept_stocks_map, lightweight=True, max_buckets=buckets,
+                                   snapshot=snapshot, held_codes=stocks_df["股票代码"], taxonomy=taxonomy)
+        render_stock_table(stocks_df, paginate=True)
+    else:
+        render_stock_table(stocks_df)
+        render_distribution_charts(industry_distribution, industry_stocks_map,
+                                   concept_distribution, concept_stocks_map, max_buckets=buckets,
+                                   snapshot=snapshot, held_codes=stocks_df["股票代码"], taxonomy=taxonomy)
+    
+    # 相似股票与概念共现
+    if snapshot is not None:
+        render_similarity_section(stocks_df, snapshot)
+    
+    # 添加下载功能
+    render_export(stocks_df, industry_distribution, concept_distribution, concentration, buckets)
+
+# 主程序
+analyze_clicked = st.button("自动分析", key="analyze_button")
+profile_mode = profiling_requested()
+if profile_mode:
+    st.caption("🔬 性能分析模式已开启，点击\"自动分析\"后将采样本次完整分析的耗时与内存分配")
+
+# 性能分析模式下对点击后的完整分析（含结果渲染）进行采样
+with profile_analysis(analyze_clicked and profile_mode):
+    if analyze_clicked:
+        run_analysis(stock_codes_input, holdings_df, scale_mode, full_market, snapshot_choice, history_options, analysis_deadline)
+    
+    # 暂定结果在后台加载完成后原地更新为完整结果
+    if st.session_state.get('analysis_done', False):
+        try:
+            if upgrade_provisional_analysis():
+                st.success("✅ 后台数据加载完成，已更新为完整结果")
+                render_not_found_warning(st.session_state.analysis_not_found)
+        except Exception as e:
+            # 后台加载失败时保留暂定结果，不再自动更新
+            st.error(f"后台加载板块数据失败，暂定结果不再自动更新: {str(e)}")
+            st.session_state.snapshot = {k: v for k, v in st.session_state.snapshot.items() if k != "provisional"}
+    
+    # 检查是否已有分析结果
+    if st.session_state.get('analysis_done', False):
+        render_analysis_results()
+
+# 性能分析结果
+if profile_mode and st.session_state.get('profile_report'):
+    render_profile_report(st.session_state.profile_report)
+
+# 运行统计
+with st.expander("运行统计"):
+    st.markdown("**上游连接**")
+    pool_summary, pool_hosts_df = http_pool_stats(get_http_session())
+    render_stat_metrics(pool_summary, percent_keys=("连接复用率",))
+    st.dataframe(pool_hosts_df, hide_index=True, use_container_width=True)
+
+    st.markdown("**数据刷新**")
+    render_stat_metrics(freshness_status())
+
+    st.markdown("**板块成分股缓存**")
+    render_stat_metrics(get_board_cache().stats(), percent_keys=("命中率",))
+
+    st.markdown("**组合结果缓存**")
+    render_stat_metrics(get_result_cache().stats(), percent_keys=("命中率",))
+
+    st.markdown("**分类API**")
+    if api_server is not None:
+        st.caption(f"监听地址: http://{api_server.server_address[0]}:{api_server.server_address[1]}")
+        st.dataframe(api_stats.summary(), hide_index=True, use_container_width=True)
+    else:
+        st.caption("本进程未启动分类API")
+
 # 页脚
 st.markdown('<div style="border-top: 1px solid #1E88E5; margin-top: 30px; padding-top: 20px; text-align: center; color: #757575;">数据来源：东方财富、<a href="https://github.com/akfamily/akshare" target="_blank" style="color: #1E88E5; text-decoration: none;">AKShare</a></div>', unsafe_allow_html=True) 
+
+# 展示暂定结果时定时重新运行，后台加载完成后原地更新为完整结果
+if st.session_state.get('analysis_done', False) and "provisional" in (st.session_state.get('snapshot') or {}):
+    time.sleep(PROVISIONAL_POLL_INTERVAL)
+    st.experimental_rerun()
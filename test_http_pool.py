@@ -0,0 +1,108 @@
+"""
+共享连接池的测试：在本机启动一个HTTP服务代替上游接口，检查连接复用和统计
+
+用法:
+    python -m unittest test_http_pool
+"""
+
+import sys
+import threading
+import types
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from http_pool import PooledSession, install_pooled_session, http_pool_stats
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """支持长连接的最小上游服务，GET和POST都返回固定的JSON"""
+
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        body = b'{"data": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _reply
+    do_POST = _reply
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PooledSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/api"
+        self.session = PooledSession(pool_size=4, timeout=(1, 2))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.session.adapter.close()
+
+    def test_sequential_requests_reuse_one_connection(self):
+        calls = 10
+        for i in range(calls):
+            if i % 2:
+                response = self.session.post(self.url, json={"page": i})
+            else:
+                response = self.session.get(self.url, params={"page": i})
+            self.assertEqual(response.json(), {"data": []})
+
+        summary, hosts_df = http_pool_stats(self.session)
+        self.assertEqual(summary["请求数"], calls)
+        self.assertEqual(summary["失败数"], 0)
+        self.assertEqual(summary["新建连接数"], 1)
+        self.assertEqual(len(hosts_df), 1)
+        self.assertEqual(int(hosts_df["请求数"].iloc[0]), calls)
+
+    def test_threads_share_pool_but_not_session_state(self):
+        sessions = []
+
+        def worker():
+            self.session.get(self.url)
+            sessions.append(self.session._thread_session())
+
+        threads = [threading.Thread(target=worker) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len({id(session) for session in sessions}), 3)
+        self.assertTrue(all(session.get_adapter(self.url) is self.session.adapter for session in sessions))
+        summary, _ = http_pool_stats(self.session)
+        self.assertEqual(summary["请求数"], 3)
+        self.assertLessEqual(summary["新建连接数"], 3)
+
+    def test_install_patches_only_target_package(self):
+        module = types.ModuleType("fake_upstream.stock")
+        module.requests = requests
+        sys.modules["fake_upstream.stock"] = module
+        try:
+            self.assertEqual(install_pooled_session(self.session, package="fake_upstream"), 1)
+            module.requests.get(self.url)
+            self.assertIs(module.requests.RequestException, requests.RequestException)
+        finally:
+            del sys.modules["fake_upstream.stock"]
+
+        self.assertTrue(callable(requests.get) and requests.get.__module__ == "requests.api")
+        summary, _ = http_pool_stats(self.session)
+        self.assertEqual(summary["请求数"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()